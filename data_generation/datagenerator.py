@@ -2,14 +2,20 @@
 from pathlib import Path
 from datetime import datetime
 import time
+import copy
 import json
+import multiprocessing
 import os
 import random
 import shutil
 
+import numpy as np
+
 # My modules
 import pattern.wrappers as pattern
+from pattern.shards import ShardWriter
 from customconfig import Properties
+import metrics
 
 
 def _create_data_folder(path, props):
@@ -20,6 +26,8 @@ def _create_data_folder(path, props):
         # => regenerating from existing data
         props['name'] = props['data_folder'] + '_regen'
         data_folder = props['name']
+    elif isinstance(props['templates'], list):
+        data_folder = props['name']  # templates are listed by subfolders
     else:
         data_folder = props['name'] + '_' + Path(props['templates']).stem
 
@@ -32,6 +40,257 @@ def _create_data_folder(path, props):
     return path_with_dataset
 
 
+def _template_jobs(path_with_dataset, templates_path, props):
+    """Templates of the dataset with their output folders & number of samples to generate: 
+        [{'name', 'entry', 'template', 'folder', 'size'}], where 'entry' is the template as listed in props
+        * Single template -- samples are saved to the dataset folder
+        * List of templates -- samples of each template are saved to the subfolder named after the template.
+            'size' is either the number of samples of every template or the list of per-template quotas
+    """
+    if not isinstance(props['templates'], list):
+        return [{
+            'name': Path(props['templates']).stem,
+            'entry': props['templates'],
+            'template': Path(templates_path) / props['templates'],
+            'folder': path_with_dataset,
+            'size': props['size']}]
+
+    templates = props['templates']
+    sizes = props['size'] if isinstance(props['size'], list) else [props['size']] * len(templates)
+    if len(sizes) != len(templates):
+        raise ValueError('Generator::Error::Got {} sizes for {} templates'.format(len(sizes), len(templates)))
+    names = [Path(template).stem for template in templates]
+    if len(set(names)) != len(names):
+        raise ValueError('Generator::Error::Template names should be unique to be used as subfolder names: {}'.format(names))
+
+    return [{
+        'name': name,
+        'entry': template,
+        'template': Path(templates_path) / template,
+        'folder': path_with_dataset / name,
+        'size': size} for name, template, size in zip(names, templates, sizes)]
+
+
+def _sample_seeds(base_seed, size):
+    """Independent random seeds of all the samples derived from the base seed, 
+        s.t. each sample is the same regardless of the process that generates it"""
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(base_seed).spawn(size)]
+
+
+class GenerationManifest(object):
+    """Append-only log of the completed samples of the dataset (generation_manifest.jsonl in the dataset folder):
+        one JSON line {'template', 'index', 'seed', 'sample', 'rejected'} per sample, where 'index' is the number of the sample 
+        among the samples of its template & 'rejected' is the number of designs rejected before it.
+        Samples are logged by the generating processes after their files are in place, 
+        so the log only lists the samples that are complete on disk. 
+        The log is synced to disk at the end of each chunk of samples & every sync_every records: 
+        records lost on system crash before the sync only make resume() re-generate their samples
+    """
+    filename = 'generation_manifest.jsonl'
+    sync_every = 100
+
+    def __init__(self, dataset_path):
+        self.path = Path(dataset_path) / self.filename
+        self.unsynced = 0  # records logged by this object since the last sync
+
+    def log(self, records, sync=False):
+        """Append records of completed samples
+            * sync -- force sync of the log to disk"""
+        self.unsynced += len(records)
+        sync = self.unsynced > 0 and (sync or self.unsynced >= self.sync_every)
+        if not records and not sync:
+            return
+        lines = ''.join([json.dumps(record) + '\n' for record in records])
+        # single write() with O_APPEND keeps the lines of different processes whole
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        try:
+            os.write(fd, lines.encode('utf-8'))
+            if sync:
+                os.fsync(fd)
+                self.unsynced = 0
+        finally:
+            os.close(fd)
+
+    def completed(self):
+        """Records of the completed samples {template name: {sample index: record}}.
+            The last line might be incomplete if the run was killed while logging -- such line is dropped"""
+        completed = {}
+        if not self.path.exists():
+            return completed
+        with open(self.path, 'r') as f_manifest:
+            content = f_manifest.read()
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print('GenerationManifest::Warning::Skipping incomplete record {}'.format(line))
+                continue
+            completed.setdefault(record['template'], {})[record['index']] = record
+        if content and not content.endswith('\n'):
+            # s.t. new records don't stick to the incomplete one
+            with open(self.path, 'a') as f_manifest:
+                f_manifest.write('\n')
+        return completed
+
+
+def _generate_samples(job, to_subfolders, spec_options, samples, shard_options=None, save_images=True, manifest=None):
+    """Generate & save samples of the template job (see _template_jobs()). Returns stats of the process
+        * samples -- list of (sample index, seed). None seeds continue the current state of random generator
+        * shard_options -- if given, samples are saved to shards (see pattern.shards.ShardWriter() for options)
+        * save_images -- draw pattern images with each sample. Otherwise only specifications are saved
+        * manifest -- GenerationManifest to log the completed samples to
+    """
+    start_time = time.time()
+    rejected = 0
+    shard = ShardWriter(job['folder'], **shard_options) if shard_options is not None else None
+    completed, logged_shards = [], 0
+    for index, seed in samples:
+        if seed is not None:
+            random.seed(seed)
+        with metrics.span('generator.sample'):
+            new_pattern = pattern.RandomPattern(job['template'])
+            rejected += new_pattern.rejected_designs
+            new_pattern.save_images = save_images
+            with metrics.span('generator.serialize'):
+                new_pattern.serialize(job['folder'], to_subfolder=to_subfolders, shard=shard, **spec_options)
+        completed.append({
+            'template': job['name'], 'index': index, 'seed': seed, 'sample': new_pattern.name, 
+            'rejected': new_pattern.rejected_designs})
+
+        # samples in a shard are complete only when the shard is closed
+        if manifest is not None and (shard is None or len(shard.shard_files) > logged_shards):
+            manifest.log(completed)
+            completed = []
+            logged_shards = len(shard.shard_files) if shard is not None else 0
+    if shard is not None:
+        shard.close()
+    if manifest is not None:
+        manifest.log(completed, sync=True)
+
+    return {
+        'pid': os.getpid(), 
+        'template': job['name'], 
+        'samples': len(samples), 
+        'rejected': rejected, 
+        'time': time.time() - start_time}
+
+
+def _init_worker(collect_metrics):
+    metrics.enable(collect_metrics)
+    metrics.reset()
+
+
+def _worker_generate_samples(args):
+    """_generate_samples() in a worker process. Metrics of the worker are returned with the stats"""
+    stats = _generate_samples(*args)
+    if metrics.enabled:
+        stats['metrics'] = metrics.aggregates()
+        metrics.reset()  # s.t. next chunk only reports its own records
+    return stats
+
+
+def _generate_parallel(jobs, job_seeds, to_subfolders, spec_options, num_workers, 
+                       shard_size=None, save_images=True, manifest=None, completed=None):
+    """Generate samples of all the template jobs (see _template_jobs()) in a single pool of num_workers processes. 
+        Every sample is generated with its own seed (job_seeds[i] are the seeds of jobs[i], see _sample_seeds()), 
+        so the dataset does not depend on the number of workers
+        * shard_size -- if given, each chunk is a shard, s.t. shards are also the same with any number of workers
+        * completed -- samples to skip, as given by GenerationManifest.completed()
+        Yields stats of each chunk of samples when it's completed"""
+    # small chunks to keep the workers evenly loaded
+    total_size = sum([len(seeds) for seeds in job_seeds])
+    chunk_size = shard_size if shard_size else max(1, total_size // (num_workers * 8))
+    chunks = []
+    for job, seeds in zip(jobs, job_seeds):
+        job_completed = completed[job['name']] if completed and job['name'] in completed else {}
+        for start in range(0, len(seeds), chunk_size):
+            indices = range(start, min(start + chunk_size, len(seeds)))
+            if all([idx in job_completed for idx in indices]):
+                continue
+            if not shard_size:  
+                indices = [idx for idx in indices if idx not in job_completed]
+            # else: unfinished shard is re-written as a whole
+            chunks.append((
+                job, to_subfolders, spec_options, 
+                [(idx, seeds[idx]) for idx in indices], 
+                {'samples_per_shard': shard_size, 'first_shard_id': start // chunk_size} if shard_size else None, 
+                save_images, manifest))
+
+    if num_workers == 1:
+        for chunk in chunks:
+            yield _generate_samples(*chunk)
+        return
+
+    with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(metrics.enabled, )) as pool:
+        for stats in pool.imap_unordered(_worker_generate_samples, chunks):
+            if 'metrics' in stats:
+                metrics.merge(stats.pop('metrics'))
+            yield stats
+
+
+def _sum_stats(chunk_stats, key):
+    """Total samples, rejected designs & time of chunks grouped by the given key of chunk stats"""
+    totals = {}
+    for stats in chunk_stats:
+        if stats[key] not in totals:
+            totals[stats[key]] = {'samples': 0, 'rejected': 0, 'time': 0}
+        for field in ['samples', 'rejected', 'time']:
+            totals[stats[key]][field] += stats[field]
+    return totals
+
+
+def _template_stats(totals):
+    """Loggable stats of generation from a template"""
+    return {
+        'samples': totals['samples'],
+        'rejected_designs': totals['rejected'],
+        'rejection_rate': totals['rejected'] / max(totals['rejected'] + totals['samples'], 1),
+        'time': f'{totals["time"]:.3f} s'
+    }
+
+
+def _run_stats(jobs, chunk_stats, elapsed, parallel):
+    """Stats of a single generation run (the first one or a resumed one) from the stats of its chunks"""
+    template_totals = _sum_stats(chunk_stats, 'template')
+    run = {
+        'samples': sum([stats['samples'] for stats in chunk_stats]),
+        'generation_time': elapsed,
+        'templates': {
+            job['name']: template_totals[job['name']] if job['name'] in template_totals 
+            else {'samples': 0, 'rejected': 0, 'time': 0} for job in jobs}
+    }
+    if parallel:
+        run['workers'] = {
+            f'worker_{idx}': {'samples': totals['samples'], 'time': totals['time']} 
+            for idx, (_, totals) in enumerate(sorted(_sum_stats(chunk_stats, 'pid').items()))
+        }
+    return run
+
+
+def _log_generation_stats(gen_stats, jobs, runs, completed=None):
+    """Stats of all the generation runs of the dataset: each run in 'runs' & totals over all of them
+        * completed -- if given, the samples & rejected designs of the templates are counted from 
+            the manifest records (see GenerationManifest.completed()) instead of the runs. Runs only log
+            their completed chunks, so the samples of the last chunks of interrupted run are only in the manifest
+    """
+    gen_stats['runs'] = runs
+    gen_stats['generation_time'] = f'{sum([run["generation_time"] for run in runs]):.3f} s'
+
+    template_totals = {}
+    for job in jobs:
+        template_totals[job['name']] = {
+            field: sum([run['templates'][job['name']][field] for run in runs if job['name'] in run['templates']]) 
+            for field in ['samples', 'rejected', 'time']}
+        if completed is not None:
+            records = completed[job['name']].values() if job['name'] in completed else []
+            template_totals[job['name']]['samples'] = len(records)
+            template_totals[job['name']]['rejected'] = sum([record.get('rejected', 0) for record in records])
+    if len(jobs) > 1:
+        gen_stats['templates'] = {job['name']: _template_stats(template_totals[job['name']]) for job in jobs}
+    else:
+        gen_stats['rejected_designs'] = template_totals[jobs[0]['name']]['rejected']
+
+
 def generate(path, templates_path, props):
     """Generates a synthetic dataset of patterns with given properties
         Params:
@@ -39,43 +298,173 @@ def generate(path, templates_path, props):
             templates_path : path to folder with pattern templates
             props : an instance of DatasetProperties class
                     requested properties of the dataset
+        Multiple templates:
+            'templates' could be a list of template files. Samples of each template are saved to the subfolder named after it,
+            with 'size' giving either the number of samples of every template or a list of per-template quotas. 
+            Each subfolder gets its own dataset_properties.json (usable as a single-template dataset, e.g. for simulation), 
+            while per-template stats are also collected in the properties of the whole dataset
+        Parallel generation:
+            'num_workers' in generator config enables generation in a pool of the given number of processes (all CPUs if <= 0).
+            In this mode every sample gets its own seed derived from 'random_seed', so the same dataset 
+            is produced with any number of workers. Samples of all templates are generated in the same pool.
+            Without 'num_workers' the samples are generated sequentially 
+            from a single global seed (as in datasets generated before)
+        Resuming:
+            Completed samples are logged to the manifest of the dataset (see GenerationManifest) & 
+            dataset_properties.json is saved before the generation starts and updated with the stats of the run 
+            after every completed chunk of samples. 
+            Interrupted generation is continued with resume() -- only for datasets generated with 'num_workers'. 
+            Stats of each run are kept in 'runs' of generator stats, with the totals over all the runs 
+            in 'generation_time', 'rejected_designs' & 'templates' 
+        Sharded output:
+            'shard_size' in generator config saves the samples into .tar shards of the given number of samples 
+            instead of a folder per sample (see pattern.shards). 
+            Use utility scripts/expand_shards.py to get the folder layout back (e.g. for simulation)
+        Deferred rendering:
+            'deferred_rendering' in generator config skips drawing of pattern images at generation time.
+            Draw them later with utility scripts/render_dataset.py (see pattern.wrappers.render_dataset())
         Not Implemented: 
-            * Generation from multiple template patterns
             * Physics simulation of garments
     """
     path = Path(path)
     gen_config = props['generator']['config']
-    gen_stats = props['generator']['stats']
-
-    if isinstance(props['templates'], list):
-        raise NotImplementedError('Generation from multiple templates is not supported')
-    template_file_path = Path(templates_path) / props['templates']
 
     # create data folder
     path_with_dataset = _create_data_folder(path, props)
 
-    # Copy template files with pattern for convernience 
-    template = pattern.VisPattern(template_file_path)
-    template.serialize(path_with_dataset, to_subfolder=False, tag='_template')
-
     # init random seed
     if 'random_seed' not in gen_config or gen_config['random_seed'] is None:
         gen_config['random_seed'] = int(time.time())
+
+    # log properties before the generation, s.t. interrupted run could be resumed
+    props.serialize(path_with_dataset / 'dataset_properties.json')
+
+    _generate_dataset(path_with_dataset, templates_path, props)
+
+
+def resume(path_with_dataset, templates_path):
+    """Continue interrupted generation of the dataset in the given folder 
+        with the properties of the dataset & skipping the samples completed according to its manifest.
+        The final dataset is the same as if the generation was not interrupted
+        Returns the updated dataset properties"""
+    path_with_dataset = Path(path_with_dataset)
+    props = Properties(path_with_dataset / 'dataset_properties.json')
+    gen_config = props['generator']['config']
+    if 'num_workers' not in gen_config or gen_config['num_workers'] is None:
+        raise ValueError(
+            'Generator::Error::Only datasets generated with per-sample seeds (num_workers option) could be resumed')
+
+    completed = GenerationManifest(path_with_dataset).completed()
+    jobs = _template_jobs(path_with_dataset, templates_path, props)
+    if all([job['name'] in completed and len(completed[job['name']]) >= job['size'] for job in jobs]):
+        # the run might have been killed before the final stats were logged
+        print('Generator::Info::All samples of {} are already completed, finalizing'.format(path_with_dataset))
+        metrics.reset()  # nothing is measured in this run
+        gen_stats = props['generator']['stats']
+        _finalize_dataset(path_with_dataset, props, jobs, list(gen_stats['runs']) if 'runs' in gen_stats else [], completed)
+        return props
+
+    _generate_dataset(path_with_dataset, templates_path, props)
+    return props
+
+
+def _generate_dataset(path_with_dataset, templates_path, props):
+    """Generate samples of the dataset that are not completed yet (all for a new dataset)"""
+    gen_config = props['generator']['config']
+    gen_stats = props['generator']['stats']
+    jobs = _template_jobs(path_with_dataset, templates_path, props)
+
+    # Copy template files with pattern for convernience 
+    for job in jobs:
+        job['folder'].mkdir(exist_ok=True)
+        template = pattern.VisPattern(job['template'])
+        template.serialize(job['folder'], to_subfolder=False, tag='_template')
+
     random.seed(gen_config['random_seed'])
 
+    manifest = GenerationManifest(path_with_dataset)
+    completed = manifest.completed()
+
+    # options of specification files, see pattern.core.BasicPattern.serialize()
+    spec_options = gen_config['spec_format'] if 'spec_format' in gen_config else {}
+
+    # optional instrumentation of the run, see metrics.py
+    metrics.enable('metrics' in gen_config and gen_config['metrics'])
+    metrics.reset()
+
+    # stats of earlier runs of the dataset (if resumed)
+    runs = list(gen_stats['runs']) if 'runs' in gen_stats else []
+
     # generate data
     start_time = time.time()
-    for _ in range(props['size']):
-        new_pattern = pattern.RandomPattern(template_file_path)
-        new_pattern.serialize(path_with_dataset, 
-                              to_subfolder=props['to_subfolders'])
-    elapsed = time.time() - start_time
-    gen_stats['generation_time'] = f'{elapsed:.3f} s'
+    shard_size = gen_config['shard_size'] if 'shard_size' in gen_config else None
+    save_images = not ('deferred_rendering' in gen_config and gen_config['deferred_rendering'])
+    parallel = 'num_workers' in gen_config and gen_config['num_workers'] is not None
+    if parallel:
+        num_workers = gen_config['num_workers'] if gen_config['num_workers'] > 0 else os.cpu_count()
+        job_seeds = []
+        for idx, job in enumerate(jobs):
+            # seeds of each template don't depend on other templates & their quotas
+            base_seed = [gen_config['random_seed'], idx] if len(jobs) > 1 else gen_config['random_seed']
+            job_seeds.append(_sample_seeds(base_seed, job['size']))
+            if job['name'] in completed:
+                _check_completed(job, job_seeds[-1], completed[job['name']])
+        chunks = _generate_parallel(
+            jobs, job_seeds, props['to_subfolders'], spec_options, num_workers, shard_size, save_images, 
+            manifest, completed)
+    else:
+        chunks = (
+            _generate_samples(job, props['to_subfolders'], spec_options, [(idx, None) for idx in range(job['size'])], 
+                              {'samples_per_shard': shard_size} if shard_size else None, save_images, manifest)
+            for job in jobs)
+
+    chunk_stats = []
+    for stats in chunks:
+        chunk_stats.append(stats)
+        # progress is logged s.t. stats of interrupted run are not lost
+        _log_generation_stats(gen_stats, jobs, runs + [_run_stats(jobs, chunk_stats, time.time() - start_time, parallel)])
+        metrics.to_props(props, 'generator')  # summed with the metrics of earlier runs
+        props.serialize(path_with_dataset / 'dataset_properties.json')
+
+    _finalize_dataset(
+        path_with_dataset, props, jobs, runs + [_run_stats(jobs, chunk_stats, time.time() - start_time, parallel)], 
+        manifest.completed())
+
+
+def _finalize_dataset(path_with_dataset, props, jobs, runs, completed):
+    """Final stats of the dataset with all the samples completed (see _log_generation_stats()), 
+        properties of template subfolders & metrics of the run"""
+    gen_stats = props['generator']['stats']
+    _log_generation_stats(gen_stats, jobs, runs, completed)
+    if len(jobs) > 1:
+        for job in jobs:
+            _serialize_template_props(props, job, gen_stats['templates'][job['name']])
+    metrics.to_props(props, 'generator')
 
     # log properties
     props.serialize(path_with_dataset / 'dataset_properties.json')
 
 
+def _check_completed(job, seeds, completed):
+    """Check that the completed samples of the job match the seeds of the current dataset properties"""
+    for index, record in completed.items():
+        if index >= len(seeds) or record['seed'] != seeds[index]:
+            raise ValueError(
+                'Generator::Error::Sample {} of {} in the manifest does not match the dataset properties'.format(
+                    record['sample'], job['name']))
+
+
+def _serialize_template_props(props, job, template_stats):
+    """Properties of the template subfolder of the multi-template dataset s.t. 
+        it could be used as a single-template dataset"""
+    template_props = copy.deepcopy(props)
+    template_props['templates'] = job['entry']
+    template_props['size'] = job['size']
+    template_props['data_folder'] = props['data_folder'] + '/' + job['name']
+    template_props['generator']['stats'] = dict(template_stats)
+    template_props.serialize(job['folder'] / 'dataset_properties.json')
+
+
 # ------------------ MAIN ------------------------
 if __name__ == "__main__":
     
@@ -4,6 +4,7 @@
 
 from datetime import timedelta
 import json
+import os
 import yaml
 from numbers import Number
 import traceback
@@ -42,14 +43,17 @@ class Properties():
     def serialize(self, filename, backup=None):
         """Log current props to file. If logging failed, at least restore provided backup or originally loaded props
             * backup is expected to be a Properties object
+            The file is written to a temporary location first & moved in place, 
+            s.t. interruption of the write does not corrupt existing file
         """
+        tmp_filename = str(filename) + '.tmp'
         try:
             extention = Path(filename).suffix.lower()
             if extention == '.json':
-                with open(filename, 'w') as f_json:
+                with open(tmp_filename, 'w') as f_json:
                     json.dump(self.properties, f_json, indent=2, sort_keys=True)
             elif extention == '.yaml':
-                with open(filename, 'w') as f:
+                with open(tmp_filename, 'w') as f:
                     yaml.dump(
                         self.properties, 
                         f,
@@ -58,10 +62,13 @@ class Properties():
                     )
             else:
                 raise ValueError(f'{self.__class__.__name__}::ERROR::Unsupported file type on serialization: {extention}')
+            os.replace(tmp_filename, filename)
             
         except Exception as e:
             print('Exception occured while saving properties:')
             traceback.print_exception(*sys.exc_info()) 
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
             # save backup, s.t. the data is not lost due to interruption of the file override
 
             if backup is not None: 
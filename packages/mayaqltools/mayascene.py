@@ -3,7 +3,6 @@
 """
 # Basic
 from functools import partial
-import copy
 import errno
 import numpy as np
 import os
@@ -1096,27 +1095,18 @@ class MayaGarmentWithUI(MayaGarment):
     def _param_value_callback(self, param_name, value_idx, value_field, *args):
         """Update pattern with new value"""
         # in case the try failes
-        spec_backup = copy.deepcopy(self.spec)
         if isinstance(self.parameters[param_name]['value'], list):
             old_value = self.parameters[param_name]['value'][value_idx]
         else:
+            value_idx = None
             old_value = self.parameters[param_name]['value']
 
-        # restore template state -- params are interdependent
-        # change cannot be applied independently by but should follow specified param order
-        self._restore_template(params_to_default=False)
-
         # get value
         new_value = args[0]
-        # save new value. No need to check ranges -- correct by UI
-        if isinstance(self.parameters[param_name]['value'], list):
-            self.parameters[param_name]['value'][value_idx] = new_value
-        else:
-            self.parameters[param_name]['value'] = new_value
-        
-        # reapply all parameters
-        self._update_pattern_by_param_values()
-        if self.is_self_intersecting():
+        # save new value & re-evaluate dependent panels. No need to check ranges -- correct by UI
+        # NOTE params are interdependent, hence the panels are re-evaluated from template state following the param order
+        updated_panels = self.update_parameter(param_name, new_value, value_idx)
+        if self.is_self_intersecting(updated_panels):
             result = cmds.confirmDialog( 
                 title='Restore from broken state', 
                 message=('Warning: Some of the panels contain intersected edges after applying value {} to {}.' 
@@ -1125,7 +1115,7 @@ class MayaGarmentWithUI(MayaGarment):
                 button=['Yes', 'No'], 
                 defaultButton='Yes', cancelButton='No', dismissString='No')
             if result == 'Yes':
-                self._restore(spec_backup)
+                self.update_parameter(param_name, old_value, value_idx)
                 cmds.floatSliderGrp(value_field, edit=True, value=old_value)
                 return  # No need to reload geometry -- nothing changed
 
@@ -12,6 +12,9 @@ import sys
 from maya import mel
 from maya import cmds
 
+# My
+import metrics
+
 
 def load_plugin():
     """
@@ -121,29 +124,37 @@ def run_sim(garment, props):
     # Allow to assemble without gravity + skip checks for first few frames
     print('Simulating {}'.format(garment.name))
     _set_gravity(solver, 0)
+    frame = 0
     for frame in range(1, config['zero_gravity_steps']):
-        cmds.currentTime(frame)  # step
-        garment.cache_if_enabled(frame)
-        garment.update_verts_info()
-        _update_progress(frame, config['max_sim_steps'])  # progress bar
+        with metrics.span('qualoth.frame'):
+            cmds.currentTime(frame)  # step
+            garment.cache_if_enabled(frame)
+            garment.update_verts_info()
+        _update_progress(frame + 1, config['max_sim_steps'])  # progress bar
 
     # resume normally
     _set_gravity(solver, -980)
     for frame in range(config['zero_gravity_steps'], config['max_sim_steps']):
-        cmds.currentTime(frame)  # step
-        garment.cache_if_enabled(frame)
-        garment.update_verts_info()
-
-        _update_progress(frame, config['max_sim_steps'])  # progress bar
-        static, non_st_count = garment.is_static(config['static_threshold'], config['non_static_percent'])
+        with metrics.span('qualoth.frame'):
+            cmds.currentTime(frame)  # step
+            garment.cache_if_enabled(frame)
+            garment.update_verts_info()
+
+        _update_progress(frame + 1, config['max_sim_steps'])  # progress bar
+        with metrics.span('qualoth.static_check'):
+            static, non_st_count = garment.is_static(config['static_threshold'], config['non_static_percent'])
         if static:  # Success!
+            _update_progress(frame + 1, config['max_sim_steps'], force=True)
             print('\nAchieved static equilibrium for {}'.format(garment.name))
             break
+    else:
+        _update_progress(frame + 1, config['max_sim_steps'], force=True)  # final state of the bar
 
     # stats
     props['stats']['sim_time'][garment.name] = time.time() - start_time
     props['stats']['spf'][garment.name] = props['stats']['sim_time'][garment.name] / frame
     props['stats']['fin_frame'][garment.name] = frame
+    metrics.count('qualoth.frames', frame)
 
     # Fail checks
     # static equilibrium never detected -- might have false negs!
@@ -377,17 +388,23 @@ def _set_gravity(solver, gravity):
     cmds.setAttr(solver + '.gravity1', gravity)
 
 
-def _update_progress(progress, total):
-    """Progress bar in console"""
+def _update_progress(progress, total, force=False):
+    """Progress bar in console. Only re-drawn when the bar changes (and on the last step), not on every step
+        * progress -- number of completed steps
+        * force -- re-draw anyway (e.g. to show the final state when the run stops early)"""
     # https://stackoverflow.com/questions/3173320/text-progress-bar-in-the-console
-    amtDone = progress / total
+    last_step = progress >= total
+    amtDone = min(progress / total, 1.)
     num_dash = int(amtDone * 50)
+    if not force and progress > 1 and not last_step and int((progress - 1) / total * 50) == num_dash:
+        return
     sys.stdout.write('\rProgress: [{0:50s}] {1:.1f}%'.format('#' * num_dash + '-' * (50 - num_dash), amtDone * 100))
     sys.stdout.flush()
 
 
 def _record_fail(props, fail_type, garment_name):
     """add a failure recording to props. Creates nodes if don't exist"""
+    metrics.count('sim.fails.' + fail_type)
     if 'fails' not in props['stats']:
         props['stats']['fails'] = {}
     try:
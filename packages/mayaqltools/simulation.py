@@ -8,7 +8,10 @@ import os
 from maya import cmds
 
 # My modules
+import metrics
 from pattern.core import BasicPattern
+from pattern.body import BodyScreen
+from pattern import shards
 import mayaqltools as mymaya
 from mayaqltools import qualothwrapper as qw
 
@@ -79,13 +82,24 @@ def batch_sim(resources, data_path, dataset_props,
 
     resume = init_sim_props(dataset_props, batch_run=True, force_restart=force_restart)
 
+    # optional instrumentation of the run, see metrics.py
+    metrics.enable('metrics' in dataset_props['sim']['config'] and dataset_props['sim']['config']['metrics'])
+    metrics.reset()
+
     qw.load_plugin()
     scene = mymaya.Scene(
         os.path.join(resources['bodies_path'], dataset_props['body']),
         dataset_props['render'], 
         scenes_path=resources['scenes_path'])
     
+    # optional check of panel placement against the body before loading to Maya
+    body_screen = _body_screen(
+        os.path.join(resources['bodies_path'], dataset_props['body']), dataset_props['sim']['config'], data_path)
+    
     pattern_specs = _get_pattern_files(data_path, dataset_props)
+    if not pattern_specs and shards.is_sharded(data_path):
+        raise RuntimeError(
+            'Simulation::Error::Dataset {} is sharded. Expand it with utility scripts/expand_shards.py first'.format(data_path))
     data_props_file = os.path.join(data_path, 'dataset_properties.json')
 
     # Simulate every template
@@ -101,12 +115,14 @@ def batch_sim(resources, data_path, dataset_props,
         dataset_props['sim']['stats']['processed'].append(pattern_name)
         _serialize_props_with_sim_stats(dataset_props, data_props_file)  # save info of processed files before potential crash
 
-        template_simulation(pattern_spec_norm, 
-                            scene, 
-                            dataset_props['sim'], 
-                            delete_on_clean=True,  # delete geometry after sim as we don't need it any more
-                            caching=caching, 
-                            save_maya_scene=False)
+        with metrics.span('sim.sample'):
+            template_simulation(pattern_spec_norm, 
+                                scene, 
+                                dataset_props['sim'], 
+                                delete_on_clean=True,  # delete geometry after sim as we don't need it any more
+                                caching=caching, 
+                                save_maya_scene=False, 
+                                body_screen=body_screen)
         
         if pattern_name in dataset_props['sim']['stats']['fails']['crashes']:
             # if we successfully finished simulating crashed example -- it's not a crash any more!
@@ -185,13 +201,15 @@ def init_sim_props(props, batch_run=False, force_restart=False):
     # else new life
     # Prepare commulative stats
     props.set_section_stats('sim', fails={}, sim_time={}, spf={}, fin_frame={})
+    props['sim']['stats'].pop('metrics', None)  # metrics are summed over the runs of the same processing only
     props['sim']['stats']['fails'] = {
         'crashes': [],
         'intersect_colliders': [],
         'intersect_self': [],
         'static_equilibrium': [],
         'fast_finish': [],
-        'pattern_loading': []
+        'pattern_loading': [],
+        'body_penetration': []
     }
 
     props.set_section_stats('render', render_time={})
@@ -202,30 +220,48 @@ def init_sim_props(props, batch_run=False, force_restart=False):
     return False
         
 
-def template_simulation(spec, scene, sim_props, delete_on_clean=False, caching=False, save_maya_scene=False):
+def template_simulation(spec, scene, sim_props, delete_on_clean=False, caching=False, save_maya_scene=False, body_screen=None):
     """
         Simulate given template within given scene & save log files
+        * body_screen -- (optional) BodyScreen of the scene body. If given, patterns with panels placed through the body 
+            are recorded as fails and skipped without simulation
     """
     print('\nGarment load')
-    garment = mymaya.MayaGarment(spec)
+    with metrics.span('sim.garment_load'):
+        garment = mymaya.MayaGarment(spec)
+    if body_screen is not None:
+        with metrics.span('sim.body_prescreen'):
+            penetrating = body_screen.penetrating_panels(garment)
+        if penetrating:
+            print('Garment {} is skipped: panels {} are placed through the body'.format(garment.name, penetrating))
+            if 'body_penetration' not in sim_props['stats']['fails']:  # datasets started before the check was added
+                sim_props['stats']['fails']['body_penetration'] = []
+            sim_props['stats']['fails']['body_penetration'].append(garment.name)
+            metrics.count('sim.fails.body_penetration')
+            return
     try:
-        garment.load(
-            shader_group=scene.cloth_SG(), 
-            obstacles=[scene.body],  # I don't add floor s.t. garment falls infinitely if falls
-            config=sim_props['config']
-        )
+        with metrics.span('sim.maya_load'):
+            garment.load(
+                shader_group=scene.cloth_SG(), 
+                obstacles=[scene.body],  # I don't add floor s.t. garment falls infinitely if falls
+                config=sim_props['config']
+            )
     except mymaya.PatternLoadingError as e:
         # record error and skip subequent processing
         sim_props['stats']['fails']['pattern_loading'].append(garment.name)
+        metrics.count('sim.fails.pattern_loading')
     else:
         # garment.save_mesh(tag='stitched')  # Saving the geometry before eny forces were applied
         garment.sim_caching(caching)
 
-        qw.run_sim(garment, sim_props)
+        with metrics.span('sim.simulate'):
+            qw.run_sim(garment, sim_props)
 
         # save even if sim failed -- to see what happened!
-        garment.save_mesh(tag='sim')
-        scene.render(garment.path, garment.name)
+        with metrics.span('sim.save_mesh'):
+            garment.save_mesh(tag='sim')
+        with metrics.span('sim.render'):
+            scene.render(garment.path, garment.name)
         if save_maya_scene:
             # save current Maya scene
             cmds.file(rename=os.path.join(garment.path, garment.name + '_scene'))
@@ -237,9 +273,29 @@ def template_simulation(spec, scene, sim_props, delete_on_clean=False, caching=F
 def _serialize_props_with_sim_stats(dataset_props, filename):
     """Compute data processing statistics and serialize props to file"""
     dataset_props.stats_summary()
+    metrics.to_props(dataset_props, 'sim')
     dataset_props.serialize(filename)
 
 
+def _body_screen(body_file, sim_config, data_path):
+    """BodyScreen for the check of initial panel placement if enabled in sim config 
+        ('body_prescreen' is true or a dict of BodyScreen tolerances).
+        The check is disabled if the template of the dataset does not pass it at default parameters"""
+    if not ('body_prescreen' in sim_config and sim_config['body_prescreen']):
+        return None
+    options = sim_config['body_prescreen'] if isinstance(sim_config['body_prescreen'], dict) else {}
+    body_screen = BodyScreen(body_file, **options)
+
+    for file in os.listdir(data_path):
+        if file.endswith('_template_specification.json'):
+            penetrating = body_screen.penetrating_panels(BasicPattern(os.path.join(data_path, file)))
+            if penetrating:
+                print('Simulation::Warning::Panels {} of {} are placed through the body at default parameters. '
+                      'Body prescreen is disabled'.format(penetrating, file))
+                return None
+    return body_screen
+
+
 def _get_pattern_files(data_path, dataset_props):
     """ Collects paths to all the pattern files in given folder"""
 
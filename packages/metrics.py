@@ -0,0 +1,164 @@
+"""
+    Lightweight instrumentation of the pattern & simulation pipeline: counters, timers and spans
+
+    Disabled by default -- every call returns immediately without recording anything,
+    so the call sites can stay in the hot loops.
+    Enabled per run (e.g. with 'metrics' option of generator or sim config) and dumped
+    into the stats of a Properties section as 'metrics' (see to_props()), 
+    summed with the metrics of earlier runs of the same processing (e.g. interrupted & resumed)
+
+    Usage:
+        metrics.count('pattern.randomize.retries')
+        with metrics.span('sim.render'):
+            ...
+    Spans opened inside other spans are recorded under nested names, e.g. 'generator.sample/pattern.randomize'
+"""
+
+import time
+
+enabled = False
+
+_counters = {}
+_timers = {}  # name -> [count, total, min, max] (seconds)
+_span_stack = []
+_earlier_runs = {}  # section -> aggregates of earlier runs logged in the section, see to_props()
+
+
+def enable(on=True):
+    """Turn recording on/off. Recorded values are kept until reset()"""
+    global enabled
+    enabled = on
+
+
+def reset():
+    """Remove all recorded values"""
+    _counters.clear()
+    _timers.clear()
+    del _span_stack[:]
+    _earlier_runs.clear()
+
+
+# ------ Recording ------
+def count(name, value=1):
+    """Add value to the counter"""
+    if not enabled:
+        return
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def record_time(name, seconds):
+    """Add a timing sample to the timer"""
+    if not enabled:
+        return
+    timer = _timers.get(name)
+    if timer is None:
+        _timers[name] = [1, seconds, seconds, seconds]
+    else:
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = min(timer[2], seconds)
+        timer[3] = max(timer[3], seconds)
+
+
+class _Span(object):
+    """Times the enclosed block and records it under the name nested in the enclosing spans"""
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _span_stack.append(self.name)
+        self.full_name = '/'.join(_span_stack)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_time(self.full_name, time.perf_counter() - self.start)
+        _span_stack.pop()
+        return False
+
+
+class _NullSpan(object):
+    """Span of disabled metrics"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(name):
+    """Context manager that records the time of the enclosed block"""
+    if not enabled:
+        return _null_span
+    return _Span(name)
+
+
+# ------ Aggregates ------
+def aggregates():
+    """Recorded values as JSON-friendly dict"""
+    return {
+        'counters': dict(_counters),
+        'timers': {
+            name: {
+                'count': timer[0],
+                'total': timer[1],
+                'avg': timer[1] / timer[0],
+                'min': timer[2],
+                'max': timer[3]
+            } for name, timer in _timers.items()
+        }
+    }
+
+
+def merge(other):
+    """Add aggregates() of another run (e.g. of a worker process) to the recorded values.
+        Works even if recording is disabled"""
+    for name, value in other['counters'].items():
+        _counters[name] = _counters.get(name, 0) + value
+    for name, other_timer in other['timers'].items():
+        timer = _timers.get(name)
+        if timer is None:
+            _timers[name] = [other_timer['count'], other_timer['total'], other_timer['min'], other_timer['max']]
+        else:
+            timer[0] += other_timer['count']
+            timer[1] += other_timer['total']
+            timer[2] = min(timer[2], other_timer['min'])
+            timer[3] = max(timer[3], other_timer['max'])
+
+
+def combine(first, second):
+    """Sum of two aggregates() dicts (e.g. of different runs)"""
+    counters = dict(first['counters'])
+    for name, value in second['counters'].items():
+        counters[name] = counters.get(name, 0) + value
+    timers = {name: dict(timer) for name, timer in first['timers'].items()}
+    for name, other_timer in second['timers'].items():
+        timer = timers.get(name)
+        if timer is None:
+            timers[name] = dict(other_timer)
+        else:
+            timer['count'] += other_timer['count']
+            timer['total'] += other_timer['total']
+            timer['avg'] = timer['total'] / timer['count']
+            timer['min'] = min(timer['min'], other_timer['min'])
+            timer['max'] = max(timer['max'], other_timer['max'])
+    return {'counters': counters, 'timers': timers}
+
+
+def to_props(props, section):
+    """Log aggregates of the current run to the stats of the section of customconfig.Properties object
+        (nothing is logged if there are no records). 
+        Metrics found in the section at the first call after reset() belong to the earlier runs 
+        (e.g. before the processing was resumed), and the current run is added to them. 
+        Hence the call could be repeated to log the progress of the run"""
+    if section not in _earlier_runs:
+        stats = props[section]['stats'] if section in props and 'stats' in props[section] else {}
+        _earlier_runs[section] = stats['metrics'] if 'metrics' in stats else None
+    if _counters or _timers:
+        current = aggregates()
+        if _earlier_runs[section] is not None:
+            current = combine(_earlier_runs[section], current)
+        props.set_section_stats(section, metrics=current)
@@ -0,0 +1,97 @@
+"""
+    Vectorized routines for quadratic Bezier edges of sewing patterns
+
+    Curvy edges are defined by their endpoints and by the Bezier control point given in relative coordinates of the edge
+    ('curvature' in pattern spec, see BasicPattern._control_to_abs_coord()).
+    All the routines work on arrays of edges of any shape (..., 2), e.g. all edges of a pattern or of a batch of patterns,
+    so that edges are processed in one array operation instead of per-edge calls
+"""
+import numpy as np
+
+
+def control_points(starts, ends, curvatures):
+    """Absolute coordinates of Bezier control points of the edges"""
+    edges = ends - starts
+    perps = np.stack([-edges[..., 1], edges[..., 0]], axis=-1)
+    return starts + curvatures[..., 0:1] * edges + curvatures[..., 1:2] * perps
+
+
+def curve_points(starts, ends, curvatures, t):
+    """Points on the edges for the array of curve parameter values t.
+        Returns array of shape (..., len(t), 2)"""
+    controls = control_points(starts, ends, curvatures)
+
+    t = np.asarray(t, dtype=float)[:, None]
+    return ((1 - t) ** 2 * starts[..., None, :] + 2 * (1 - t) * t * controls[..., None, :] + t ** 2 * ends[..., None, :])
+
+
+def sample(starts, ends, curvatures, num_samples=10):
+    """Edges as polylines of num_samples segments (uniform in curve parameter), including both endpoints
+        Returns
+            * polyline points of shape (..., num_samples + 1, 2)
+            * cumulative length of polylines at each point (..., num_samples + 1), starting from zero.
+                The last value is the approximate arc length of the edge
+    """
+    points = curve_points(starts, ends, curvatures, np.linspace(0, 1, num_samples + 1))
+
+    segment_lengths = np.linalg.norm(np.diff(points, axis=-2), axis=-1)
+    arc_lengths = np.zeros(points.shape[:-1])
+    arc_lengths[..., 1:] = np.cumsum(segment_lengths, axis=-1)
+    return points, arc_lengths
+
+
+def sample_edge_tensors(edge_tensor, num_samples=10):
+    """Polylines (see sample()) for the edges given as vectors with curvatures
+        (as panels in BasicPattern.pattern_as_tensors()) of shape (..., num_edges, 4).
+        Each edge loop starts at the origin. Padding edges are sampled as zero-length polylines
+    """
+    edge_tensor = np.asarray(edge_tensor, dtype=float)
+    ends = np.cumsum(edge_tensor[..., :2], axis=-2)
+    starts = ends - edge_tensor[..., :2]
+    return sample(starts, ends, edge_tensor[..., 2:], num_samples)
+
+
+# Gauss-Legendre nodes & weights on [0, 1] per quadrature order
+_quadratures = {}
+
+
+def _quadrature(order):
+    if order not in _quadratures:
+        nodes, weights = np.polynomial.legendre.leggauss(order)
+        _quadratures[order] = ((nodes + 1) / 2, weights / 2)
+    return _quadratures[order]
+
+
+def arc_lengths(starts, ends, curvatures, order=16):
+    """Arc lengths of the edges evaluated with Gauss-Legendre quadrature of given order
+        Returns array of shape (...)
+        * Curve is split at the point of its minimal speed (that's where the integrand is the least smooth), 
+            and each part is integrated separately
+        NOTE quadrature is exact for straight edges, and precise to ~1e-10 relative error for curvatures of the usual patterns 
+            (~1e-6 for extreme ones with control point far outside of the edge)
+    """
+    controls = control_points(starts, ends, curvatures)
+    nodes, weights = _quadrature(order)
+
+    # derivative of quadratic Bezier curve: 2 * (first + t * second)
+    first = controls - starts
+    second = ends - 2 * controls + starts
+    second_sq = (second * second).sum(axis=-1)
+    split = -(first * second).sum(axis=-1) / np.where(second_sq > 0, second_sq, 1)
+    split = np.clip(np.where(second_sq > 0, split, 0), 0, 1)
+
+    lengths = np.zeros(split.shape)
+    for low, high in [(np.zeros_like(split), split), (split, np.ones_like(split))]:
+        t = low[..., None] + (high - low)[..., None] * nodes  # (..., order)
+        derivatives = 2 * (first[..., None, :] + t[..., None] * second[..., None, :])
+        lengths += (np.sqrt((derivatives * derivatives).sum(axis=-1)) * weights).sum(axis=-1) * (high - low)
+    return lengths
+
+
+def arc_lengths_edge_tensors(edge_tensor, order=16):
+    """Arc lengths of the edges given as vectors with curvatures (as in sample_edge_tensors()) 
+        Returns array of shape (..., num_edges), zeros for padding edges
+    """
+    edge_tensor = np.asarray(edge_tensor, dtype=float)
+    ends = edge_tensor[..., :2]
+    return arc_lengths(np.zeros_like(ends), ends, edge_tensor[..., 2:], order)
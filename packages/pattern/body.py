@@ -0,0 +1,250 @@
+"""
+    Body mesh tools that don't need Maya:
+    pre-simulation screening of patterns for panels placed through the body
+"""
+import numpy as np
+
+# my
+from pattern import rotation as rotation_tools
+
+
+def load_obj(filepath):
+    """Vertices (N, 3) & triangle faces (M, 3) (as vertex ids) of the mesh in .obj file.
+        Polygonal faces are triangulated as fans"""
+    vertices, faces = [], []
+    with open(filepath, 'r') as f:
+        for line in f:
+            if line.startswith('v '):
+                vertices.append([float(value) for value in line.split()[1:4]])
+            elif line.startswith('f '):
+                # 'v', 'v/vt', 'v//vn' or 'v/vt/vn' with 1-based (or negative) vertex ids
+                face = [int(token.split('/')[0]) for token in line.split()[1:]]
+                face = [vert_id - 1 if vert_id > 0 else len(vertices) + vert_id for vert_id in face]
+                for idx in range(1, len(face) - 1):
+                    faces.append([face[0], face[idx], face[idx + 1]])
+    return np.array(vertices, dtype=float).reshape(-1, 3), np.array(faces, dtype=int).reshape(-1, 3)
+
+
+class BodyScreen(object):
+    """
+        Check of the initial 3D placement of pattern panels against the body mesh before simulation:
+        panels that cross the body surface make the garment intersect the body (collider) after simulation,
+        so such samples could be skipped without loading them to Maya
+
+        * Panels that only touch the body are allowed: the panel is reported if the part of it deeper than 
+            min_depth (cm) inside the body covers more than min_area (fraction) of the panel area. 
+            Default tolerances are set s.t. all the templates of data_generation/Patterns pass at default parameters
+            on the shipped bodies (hoods are placed partially inside the body by design) 
+        * Body is loaded once and scaled to cm the same way Maya scene does it (see mayaqltools.utils.scale_to_cm())
+        * Body triangles are indexed with uniform grid for fast look-up of the triangles close to each panel
+        * Panels are checked as flat polygons with curved edges sampled (see BasicPattern.panel_outlines_3D())
+    """
+    def __init__(self, body_file, cell_size=None, curve_samples=10, max_height_cm=220, 
+                 min_depth=2., min_area=0.3, area_step=1.):
+        self.body_file = body_file
+        self.curve_samples = curve_samples
+        self.min_depth = min_depth
+        self.min_area = min_area
+        self.area_step = area_step  # cm between the samples of panel area
+
+        vertices, self.faces = load_obj(body_file)
+        self.vertices = self._scale_to_cm(vertices, max_height_cm)
+        self.triangles = self.vertices[self.faces]  # (num_faces, 3, 3)
+
+        if cell_size is None:  # a few triangles per cell
+            cell_size = 2 * np.linalg.norm(self.triangles[:, 1] - self.triangles[:, 0], axis=-1).mean()
+        self.cell_size = cell_size
+        self._build_grid()
+
+    # -------- Checks --------
+    def penetrating_panels(self, pattern):
+        """Names of the panels of the pattern that are placed through the body in their initial 3D placement 
+            (deeper than the tolerances allow)"""
+        panel_names = list(pattern.pattern['panels'].keys())
+        points_2D, counts = pattern._outline_points(panel_names, self.curve_samples, local=True)
+        points_3D, _ = pattern._outline_points(panel_names, self.curve_samples)
+        rotations = rotation_tools.euler_xyz_to_R_batch([pattern.pattern['panels'][name]['rotation'] for name in panel_names])
+        translations = np.array([pattern.pattern['panels'][name]['translation'] for name in panel_names], dtype=float)
+
+        splits = np.cumsum(counts)[:-1]
+        penetrating = []
+        for name, outline_2D, outline_3D, rotation, translation in zip(
+                panel_names, np.split(points_2D, splits), np.split(points_3D, splits), rotations, translations):
+            triangles = self.triangles[self._triangles_in_box(outline_3D.min(axis=0), outline_3D.max(axis=0))]
+            if not len(triangles):
+                continue
+            if ((self._triangle_edges_through_panel(triangles, outline_2D, rotation, translation)
+                    or self._outline_through_triangles(outline_3D, triangles))
+                    and self.deep_area(outline_2D, rotation, translation) > self.min_area):
+                penetrating.append(name)
+        return penetrating
+
+    def deep_area(self, outline_2D, rotation, translation):
+        """Fraction of the area of the panel that is deeper than min_depth inside the body.
+            Area is sampled with the grid of area_step, depth is measured to the closest body vertex"""
+        box_min, box_max = outline_2D.min(axis=0), outline_2D.max(axis=0)
+        grid = np.stack(np.meshgrid(
+            np.arange(box_min[0], box_max[0], self.area_step) + self.area_step / 2, 
+            np.arange(box_min[1], box_max[1], self.area_step) + self.area_step / 2), axis=-1).reshape(-1, 2)
+        grid = grid[_points_in_polygon(grid, outline_2D)]
+        if not len(grid):  # very small panel
+            grid = outline_2D
+        points = np.matmul(np.pad(grid, ((0, 0), (0, 1))), rotation.T) + translation
+
+        # points outside the body box are outside the body
+        candidates = np.all(points > self.vertices.min(axis=0) + self.min_depth, axis=1) & np.all(
+            points < self.vertices.max(axis=0) - self.min_depth, axis=1)
+        candidates[candidates] = self._inside(points[candidates])
+        candidates[candidates] = self._closest_vertex_distance(points[candidates]) > self.min_depth
+
+        return np.count_nonzero(candidates) / len(points)
+
+    def is_penetrating(self, pattern):
+        """Check if any panel of the pattern crosses the body surface in its initial 3D placement"""
+        return len(self.penetrating_panels(pattern)) > 0
+
+    # -------- Utils --------
+    @staticmethod
+    def _scale_to_cm(vertices, max_height_cm):
+        """Same heuristics as mayaqltools.utils.scale_to_cm():
+            detect units by body height & scale around the center of the bounding box"""
+        bbox_min, bbox_max = vertices.min(axis=0), vertices.max(axis=0)
+        height = bbox_max[1] - bbox_min[1]
+        if height < max_height_cm * 0.01:  # meters
+            scale = 100
+        elif height > max_height_cm:  # millimiters or something strange
+            scale = 0.1
+        else:
+            return vertices
+        center = (bbox_min + bbox_max) / 2
+        return center + scale * (vertices - center)
+
+    def _build_grid(self):
+        """Uniform grid over body bounding box: sorted list of (cell, triangle) pairs for all cells overlapped by
+            bounding boxes of triangles"""
+        self.grid_origin = self.vertices.min(axis=0)
+        self.grid_shape = (np.floor((self.vertices.max(axis=0) - self.grid_origin) / self.cell_size)).astype(int) + 1
+
+        cell_min = self._cell_coords(self.triangles.min(axis=1))
+        cell_max = self._cell_coords(self.triangles.max(axis=1))
+        max_span = (cell_max - cell_min).max(axis=0) + 1
+
+        cells, triangle_ids = [], []
+        all_ids = np.arange(len(self.triangles))
+        for offset in np.ndindex(*max_span):
+            coords = cell_min + offset
+            in_box = np.all(coords <= cell_max, axis=1)
+            cells.append(np.ravel_multi_index(coords[in_box].T, self.grid_shape))
+            triangle_ids.append(all_ids[in_box])
+        cells, triangle_ids = np.concatenate(cells), np.concatenate(triangle_ids)
+
+        order = np.argsort(cells, kind='stable')
+        self.cell_keys = cells[order]
+        self.cell_triangles = triangle_ids[order]
+
+    def _cell_coords(self, points):
+        """Grid cell of each point, clipped to the grid"""
+        coords = np.floor((points - self.grid_origin) / self.cell_size).astype(int)
+        return np.clip(coords, 0, self.grid_shape - 1)
+
+    def _triangles_in_box(self, box_min, box_max):
+        """Ids of body triangles in the grid cells overlapped by given 3D box"""
+        if np.any(box_max < self.grid_origin) or np.any(box_min > self.grid_origin + self.grid_shape * self.cell_size):
+            return np.zeros(0, dtype=int)
+        cell_min, cell_max = self._cell_coords(box_min), self._cell_coords(box_max)
+        ranges = [np.arange(low, high + 1) for low, high in zip(cell_min, cell_max)]
+        cells = np.ravel_multi_index([coords.ravel() for coords in np.meshgrid(*ranges, indexing='ij')], self.grid_shape)
+        return np.unique(self.cell_triangles[np.isin(self.cell_keys, cells)])
+
+    def _closest_vertex_distance(self, points, chunk_size=256):
+        """Distance from each point to the closest body vertex"""
+        distances = np.empty(len(points))
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            distances[start:start + chunk_size] = np.sqrt(
+                np.min(np.sum((chunk[:, None] - self.vertices[None]) ** 2, axis=-1), axis=1))
+        return distances
+
+    def _inside(self, points, chunk_size=256):
+        """Check if the points (within the body box) are inside the (closed) body mesh: even-odd number of ray hits"""
+        # slightly tilted ray to avoid passing exactly through the edges & vertices of the mesh
+        direction = np.array([1., 1e-3, 2e-3])
+        tri_min, tri_max = self.triangles.min(axis=1), self.triangles.max(axis=1)
+        drift = direction * (tri_max[:, 0].max() - tri_min[:, 0].min())  # max shift of the ray over the body box
+
+        inside = np.zeros(len(points), dtype=bool)
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            # only the triangles in the way of the ray
+            point_ids, tri_ids = np.nonzero(
+                (tri_max[None, :, 0] >= chunk[:, None, 0])
+                & (tri_max[None, :, 1] >= chunk[:, None, 1]) & (tri_min[None, :, 1] <= chunk[:, None, 1] + drift[1])
+                & (tri_max[None, :, 2] >= chunk[:, None, 2]) & (tri_min[None, :, 2] <= chunk[:, None, 2] + drift[2]))
+            triangles = self.triangles[tri_ids]
+
+            edge_1 = triangles[:, 1] - triangles[:, 0]
+            edge_2 = triangles[:, 2] - triangles[:, 0]
+            p_vec = np.cross(direction, edge_2)
+            det = np.sum(edge_1 * p_vec, axis=-1)
+            parallel = np.abs(det) < 1e-12
+            inv_det = 1. / np.where(parallel, 1., det)
+
+            t_vec = chunk[point_ids] - triangles[:, 0]
+            u = np.sum(t_vec * p_vec, axis=-1) * inv_det
+            q_vec = np.cross(t_vec, edge_1)
+            v = np.sum(direction * q_vec, axis=-1) * inv_det
+            t = np.sum(edge_2 * q_vec, axis=-1) * inv_det
+            hits = ~parallel & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+            inside[start:start + chunk_size] = np.bincount(point_ids[hits], minlength=len(chunk)) % 2 == 1
+        return inside
+
+    @staticmethod
+    def _triangle_edges_through_panel(triangles, outline_2D, rotation, translation):
+        """Check if any edge of given triangles pierces the panel polygon"""
+        # triangles in local coordinates of the panel: R^T (p - t)
+        local = np.matmul(triangles - translation, rotation)
+        starts = local.reshape(-1, 3)
+        ends = local[:, [1, 2, 0]].reshape(-1, 3)
+
+        crossing = starts[:, 2] * ends[:, 2] < 0  # endpoints on the opposite sides of the panel plane
+        if not np.any(crossing):
+            return False
+        starts, ends = starts[crossing], ends[crossing]
+        points = starts[:, :2] + (ends[:, :2] - starts[:, :2]) * (starts[:, 2] / (starts[:, 2] - ends[:, 2]))[:, None]
+
+        return bool(np.any(_points_in_polygon(points, outline_2D)))
+
+    @staticmethod
+    def _outline_through_triangles(outline_3D, triangles):
+        """Check if any segment of the closed panel outline pierces any of given triangles (Moller-Trumbore)"""
+        origins = outline_3D
+        directions = np.roll(outline_3D, -1, axis=0) - outline_3D  # segment i goes to outline point i + 1
+
+        edge_1 = (triangles[:, 1] - triangles[:, 0])[None]
+        edge_2 = (triangles[:, 2] - triangles[:, 0])[None]
+        p_vec = np.cross(directions[:, None], edge_2)
+        det = np.sum(edge_1 * p_vec, axis=-1)
+        parallel = np.abs(det) < 1e-12
+        inv_det = 1. / np.where(parallel, 1., det)
+
+        t_vec = origins[:, None] - triangles[None, :, 0]
+        u = np.sum(t_vec * p_vec, axis=-1) * inv_det
+        q_vec = np.cross(t_vec, edge_1)
+        v = np.sum(directions[:, None] * q_vec, axis=-1) * inv_det
+        t = np.sum(edge_2 * q_vec, axis=-1) * inv_det
+
+        hits = ~parallel & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= 1)
+        return bool(np.any(hits))
+
+
+def _points_in_polygon(points, polygon):
+    """Even-odd rule check for (N, 2) points against closed polygon given by (K, 2) vertices"""
+    starts = polygon[None, :, :]
+    ends = np.roll(polygon, -1, axis=0)[None, :, :]
+    px, py = points[:, 0:1], points[:, 1:2]
+
+    straddles = (starts[..., 1] > py) != (ends[..., 1] > py)
+    dy = np.where(straddles, ends[..., 1] - starts[..., 1], 1.)
+    x_cross = starts[..., 0] + (py - starts[..., 1]) * (ends[..., 0] - starts[..., 0]) / dy
+    crossings = np.sum(straddles & (px < x_cross), axis=1)
+    return crossings % 2 == 1
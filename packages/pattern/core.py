@@ -4,14 +4,21 @@
 # Basic
 import copy
 from datetime import datetime
-import errno
+import hashlib
+import io
 import json
 import numpy as np
 import os
+from pathlib import Path
 import random
+import shutil
+import tempfile
+import zipfile
 
 # My
+import metrics
 from pattern import rotation as rotation_tools
+from pattern import bezier
 
 standard_filenames = [
     'specification',  # e.g. used by dataset generation
@@ -42,7 +49,106 @@ panel_spec_template = {
 }
 
 
+def spec_copy(spec, precision=None):
+    """Copy of pattern specification -- a cheaper equivalent of copy.deepcopy() for JSON-like structures
+        * precision -- if given, float values are rounded to this number of decimal digits 
+    """
+    if type(spec) is dict:
+        return {key: spec_copy(value, precision) for key, value in spec.items()}
+    if type(spec) is list:
+        return [spec_copy(value, precision) for value in spec]
+    if precision is not None and type(spec) is float:
+        return round(spec, precision)
+    return spec
+
+
+def _fuzzy_groups(sorted_values, segments, tolerance):
+    """Ids of groups of similar values in sorted list (see BasicPattern.define_panel_order())
+        * New group starts when value is at least tolerance away from the first value of the current group
+        * Groups do not cross the boundaries of given segments (e.g. groups by the previous dimention)
+    """
+    groups = np.empty(len(sorted_values), dtype=int)
+    group, start = -1, 0
+    for idx in range(len(sorted_values)):
+        if idx == 0 or segments[idx] != segments[start] or sorted_values[idx] - sorted_values[start] >= tolerance:
+            group += 1
+            start = idx
+        groups[idx] = group
+    return groups
+
+
 # ------------ Patterns --------
+class Panel(object):
+    """
+        Compact array-backed geometry of a pattern panel 
+            * vertices -- (num_verts, 2) float64 vertex coordinates
+            * endpoints -- (num_edges, 2) int32 ids of edge endpoints
+            * curvatures -- (num_edges, 2) float64 relative coordinates of Bezier control points of curvy edges 
+                (as 'curvature' of edges in spec). Zeros for straight edges
+            * curved -- (num_edges, ) boolean mask of curvy edges
+            * arc_lengths -- (num_edges, ) arc lengths of the edges once measured (see measure_arc_lengths()), 
+                None otherwise. Cached until the geometry changes: code that changes vertices or curvatures 
+                in-place resets it to None. Copies start without it
+
+        Pattern objects keep the result of computations on panel geometry as Panel objects, 
+        and only update the JSON-like pattern spec when the spec is requested (see BasicPattern.spec)
+        Other panel info (placement, edge labels, etc.) is only stored in the spec
+    """
+    __slots__ = ('vertices', 'endpoints', 'curvatures', 'curved', 'arc_lengths')
+
+    def __init__(self, vertices, endpoints, curvatures, curved):
+        self.vertices = vertices
+        self.endpoints = endpoints
+        self.curvatures = curvatures
+        self.curved = curved
+        self.arc_lengths = None
+
+    @classmethod
+    def from_spec(cls, panel):
+        """Panel geometry from panel in spec format"""
+        edges = panel['edges']
+        return cls(
+            np.array(panel['vertices'], dtype=float).reshape(-1, 2),
+            np.array([edge['endpoints'] for edge in edges], dtype=np.int32).reshape(-1, 2),
+            np.array([edge['curvature'] if 'curvature' in edge else [0, 0] for edge in edges], dtype=float).reshape(-1, 2),
+            np.array(['curvature' in edge for edge in edges], dtype=bool)
+        )
+
+    def update_spec(self, panel):
+        """Write vertices & edge curvatures to panel in spec format (in-place)"""
+        panel['vertices'] = self.vertices.tolist()
+        for edge, curvature, curved in zip(panel['edges'], self.curvatures.tolist(), self.curved):
+            if curved:
+                edge['curvature'] = curvature
+
+    def copy(self):
+        """Copy with writable geometry arrays. Edge structure (endpoints & curved mask) is shared"""
+        return Panel(self.vertices.copy(), self.endpoints, self.curvatures.copy(), self.curved)
+
+    def freeze(self):
+        """Make all arrays read-only (e.g. to share Panel object between patterns safely)"""
+        for array in (self.vertices, self.endpoints, self.curvatures, self.curved):
+            array.flags.writeable = False
+        return self
+
+
+def measure_arc_lengths(panels):
+    """Arc lengths of the edges of Panel objects (see bezier.arc_lengths()). 
+        Only the panels without cached lengths are measured, all of them at once. 
+        Returns the list of (num_edges, ) read-only arrays"""
+    outdated = [panel for panel in panels if panel.arc_lengths is None]
+    if outdated:
+        lengths = bezier.arc_lengths(
+            np.concatenate([panel.vertices[panel.endpoints[:, 0]] for panel in outdated]),
+            np.concatenate([panel.vertices[panel.endpoints[:, 1]] for panel in outdated]),
+            np.concatenate([panel.curvatures for panel in outdated]))
+        lengths.flags.writeable = False  # shared with the cache
+        splits = np.cumsum([len(panel.endpoints) for panel in outdated])[:-1]
+        for panel, panel_lengths in zip(outdated, np.split(lengths, splits)):
+            panel.arc_lengths = panel_lengths
+    return [panel.arc_lengths for panel in panels]
+
+
 class BasicPattern(object):
     """Loading & serializing of a pattern specification in custom JSON format.
         Input:
@@ -56,6 +162,15 @@ class BasicPattern(object):
             * Support for patterns with darts
     """
 
+    # Normalized specs are cached next to the spec files they are loaded from (see reloadJSON()). 
+    # Set to False to always normalize on load
+    normalization_cache = True
+    # normalization result depends on the pattern class (see ParametrizedPattern._normalize_edge_loop())
+    normalization_kind = 'basic'
+    # NOTE increase on any change of the normalization routines (_normalize_*()) or the cache format 
+    # to invalidate existing caches
+    normalization_version = 2
+
     # ------------ Interface -------------
 
     def __init__(self, pattern_file=None):
@@ -70,9 +185,29 @@ class BasicPattern(object):
             self.path = None
             self.name = self.__class__.__name__
             self.spec = copy.deepcopy(pattern_spec_template)
-            self.pattern = self.spec['pattern']
             self.properties = self.spec['properties']  # mandatory part
 
+    @property
+    def spec(self):
+        """Pattern specification in custom JSON format
+            Panel geometry that is only kept in Panel objects (if any) is written to the spec on request. 
+            NOTE internal code reads fields other than panel geometry (parameters, constraints, etc.) from self._spec, 
+            s.t. the Panel objects are kept"""
+        if self.panels is not None:
+            self._update_spec_panels()
+        return self._spec
+
+    @spec.setter
+    def spec(self, spec):
+        self._spec = spec
+        self.panels = None  # up-to-date geometry is in the new spec
+        # panel name -> Panel with measured arc lengths for the panels only kept in the spec, see edge_arc_lengths()
+        self.arc_length_cache = {}
+
+    @property
+    def pattern(self):
+        return self.spec['pattern']
+
     def reloadJSON(self):
         """(Re)loads pattern info from spec file. 
         Useful when spec is updated from outside"""
@@ -82,34 +217,196 @@ class BasicPattern(object):
             ))
             return
 
-        with open(self.spec_file, 'r') as f_json:
-            self.spec = json.load(f_json)
-        self.pattern = self.spec['pattern']
+        with open(self.spec_file, 'rb') as f_json:
+            content = f_json.read()
+        source_hash = hashlib.sha1(content).hexdigest()
+        if self.normalization_cache and self._load_normalized_cache(source_hash):
+            metrics.count('pattern.normalization_cache.hits')
+            return
+        metrics.count('pattern.normalization_cache.misses')
+
+        self.spec = json.loads(content.decode('utf-8'))
+        sidecar = 'vertices_sidecar' in self.spec
+        if sidecar:  # vertices are saved separately
+            self._load_vertices_sidecar()
         self.properties = self.spec['properties']  # mandatory part
 
         # template normalization - panel translations and curvature to relative coords
-        self._normalize_template()
-
-    def serialize(self, path, to_subfolder=True, tag=''):
-        # log context
+        needs_normalization = self._needs_normalization()
+        with metrics.span('pattern.normalize'):
+            self._normalize_template()
+
+        # NOTE specs that are normalized already (e.g. dataset samples) load as fast as the cache, no need to clutter the folders
+        # Specs with vertices sidecar are not cached since the hash does not cover the sidecar file
+        if self.normalization_cache and needs_normalization and not sidecar:
+            self._save_normalized_cache(source_hash)
+
+    def serialize(self, path, to_subfolder=True, tag='', compact=False, precision=None, vertices_sidecar=False, shard=None):
+        """Save pattern specification to JSON file. Options for more compact files (e.g. for large datasets):
+            * compact -- write JSON without indentation & spaces
+            * precision -- number of decimal digits to keep in float values (full precision if None)
+            * vertices_sidecar -- save panel vertices to a binary .npy file next to the specification file 
+                instead of JSON
+            All forms are loaded with reloadJSON()
+            * shard -- (optional) pattern.shards.ShardWriter to add the files to instead of saving them to path.
+                Files are added with the paths relative to path that they would have otherwise
+            Files are written to temporary locations & moved in place when complete, 
+            s.t. an interrupted run does not leave partially written files behind
+        """
         if to_subfolder:
             log_dir = os.path.join(path, self.name)
-            try:
-                os.makedirs(log_dir)
-            except OSError as e:
-                if e.errno != errno.EEXIST:
-                    raise
-            spec_file = os.path.join(log_dir, tag + 'specification.json')
+            spec_filename = tag + 'specification.json'
         else:
             log_dir = path
-            spec_file = os.path.join(path, (self.name + tag + '_specification.json'))
-
-        # Save specification
-        with open(spec_file, 'w') as f_json:
-            json.dump(self.spec, f_json, indent=2)
+            spec_filename = self.name + tag + '_specification.json'
+        files = self._serialized_files(
+            spec_filename, tag, compact=compact, precision=precision, vertices_sidecar=vertices_sidecar)
+
+        if shard is not None:
+            shard.add(self.name, {
+                (os.path.join(self.name, filename) if to_subfolder else filename): content 
+                for filename, content in files.items()})
+            return log_dir
+
+        if to_subfolder and not os.path.exists(log_dir):
+            # new folder appears with all the files at once
+            tmp_dir = log_dir + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)  # leftover of an interrupted run
+            os.makedirs(tmp_dir)
+            for filename, content in files.items():
+                self._write_file(os.path.join(tmp_dir, filename), content)
+            os.replace(tmp_dir, log_dir)
+        else:
+            for filename, content in files.items():
+                filepath = os.path.join(log_dir, filename)
+                self._write_file(filepath + '.tmp', content)
+                os.replace(filepath + '.tmp', filepath)
         
         return log_dir
 
+    @staticmethod
+    def _write_file(filepath, content):
+        with open(filepath, 'w' if isinstance(content, str) else 'wb') as f_out:
+            f_out.write(content)
+
+    def _serialized_files(self, spec_filename, tag='', compact=False, precision=None, vertices_sidecar=False):
+        """Content of the files to save the pattern to, see serialize(). 
+            Returns dict {file name: str or bytes content}"""
+        files = {}
+        spec = self.spec
+        if precision is not None:
+            spec = spec_copy(spec, precision)
+        if vertices_sidecar:
+            spec, sidecar_filename, files[sidecar_filename] = self._vertices_sidecar(
+                spec, spec_filename, copy_spec=(precision is None))
+
+        if compact:  # NOTE dumps() to a string at once is faster than streaming with dump()
+            files[spec_filename] = json.dumps(spec, separators=(',', ':'))
+        else:
+            files[spec_filename] = json.dumps(spec, indent=2)
+        return files
+
+    def _vertices_sidecar(self, spec, spec_filename, copy_spec=True):
+        """Vertices of all panels as .npy file content with one (num_verts, 2) array, to be saved next to spec_filename
+            Returns spec with vertices replaced by the reference to the file, sidecar file name & its content"""
+        if copy_spec:
+            spec = spec_copy(spec)
+        panel_names = list(spec['pattern']['panels'])
+        vertices = [spec['pattern']['panels'][name].pop('vertices') for name in panel_names]
+        sidecar_filename = os.path.splitext(spec_filename)[0] + '_vertices.npy'
+        sidecar = io.BytesIO()
+        np.save(sidecar, np.array([vert for panel_verts in vertices for vert in panel_verts], dtype=float).reshape(-1, 2))
+
+        spec['vertices_sidecar'] = {
+            'file': sidecar_filename,
+            'panels': panel_names,
+            'counts': [len(panel_verts) for panel_verts in vertices]
+        }
+        return spec, sidecar_filename, sidecar.getvalue()
+
+    def _load_vertices_sidecar(self):
+        """Put panel vertices from sidecar file (see _vertices_sidecar()) back to the spec"""
+        sidecar = self.spec.pop('vertices_sidecar')
+        vertices = np.load(os.path.join(os.path.dirname(self.spec_file), sidecar['file'])).tolist()
+        start = 0
+        for name, count in zip(sidecar['panels'], sidecar['counts']):
+            self.spec['pattern']['panels'][name]['vertices'] = vertices[start:start + count]
+            start += count
+
+    def _normalized_cache_file(self):
+        """Separate cache file for each normalization kind, s.t. loading the spec with different classes does not 
+            override the cache of each other"""
+        return os.path.splitext(self.spec_file)[0] + '_' + self.normalization_kind + '_normalized.npz'
+
+    def _save_normalized_cache(self, source_hash):
+        """Save normalized spec to .npz file next to the spec file: 
+            JSON header with the hash of the source spec file, normalization kind & version, 
+            the spec without vertices as JSON string & vertices of all panels as one (num_verts, 2) array, 
+            with the mask of integer coordinates s.t. loaded spec is the same as the normalized one
+            * Written to temporary file first & moved in place, so concurrent readers never see partial files
+            * Failures to write (e.g. read-only dataset folders) are ignored -- cache is only an optimization
+        """
+        spec = spec_copy(self.spec)
+        panel_names = list(spec['pattern']['panels'])
+        vertices = [spec['pattern']['panels'][name].pop('vertices') for name in panel_names]
+        header = {
+            'source_sha1': source_hash, 
+            'kind': self.normalization_kind, 
+            'version': self.normalization_version, 
+            'panels': panel_names, 
+            'counts': [len(panel_verts) for panel_verts in vertices]
+        }
+
+        all_vertices = [vert for panel_verts in vertices for vert in panel_verts]
+        cache_file = self._normalized_cache_file()
+        try:
+            f_handle, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(cache_file) or '.')
+            try:
+                with os.fdopen(f_handle, 'wb') as f_cache:
+                    np.savez(
+                        f_cache, 
+                        header=np.array(json.dumps(header)), 
+                        spec=np.array(json.dumps(spec, separators=(',', ':'))),
+                        vertices=np.array(all_vertices, dtype=float).reshape(-1, 2),
+                        int_coords=np.array([[isinstance(coord, int) for coord in vert] for vert in all_vertices], 
+                                            dtype=bool).reshape(-1, 2))
+                os.replace(tmp_file, cache_file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+        except OSError:
+            pass
+
+    def _load_normalized_cache(self, source_hash):
+        """Load normalized spec from the cache file (see _save_normalized_cache()) 
+            if it's created from the same source content & with the same normalization kind & version.
+            Returns True if the spec was loaded"""
+        cache_file = self._normalized_cache_file()
+        if not os.path.exists(cache_file):
+            return False
+        try:
+            with np.load(cache_file) as cache:
+                header = json.loads(str(cache['header']))
+                if (header['source_sha1'] != source_hash or header['kind'] != self.normalization_kind 
+                        or header.get('version') != self.normalization_version):
+                    return False
+                spec = json.loads(str(cache['spec']))
+                vertices, int_coords = cache['vertices'], cache['int_coords']
+                if np.any(int_coords):
+                    vertices = vertices.astype(object)
+                    vertices[int_coords] = vertices[int_coords].astype(int).tolist()
+                vertices = vertices.tolist()
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):  # broken cache is the same as no cache
+            return False
+
+        start = 0
+        for name, count in zip(header['panels'], header['counts']):
+            spec['pattern']['panels'][name]['vertices'] = vertices[start:start + count]
+            start += count
+        self.spec = spec
+        self.properties = self.spec['properties']
+        return True
+
     @staticmethod
     def name_from_path(pattern_file):
         name = os.path.splitext(os.path.basename(pattern_file))[0]
@@ -129,41 +426,34 @@ class BasicPattern(object):
         return self.pattern['panel_order']
 
     def define_panel_order(self, name_list=None, location_dict=None, dim=0, tolerance=10):
-        """ (Recursive) Ordering of the panels based on their 3D translation values.
+        """ Ordering of the panels based on their 3D translation values.
             * Using cm as units for tolerance (when the two coordinates are considered equal)
             * Sorting by all dims as keys X -> Y -> Z (left-right (looking from Z) then down-up then back-front)
-            * based on the fuzzysort suggestion here https://stackoverflow.com/a/24024801/11206726"""
+            * based on the fuzzysort suggestion here https://stackoverflow.com/a/24024801/11206726
+            * Fuzzy groups of each dim are evaluated in turn and used as primary keys of lexsort by the next dim,
+                which gives the same order as recursive re-sorting of the groups"""
 
         if name_list is None:  # start from beginning
             name_list = self.pattern['panels'].keys() 
+        name_list = list(name_list)
+        if not name_list:
+            return []
         if location_dict is None:  # obtain location for all panels to use in sorting further
-            location_dict = {}
-            for name in name_list:
-                location_dict[name], _ = self._panel_universal_transtation(name)
-
-        # consider only translations of the requested panel names
-        reference = [location_dict[panel_n][dim] for panel_n in name_list]
-        sorted_couple = sorted(zip(reference, name_list))  # sorts according to the first list
-        sorted_reference, sorted_names = zip(*sorted_couple)
-        sorted_names = list(sorted_names)
-
-        if (dim + 1) < 3:  # 3D is max
-            # re-sort values by next dimention if they have similar values in current dimention
-            fuzzy_start, fuzzy_end = 0, 0  # init both in case we start from 1 panel to sort
-            for fuzzy_end in range(1, len(sorted_reference)):
-                if sorted_reference[fuzzy_end] - sorted_reference[fuzzy_start] >= tolerance:
-                    # the range of similar values is completed
-                    if fuzzy_end - fuzzy_start > 1:
-                        sorted_names[fuzzy_start:fuzzy_end] = self.define_panel_order(
-                            sorted_names[fuzzy_start:fuzzy_end], location_dict, dim + 1, tolerance)
-                    fuzzy_start = fuzzy_end  # start counting similar values anew
-
-            # take care of the tail
-            if fuzzy_start != fuzzy_end:
-                sorted_names[fuzzy_start:] = self.define_panel_order(
-                    sorted_names[fuzzy_start:], location_dict, dim + 1, tolerance)
-
-        return sorted_names
+            locations, _ = self._panels_universal_translations(name_list)
+        else:
+            locations = np.array([location_dict[name][:3] for name in name_list], dtype=float)
+
+        # ties in coordinates are resolved by names
+        name_ranks = np.empty(len(name_list), dtype=int)
+        name_ranks[sorted(range(len(name_list)), key=lambda idx: name_list[idx])] = np.arange(len(name_list))
+
+        groups = np.zeros(len(name_list), dtype=int)
+        for curr_dim in range(dim, 2):
+            order = np.lexsort((name_ranks, locations[:, curr_dim], groups))
+            groups[order] = _fuzzy_groups(locations[order, curr_dim], groups[order], tolerance)
+        order = np.lexsort((name_ranks, locations[:, 2], groups))
+
+        return [name_list[idx] for idx in order]
 
     # -- sub-utils --
     def _edge_as_vector(self, vertices, edge_dict):
@@ -210,29 +500,267 @@ class BasicPattern(object):
                 * 3D location of a panel is placing this panel around the body in T-pose
             * Function result is independent from the current choice of the local coordinate system of the panel
         """
-        panel = self.pattern['panels'][panel_name]
-        vertices = np.array(panel['vertices'])
+        locations_3D, locations_2D = self._panels_universal_translations([panel_name])
+        return locations_3D[0], locations_2D[0]
 
-        # out of 2D bounding box sides' midpoints choose the one that is highest in 3D
-        top_right = vertices.max(axis=0)
-        low_left = vertices.min(axis=0)
-        mid_x = (top_right[0] + low_left[0]) / 2
-        mid_y = (top_right[1] + low_left[1]) / 2
-        mid_points_2D = [
-            [mid_x, top_right[1]], 
-            [mid_x, low_left[1]],
-            [top_right[0], mid_y],
-            [low_left[0], mid_y]
-        ]
-        rot_matrix = rotation_tools.euler_xyz_to_R(panel['rotation'])  # calculate once for all points 
-        mid_points_3D = np.vstack(tuple(
-            [self._point_in_3D(coords, rot_matrix, panel['translation']) for coords in mid_points_2D]
-        ))
-        top_mid_point = mid_points_3D[:, 1].argmax()
+    def _panels_universal_translations(self, panel_names):
+        """Universal translations (see _panel_universal_transtation()) of all the requested panels at once.
+            Returns (N, 3) array of 3D locations and (N, 2) array of corresponding points in panels' local coordinates
+        """
+        panels = [self.pattern['panels'][name] for name in panel_names]
+
+        # 2D bounding boxes of all panels
+        vertices = [np.asarray(panel['vertices'], dtype=float) for panel in panels]
+        top_right = np.stack([verts.max(axis=0) for verts in vertices])
+        low_left = np.stack([verts.min(axis=0) for verts in vertices])
+        mid = (top_right + low_left) / 2
 
-        return mid_points_3D[top_mid_point], np.array(mid_points_2D[top_mid_point])
+        # out of 2D bounding box sides' midpoints choose the one that is highest in 3D
+        mid_points_2D = np.stack([
+            np.stack([mid[:, 0], top_right[:, 1]], axis=-1),
+            np.stack([mid[:, 0], low_left[:, 1]], axis=-1),
+            np.stack([top_right[:, 0], mid[:, 1]], axis=-1),
+            np.stack([low_left[:, 0], mid[:, 1]], axis=-1),
+        ], axis=1)  # N x 4 x 2
+        mid_points_local = np.concatenate([mid_points_2D, np.zeros(mid_points_2D.shape[:-1] + (1, ))], axis=-1)
+
+        rotations = rotation_tools.euler_xyz_to_R_batch([panel['rotation'] for panel in panels])
+        translations = np.array([panel['translation'] for panel in panels], dtype=float)
+        mid_points_3D = np.matmul(mid_points_local, rotations.transpose(0, 2, 1)) + translations[:, None, :]
+
+        top_mid_points = mid_points_3D[:, :, 1].argmax(axis=1)
+        panel_ids = np.arange(len(panels))
+        return mid_points_3D[panel_ids, top_mid_points], mid_points_2D[panel_ids, top_mid_points]
+
+    # --------- Tensor representation ----------
+    def pattern_as_tensors(
+            self, pad_panels_to_len=None, pad_panels_num=None, pad_stitches_num=None,
+            with_placement=False, with_stitches=False, with_stitch_tags=False):
+        """Return pattern in fixed-size numeric format suitable for NN inputs/outputs. 
+            Panels follow panel_order()
+            * 3D tensor of panel edges (num_panels, max_num_edges, 4): 
+                edges as vectors (see _edge_as_vector()) in edge loop order padded with zeros
+            * actual number of panels
+            Optional:
+            * with_placement: 
+                * panel rotations (num_panels, 3) as Euler angles (as in spec)
+                * panel translations (num_panels, 3) -- 3D location of the start vertex of the first edge, 
+                    s.t. the panel could be restored from the edge sequence starting at the origin
+            * with_stitches: 
+                * stitches (2, num_stitches) as pairs of edge ids in the flattened edge tensor 
+                    (panel_id * max_num_edges + edge_id), padded with -1
+                * actual number of stitches
+            * with_stitch_tags: per-edge stitch tags (num_panels, max_num_edges, 3) -- 
+                approximate 3D location of the stitch that edge belongs to (mean of the stitched edge endpoints in 3D). 
+                Zeros for edges without stitches
+            
+            Parameters to control padding: 
+            * pad_panels_to_len -- pad the list edges of every panel to this number of edges
+            * pad_panels_num -- pad the list of panels of the pattern to this number of panels
+            * pad_stitches_num -- pad the list of stitches to this number of stitches
+        """
+        panel_order = self.panel_order()
+        panels = [Panel.from_spec(self.pattern['panels'][name]) for name in panel_order]
+        num_edges = [len(panel.endpoints) for panel in panels]
+        max_len = pad_panels_to_len if pad_panels_to_len is not None else max(num_edges, default=0)
+        num_panels = pad_panels_num if pad_panels_num is not None else len(panels)
+        if max(num_edges, default=0) > max_len or len(panels) > num_panels:
+            raise ValueError('BasicPattern::Error::{}::Pattern does not fit into requested padding'.format(self.name))
+
+        # edges as vectors
+        edge_tensor = np.zeros((num_panels, max_len, 4))
+        for panel_id, panel in enumerate(panels):
+            edge_tensor[panel_id, :num_edges[panel_id], :2] = (
+                panel.vertices[panel.endpoints[:, 1]] - panel.vertices[panel.endpoints[:, 0]])
+            edge_tensor[panel_id, :num_edges[panel_id], 2:] = panel.curvatures
+
+        result = [edge_tensor, len(panels)]
+
+        # placement
+        rotations = np.zeros((num_panels, 3))
+        translations = np.zeros((num_panels, 3))
+        for panel_id, name in enumerate(panel_order):
+            rotations[panel_id] = self.pattern['panels'][name]['rotation']
+            translations[panel_id] = self.pattern['panels'][name]['translation']
+        rot_matrices = rotation_tools.euler_xyz_to_R_batch(rotations)
+        if with_placement:
+            first_verts = np.zeros((num_panels, 3))
+            first_verts[:len(panels), :2] = [panel.vertices[panel.endpoints[0, 0]] for panel in panels]
+            result.append(rotations)
+            result.append(np.einsum('pij,pj->pi', rot_matrices, first_verts) + translations)
+
+        # stitches
+        stitches = self.pattern['stitches']
+        if with_stitches:
+            num_stitches = pad_stitches_num if pad_stitches_num is not None else len(stitches)
+            if len(stitches) > num_stitches:
+                raise ValueError('BasicPattern::Error::{}::Stitches do not fit into requested padding'.format(self.name))
+            stitch_ids = np.full((2, num_stitches), -1, dtype=int)
+            panel_ids = {name: panel_id for panel_id, name in enumerate(panel_order)}
+            for stitch_id, stitch in enumerate(stitches):
+                stitch_ids[:, stitch_id] = [panel_ids[side['panel']] * max_len + side['edge'] for side in stitch]
+            result.append(stitch_ids)
+            result.append(len(stitches))
+
+        if with_stitch_tags:
+            # 3D locations of edge endpoints
+            edge_points = np.zeros((num_panels, max_len, 2, 3))
+            for panel_id, panel in enumerate(panels):
+                points = np.zeros((num_edges[panel_id], 2, 3))
+                points[:, :, :2] = panel.vertices[panel.endpoints]
+                edge_points[panel_id, :num_edges[panel_id]] = (
+                    np.einsum('ij,esj->esi', rot_matrices[panel_id], points) + translations[panel_id])
+
+            panel_ids = {name: panel_id for panel_id, name in enumerate(panel_order)}
+            stitch_tags = np.zeros((num_panels, max_len, 3))
+            for stitch in stitches:
+                sides = [(panel_ids[side['panel']], side['edge']) for side in stitch]
+                tag = np.mean([edge_points[panel_id, edge_id] for panel_id, edge_id in sides], axis=(0, 1))
+                for panel_id, edge_id in sides:
+                    stitch_tags[panel_id, edge_id] = tag
+            result.append(stitch_tags)
+
+        return tuple(result)
+
+    def pattern_from_tensors(
+            self, pattern_representation, 
+            panel_rotations=None, panel_translations=None, stitches=None,
+            padded=False):
+        """Create panels from given panel representation (as in pattern_as_tensors()). 
+            Replaces current panels & stitches of the pattern
+            * Panels are named by their position in the representation, which also defines panel order
+            * Panel local coordinates start from the first vertex at the origin
+            * padded -- if enabled, zero edges and panels are treated as padding and ignored. 
+                Stitches may be padded with -1 then
+        """
+        pattern_representation = np.asarray(pattern_representation, dtype=float)
+        max_len = pattern_representation.shape[1]
+        self.pattern['panels'] = {}
+        self.pattern['stitches'] = []
+        panel_names = []
+
+        # panel id in representation -> name
+        names = {}
+        for panel_id, edge_tensor in enumerate(pattern_representation):
+            if padded:
+                edge_tensor = edge_tensor[np.any(np.abs(edge_tensor) > 1e-5, axis=1)]
+                if len(edge_tensor) == 0:
+                    continue
+            panel_name = 'panel_' + str(panel_id)
+            names[panel_id] = panel_name
+            panel_names.append(panel_name)
+            
+            panel = copy.deepcopy(panel_spec_template)
+            # vertices from the edge loop starting at origin
+            num_edges = len(edge_tensor)
+            vertices = np.zeros((num_edges, 2))
+            vertices[1:] = np.cumsum(edge_tensor[:-1, :2], axis=0)
+            panel['vertices'] = vertices.tolist()
+            for edge_id, edge in enumerate(edge_tensor.tolist()):
+                edge_dict = {'endpoints': [edge_id, (edge_id + 1) % num_edges]}
+                if abs(edge[2]) > 1e-5 or abs(edge[3]) > 1e-5:
+                    edge_dict['curvature'] = edge[2:]
+                panel['edges'].append(edge_dict)
+
+            if panel_rotations is not None:
+                panel['rotation'] = np.asarray(panel_rotations[panel_id], dtype=float).tolist()
+            if panel_translations is not None:
+                panel['translation'] = np.asarray(panel_translations[panel_id], dtype=float).tolist()
+            self.pattern['panels'][panel_name] = panel
+
+        if stitches is not None:
+            for stitch in np.asarray(stitches, dtype=int).transpose():
+                if padded and np.any(stitch < 0):
+                    continue
+                self.pattern['stitches'].append([
+                    {'panel': names[edge_id // max_len], 'edge': int(edge_id % max_len)} for edge_id in stitch])
+
+        self.pattern['panel_order'] = panel_names
+        self.properties['curvature_coords'] = 'relative'
+        self.properties['normalize_panel_translation'] = False
+        self.arc_length_cache = {}  # panels are replaced
+
+    def edge_arc_lengths(self, panel_names=None):
+        """Arc lengths of the panel edges accounting for curvature (see bezier.arc_lengths()) 
+            as dictionary of (num_edges, ) arrays per panel
+            * panel_names -- panels to measure, all panels by default
+            * Lengths are cached per panel until its geometry changes (see _arc_length_panels()). 
+                All the panels to re-evaluate are measured at once
+        """
+        if panel_names is None:
+            panel_names = list(self._spec['pattern']['panels'].keys())
+        return dict(zip(panel_names, measure_arc_lengths(self._arc_length_panels(panel_names))))
+
+    def _arc_length_panels(self, panel_names):
+        """Panel objects of the current geometry that keep the cache of arc lengths: 
+            Panel objects of the pattern if the geometry is kept in them, 
+            otherwise Panels created from the spec -- re-used while spec geometry stays the same"""
+        panels = []
+        for name in panel_names:
+            if self.panels is not None:
+                panels.append(self.panels[name])
+                continue
+            panel = Panel.from_spec(self._spec['pattern']['panels'][name])
+            cached = self.arc_length_cache.get(name)
+            if (cached is None or not np.array_equal(cached.vertices, panel.vertices) 
+                    or not np.array_equal(cached.curvatures, panel.curvatures)):
+                self.arc_length_cache[name] = cached = panel
+            panels.append(cached)
+        return panels
+
+    def panel_outlines_3D(self, curve_samples=10):
+        """World-space outlines of all panels as placed for simulation (as in MayaGarment._apply_panel_3d_placement()),
+            evaluated without Maya
+            * curve_samples -- number of segments to sample each curved (quadratic Bezier) edge with
+            Returns dictionary of (num_points, 3) arrays for panels in panel_order(): 
+                closed polylines of start vertices of each edge in edge loop order, 
+                followed by the inner samples of the edge if it's curved 
+        """
+        panel_order = self.panel_order()
+        points, counts = self._outline_points(panel_order, curve_samples)
+        return dict(zip(panel_order, np.split(points, np.cumsum(counts)[:-1])))
+
+    def _outline_points(self, panel_names, curve_samples=10, local=False):
+        """3D outline points of all requested panels (see panel_outlines_3D()) in one array 
+            & number of outline points of every panel
+            * local -- if set, points are returned in 2D local coordinates of the panels
+        """
+        panels = [Panel.from_spec(self.pattern['panels'][name]) for name in panel_names]
+        if not panels:
+            return np.zeros((0, 2 if local else 3)), np.zeros(0, dtype=int)
+
+        starts = np.concatenate([panel.vertices[panel.endpoints[:, 0]] for panel in panels])
+        ends = np.concatenate([panel.vertices[panel.endpoints[:, 1]] for panel in panels])
+        curvatures = np.concatenate([panel.curvatures for panel in panels])
+        curved = np.concatenate([panel.curved for panel in panels])
+        edge_panels = np.repeat(np.arange(len(panels)), [len(panel.endpoints) for panel in panels])
+
+        # all edges sampled as Bezier curves, only the start point is kept for straight ones
+        samples = bezier.curve_points(starts, ends, curvatures, np.arange(curve_samples) / curve_samples)
+        keep = np.zeros(samples.shape[:2], dtype=bool)
+        keep[:, 0] = True
+        keep[curved, 1:] = True
+        points_2D = samples[keep]
+        point_panels = np.repeat(edge_panels, keep.sum(axis=1))
+        if local:
+            return points_2D, np.bincount(point_panels, minlength=len(panels))
+
+        # 3D placement
+        rotations = rotation_tools.euler_xyz_to_R_batch([self.pattern['panels'][name]['rotation'] for name in panel_names])
+        translations = np.array([self.pattern['panels'][name]['translation'] for name in panel_names], dtype=float)
+        points = np.einsum('nij,nj->ni', rotations[point_panels][:, :, :2], points_2D) + translations[point_panels]
+
+        return points, np.bincount(point_panels, minlength=len(panels))
 
     # --------- Pattern operations (changes inner dicts) ----------
+    def _needs_normalization(self):
+        """Check if _normalize_template() would change the loaded spec"""
+        return (self.properties['curvature_coords'] == 'absolute'
+                or self.properties.get('units_in_meter', 100) != 100
+                or self.properties.get('normalize_panel_translation', False)
+                or not self.properties.get('normalized_edge_loops', False)
+                or 'panel_order' not in self.pattern)
+
     def _normalize_template(self):
         """
         Updated template definition for convenient processing:
@@ -329,8 +857,8 @@ class BasicPattern(object):
 
         # Loop Origin
         loop_origin_id = self._vert_at_left_corner(vertices)
-        print('{}:{}: Origin: {} -> {}'.format(
-            self.name, panel_name, panel['edges'][0]['endpoints'][0], loop_origin_id))
+        if panel['edges'][0]['endpoints'][0] != loop_origin_id:
+            metrics.count('pattern.edge_loop.origin_changes')
 
         rotated_edges, rotated_edge_ids = self._rotate_edges(
             panel['edges'], list(range(len(panel['edges']))), loop_origin_id)
@@ -342,10 +870,8 @@ class BasicPattern(object):
         flipped = False
         # due to the choice of origin (at the corner), first & last edge cross-product will reliably show panel normal direction 
         if np.cross(first_edge, last_edge) > 0:  # should be negative -- counterclockwise
-            print('{}::{}::panel <{}> flipped'.format(
-                self.__class__.__name__, self.name, panel_name
-            ))
             flipped = True
+            metrics.count('pattern.edge_loop.flips')
 
             # Vertices
             vertices[:, 0] = - vertices[:, 0]  # flip by X coordinate -- we'll rotate around Y
@@ -354,8 +880,6 @@ class BasicPattern(object):
             # Edges
             # new loop origin after update
             loop_origin_id = self._vert_at_left_corner(vertices)
-            print('{}:{}: Origin: {} -> {}'.format(
-                self.name, panel_name, panel['edges'][0]['endpoints'][0], loop_origin_id))
 
             rotated_edges, rotated_edge_ids = self._rotate_edges(rotated_edges, rotated_edge_ids, loop_origin_id)
             panel['edges'] = rotated_edges
@@ -389,13 +913,7 @@ class BasicPattern(object):
         """
         Derives absolute coordinates of Bezier control point given as an offset
         """
-        edge = end - start
-        edge_perp = np.array([-edge[1], edge[0]])
-
-        control_start = start + control_scale[0] * edge
-        control_point = control_start + control_scale[1] * edge_perp
-
-        return control_point 
+        return bezier.control_points(np.asarray(start), np.asarray(end), np.asarray(control_scale))
     
     def _control_to_relative_coord(self, start, end, control_point):
         """
@@ -469,42 +987,66 @@ class BasicPattern(object):
             Makes a full copy of backup to avoid accidential corruption of backup
         """
         self.spec = copy.deepcopy(backup_copy)
-        self.pattern = self.spec['pattern']
         self.properties = self.spec['properties']  # mandatory part
 
+    def _update_spec_panels(self):
+        """Write geometry of Panel objects to the spec 
+            After that spec is the only source of panel geometry: it might be changed from outside"""
+        for name, panel in self.panels.items():
+            panel.update_spec(self._spec['pattern']['panels'][name])
+        # measured arc lengths stay valid while the spec geometry is the same
+        self.arc_length_cache = {name: panel for name, panel in self.panels.items() if panel.arc_lengths is not None}
+        self.panels = None
+
     # -------- Checks ------------
-    def is_self_intersecting(self):
-        """returns True if any of the pattern panels are self-intersecting"""
-        return any(map(self._is_panel_self_intersecting, self.pattern['panels']))
+    def is_self_intersecting(self, panel_names=None):
+        """returns True if any of the pattern panels are self-intersecting
+            * panel_names -- if given, only these panels are checked
+        """
+        if panel_names is None:
+            panel_names = self.pattern['panels'].keys()
+        # all panels are checked at once, padded with degenerate segments that never intersect
+        panel_segments = [self._panel_edge_list(self.pattern['panels'][name]) for name in panel_names]
+        max_segments = max(map(len, panel_segments), default=0)
+        if max_segments < 2:
+            return False
+        segments = np.zeros((len(panel_segments), max_segments, 2, 2))
+        for panel_id, edge_list in enumerate(panel_segments):
+            if edge_list:
+                segments[panel_id, :len(edge_list)] = edge_list
+
+        return bool(_segments_intersecting(segments).any())
 
     def _is_panel_self_intersecting(self, panel_name):
         """Checks whatever a given panel contains intersecting edges
         """
-        panel = self.pattern['panels'][panel_name]
-        vertices = np.array(panel['vertices'])
+        edge_list = self._panel_edge_list(self.pattern['panels'][panel_name])
+        if len(edge_list) < 2:
+            return False
+        return bool(_segments_intersecting(np.array(edge_list, dtype=float)))
 
-        # construct edge list in coordinates
+    def _panel_edge_list(self, panel):
+        """Panel edges as list of segments in coordinates
+            * view curvy edge as two segments
+                NOTE this aproximation might lead to False positives in intersection tests
+        """
+        vertices = panel['vertices']
         edge_list = []
         for edge in panel['edges']:
-            edge_ids = edge['endpoints']
-            edge_coords = vertices[edge_ids]
+            start, end = vertices[edge['endpoints'][0]], vertices[edge['endpoints'][1]]
             if 'curvature' in edge:
-                curv_abs = self._control_to_abs_coord(edge_coords[0], edge_coords[1], edge['curvature'])
-                # view curvy edge as two segments
-                # NOTE this aproximation might lead to False positives in intersection tests
-                edge_list.append([edge_coords[0], curv_abs])
-                edge_list.append([curv_abs, edge_coords[1]])
+                # see _control_to_abs_coord()
+                control_scale = edge['curvature']
+                edge_vec = [end[0] - start[0], end[1] - start[1]]
+                curv_abs = [
+                    start[0] + control_scale[0] * edge_vec[0] + control_scale[1] * -edge_vec[1],
+                    start[1] + control_scale[0] * edge_vec[1] + control_scale[1] * edge_vec[0]
+                ]
+                edge_list.append([start, curv_abs])
+                edge_list.append([curv_abs, end])
             else:
-                edge_list.append(edge_coords.tolist())
-
-        # simple pairwise checks of edges
-        # Follows discussion in  https://math.stackexchange.com/questions/80798/detecting-polygon-self-intersection 
-        for i1 in range(0, len(edge_list)):
-            for i2 in range(i1 + 1, len(edge_list)):
-                if self._is_segm_intersecting(edge_list[i1], edge_list[i2]):
-                    return True
-        
-        return False          
+                edge_list.append([start, end])
+        return edge_list
         
     def _is_segm_intersecting(self, segment1, segment2):
         """Checks wheter two segments intersect 
@@ -528,9 +1070,13 @@ class ParametrizedPattern(BasicPattern):
         Extention to BasicPattern that can work with parametrized patterns
         Update pattern with new parameter values & randomize those parameters
     """
+    normalization_kind = 'parametrized'
+
     def __init__(self, pattern_file=None):
         super(ParametrizedPattern, self).__init__(pattern_file)
         self.parameters = self.spec['parameters']
+        self.param_plan = None  # compiled on first use
+        self.template_snapshot = None  # taken on first return to template state
 
         self.parameter_defaults = {
             'length': 1,
@@ -544,7 +1090,7 @@ class ParametrizedPattern(BasicPattern):
     def param_values_list(self):
         """Returns current values of all parameters as a list in the pattern defined parameter order"""
         value_list = []
-        for parameter in self.spec['parameter_order']:
+        for parameter in self._spec['parameter_order']:
             value = self.parameters[parameter]['value']
             if isinstance(value, list):
                 value_list += value
@@ -555,11 +1101,11 @@ class ParametrizedPattern(BasicPattern):
     def apply_param_list(self, values):
         """Apply given parameters supplied as a list of param_values_list() form"""
 
-        self._restore_template(params_to_default=False)
+        self._get_template_snapshot()  # evaluation starts from template state
 
         # set new values
         value_count = 0
-        for parameter in self.spec['parameter_order']:
+        for parameter in self._spec['parameter_order']:
             last_value = self.parameters[parameter]['value']
             if isinstance(last_value, list):
                 self.parameters[parameter]['value'] = [values[value_count + i] for i in range(len(last_value))]
@@ -576,7 +1122,56 @@ class ParametrizedPattern(BasicPattern):
         super(ParametrizedPattern, self).reloadJSON()
 
         self.parameters = self.spec['parameters']
-        self._normalize_param_scaling()
+        self.param_plan = None  # edge ids might have changed
+        self.template_snapshot = None
+
+    def update_parameter(self, parameter, value, value_idx=None):
+        """Set new value of a single parameter & only re-evaluate the panels that depend on it: 
+            panels influenced by the parameter & panels connected to them by constraints.
+            Gives the same result as re-evaluation of the full pattern 
+            assuming that the pattern is in the state defined by current parameter values 
+            (e.g. after apply_param_list() or update_parameter())
+
+            * value_idx -- index of the value to update in multi-value parameters. Full value is replaced if None
+            Returns the list of re-evaluated panels
+        """
+        full_update = self.template_snapshot is None
+        if full_update:  # full evaluation is needed to get to the template state -- with the current values
+            self._get_template_snapshot()
+
+        if value_idx is not None:
+            self.parameters[parameter]['value'][value_idx] = value
+        else:
+            self.parameters[parameter]['value'] = value
+
+        if full_update:
+            self._update_pattern_by_param_values()
+            return list(self.template_snapshot)
+
+        plan = self._get_param_plan()
+        panel_names = plan.dependent_panels([parameter])
+
+        # re-evaluate dependent panels from template state
+        updated = {name: self.template_snapshot[name].copy() for name in panel_names}
+        vertices = {name: panel.vertices for name, panel in updated.items()}
+        plan.apply_parameters(
+            {param: self.parameters[param]['value'] for param in self.parameters}, 
+            vertices, {name: panel.curvatures for name, panel in updated.items()}, panels=panel_names)
+        self._record_constraint_values(plan.apply_constraints(
+            vertices, panels=panel_names, curvatures={name: panel.curvatures for name, panel in updated.items()}, 
+            arc_reference=self._arc_reference(panel_names) if plan.measures_arcs else None))
+        for name in panel_names:  # geometry is replaced
+            self.arc_length_cache.pop(name, None)
+
+        # other panels stay the same
+        if self.panels is not None:
+            panels = dict(self.panels)
+        else:
+            panels = {name: Panel.from_spec(panel) for name, panel in self.pattern['panels'].items()}
+        panels.update(updated)
+        self.panels = panels
+
+        return [name for name in plan.panel_names if name in panel_names]
 
     def _restore(self, backup_copy):
         """Restores spec structure from given backup copy 
@@ -587,6 +1182,22 @@ class ParametrizedPattern(BasicPattern):
     
     # ---------- Parameters operations --------
 
+    def _get_param_plan(self):
+        """Compiled parameter application plan of the current template. Created on first request"""
+        if self.param_plan is None:
+            self.param_plan = ParameterPlan(self.spec, self.parameter_defaults, self.constraint_types)
+        return self.param_plan
+
+    def _needs_normalization(self):
+        return (super(ParametrizedPattern, self)._needs_normalization()
+                or 'original_units_in_meter' in self.properties)
+
+    def _normalize_template(self):
+        """Template normalization including the parameters"""
+        self.parameters = self.spec['parameters']
+        super(ParametrizedPattern, self)._normalize_template()
+        self._normalize_param_scaling()
+
     def _normalize_param_scaling(self):
         """Convert additive parameters to cm units"""
 
@@ -609,16 +1220,16 @@ class ParametrizedPattern(BasicPattern):
         rotated_edge_ids, flipped = super(ParametrizedPattern, self)._normalize_edge_loop(panel_name)
 
         # Parameters
-        for parameter_name in self.spec['parameters']:
+        for parameter_name in self._spec['parameters']:
             self._influence_after_edge_loop_update(
-                self.spec['parameters'][parameter_name]['influence'], 
+                self._spec['parameters'][parameter_name]['influence'], 
                 panel_name, rotated_edge_ids)
 
         # Constraints
-        if 'constraints' in self.spec:
-            for constraint_name in self.spec['constraints']:
+        if 'constraints' in self._spec:
+            for constraint_name in self._spec['constraints']:
                 self._influence_after_edge_loop_update(
-                    self.spec['constraints'][constraint_name]['influence'], 
+                    self._spec['constraints'][constraint_name]['influence'], 
                     panel_name, rotated_edge_ids)
 
     def _influence_after_edge_loop_update(self, infl_list, panel_name, new_edge_ids):
@@ -649,33 +1260,71 @@ class ParametrizedPattern(BasicPattern):
         parameter values
         (!) Assumes that the current pattern is a template:
                 with all the parameters equal to defaults!
-        """
-        for parameter in self.spec['parameter_order']:
-            value = self.parameters[parameter]['value']
-            param_type = self.parameters[parameter]['type']
-            if param_type not in self.parameter_defaults:
-                raise ValueError("Incorrect parameter type. Alowed are "
-                                 + self.parameter_defaults.keys())
 
-            for panel_influence in self.parameters[parameter]['influence']:
-                for edge in panel_influence['edge_list']:
-                    if param_type == 'length':
-                        self._extend_edge(panel_influence['panel'], edge, value)
-                    elif param_type == 'additive_length':
-                        self._extend_edge(panel_influence['panel'], edge, value, multiplicative=False)
-                    elif param_type == 'curve':
-                        self._curve_edge(panel_influence['panel'], edge, value)
-        # finally, ensure secified constraints are held
-        self._apply_constraints()    
+        Parameters are applied with the compiled plan (see ParameterPlan)
+        on the copy of template snapshot. The resulting geometry is kept as Panel objects 
+        and the pattern spec is updated when requested
+        """
+        with metrics.span('pattern.evaluate'):
+            plan = self._get_param_plan()
+            if self.template_snapshot is None:
+                self._take_template_snapshot()  # current pattern is a template as assumed
+
+            panels = {name: panel.copy() for name, panel in self.template_snapshot.items()}
+            vertices = {name: panel.vertices for name, panel in panels.items()}
+            curvatures = {name: panel.curvatures for name, panel in panels.items()}
+            plan.apply_parameters(
+                {parameter: self.parameters[parameter]['value'] for parameter in self.parameters}, 
+                vertices, curvatures)
+            # finally, ensure secified constraints are held
+            self._record_constraint_values(plan.apply_constraints(
+                vertices, curvatures=curvatures, arc_reference=self._arc_reference() if plan.measures_arcs else None))
+            self.panels = panels  # spec is updated on request
+            self.arc_length_cache = {}  # geometry is replaced
+
+    def _arc_reference(self, panel_names=None):
+        """Panels with cached arc lengths to re-use in constraints measured by arc length: 
+            current geometry if it was measured already, template snapshot otherwise 
+            (lengths of the template are measured once and shared)"""
+        if panel_names is None:
+            panel_names = list(self.template_snapshot)
+        reference = dict(zip(panel_names, self._arc_length_panels(panel_names)))
+        for name, panel in reference.items():
+            if panel.arc_lengths is None:
+                reference[name] = self.template_snapshot[name]
+        return reference
 
     def _restore_template(self, params_to_default=True):
         """Restore pattern to it's state with all parameters having default values
             Recalculate vertex positions, edge curvatures & snap values to 1
+
+            Template state is copied from the template snapshot. 
+            The snapshot is created on the first call by following parameter application process backwards 
         """
+        if self.template_snapshot is None:
+            self._invert_param_values()
+            self._take_template_snapshot()
+        else:
+            self._reset_constraint_values()
+            self.panels = dict(self.template_snapshot)  # read-only panels could be shared
+
+        # restore defaults
+        if params_to_default:
+            for parameter in self._spec['parameter_order']:
+                value = self.parameters[parameter]['value']
+                param_type = self.parameters[parameter]['type']
+                if isinstance(value, list):
+                    self.parameters[parameter]['value'] = [self.parameter_defaults[param_type] for _ in value]
+                else:
+                    self.parameters[parameter]['value'] = self.parameter_defaults[param_type]
+
+    def _invert_param_values(self):
+        """Return pattern geometry to template state by applying inverse of current parameter values 
+            in reversed order"""
         # Follow process backwards
         self._invert_constraints()
 
-        for parameter in reversed(self.spec['parameter_order']):
+        for parameter in reversed(self._spec['parameter_order']):
             value = self.parameters[parameter]['value']
             param_type = self.parameters[parameter]['type']
             if param_type not in self.parameter_defaults:
@@ -692,13 +1341,28 @@ class ParametrizedPattern(BasicPattern):
                                           multiplicative=False)
                     elif param_type == 'curve':
                         self._curve_edge(panel_influence['panel'], edge, self._invert_value(value))
-            
-            # restore defaults
-            if params_to_default:
-                if isinstance(value, list):
-                    self.parameters[parameter]['value'] = [self.parameter_defaults[param_type] for _ in value]
-                else:
-                    self.parameters[parameter]['value'] = self.parameter_defaults[param_type]
+
+    # -- template snapshot --
+    def _take_template_snapshot(self):
+        """Save immutable copy of all panels as Panel objects
+            Assumes that the current pattern is in the template state"""
+        self.template_snapshot = {
+            name: Panel.from_spec(panel).freeze() for name, panel in self.pattern['panels'].items()}
+
+    def _get_template_snapshot(self):
+        """Template snapshot of the current pattern. Returns pattern to the template state if the snapshot is not available yet"""
+        if self.template_snapshot is None:
+            self._restore_template(params_to_default=False)
+        return self.template_snapshot
+
+    def _reset_constraint_values(self):
+        """Mark all constraints as not applied (as they are in template state)"""
+        if 'constraints' not in self._spec:  # NOTE no need to update panel geometry in spec here
+            return 
+        for constraint in self._spec['constraints'].values():
+            for panel_influence in constraint['influence']:
+                for edge in panel_influence['edge_list']:
+                    edge['value'] = 1
 
     def _extend_edge(self, panel_name, edge_influence, value, multiplicative=True):
         """
@@ -716,37 +1380,7 @@ class ParametrizedPattern(BasicPattern):
 
         verts_ids, verts_coords, target_line, _ = self._meta_edge(panel_name, edge_influence)
 
-        # calc extention pivot
-        if edge_influence['direction'] == 'end':
-            fixed = verts_coords[0]  # start is fixed
-        elif edge_influence['direction'] == 'start':
-            fixed = verts_coords[-1]  # end is fixed
-        elif edge_influence['direction'] == 'both':
-            fixed = (verts_coords[0] + verts_coords[-1]) / 2
-        else:
-            raise RuntimeError('Unknown edge extention direction {}'.format(edge_influence['direction']))
-
-        # move verts 
-        # * along target line that sits on fixed point (correct sign & distance along the line)
-        verts_projection = np.empty(verts_coords.shape)
-        for i in range(verts_coords.shape[0]):
-            verts_projection[i] = (verts_coords[i] - fixed).dot(target_line) * target_line
-
-        if multiplicative:
-            # * to match the scaled projection (correct point of application -- initial vertex position)
-            new_verts = verts_coords - (1 - value) * verts_projection
-        else:
-            # * to match the added projection: 
-            # still need projection to make sure the extention derection is corect relative to fixed point
-            
-            # normalize first
-            for i in range(verts_coords.shape[0]):
-                norm = np.linalg.norm(verts_projection[i])
-                if not np.isclose(norm, 0):
-                    verts_projection[i] /= norm
-
-            # zero projections were not normalized -- they will zero-out the effect
-            new_verts = verts_coords + value * verts_projection
+        new_verts = _extend_verts(verts_coords, target_line, edge_influence['direction'], value, multiplicative)
 
         # update in the initial structure
         panel = self.pattern['panels'][panel_name]
@@ -801,47 +1435,37 @@ class ParametrizedPattern(BasicPattern):
     def _apply_constraints(self):
         """Change the pattern to adhere to constraints if given in pattern spec
             Assumes no zero-length edges exist"""
-        if 'constraints' not in self.spec:
+        if 'constraints' not in self._spec:
             return 
 
-        for constraint_n in self.spec['constraints']:  # order preserved as it's a list
-            constraint = self.spec['constraints'][constraint_n]
-            constraint_type = constraint['type']
-            if constraint_type not in self.constraint_types:
-                raise ValueError("Incorrect constraint type. Alowed are "
-                                 + self.constraint_types)
-
-            if constraint_type == 'length_equality':
-                # get all length of the affected (meta) edges
-                target_len = []
-                for panel_influence in constraint['influence']:
-                    for edge in panel_influence['edge_list']:
-                        # TODO constraints along a custom vector are not well tested
-                        _, _, _, length = self._meta_edge(panel_influence['panel'], edge)
-                        edge['length'] = length
-                        target_len.append(length)
-                if len(target_len) == 0:
-                    return
-                # target as mean of provided edges
-                target_len = sum(target_len) / len(target_len)  
-
-                # calculate scaling factor for every edge to match max length
-                # & update edges with it
-                for panel_influence in constraint['influence']:
-                    for edge in panel_influence['edge_list']:
-                        scaling = target_len / edge['length'] 
-                        if not np.isclose(scaling, 1):
-                            edge['value'] = scaling
-                            self._extend_edge(panel_influence['panel'], edge, edge['value'])
+        panels = {name: Panel.from_spec(panel) for name, panel in self.pattern['panels'].items()}
+        self._record_constraint_values(self._get_param_plan().apply_constraints(
+            {name: panel.vertices for name, panel in panels.items()}, 
+            curvatures={name: panel.curvatures for name, panel in panels.items()}))
+        self.panels = panels
+
+    def _record_constraint_values(self, records):
+        """Save lengths & scaling factors applied to constraint edges to the pattern spec 
+            (as returned by ParameterPlan.apply_constraints())"""
+        for constraint_n, lengths, scalings in records:
+            # NOTE no need to update panel geometry in spec here
+            edges = [edge for panel_influence in self._spec['constraints'][constraint_n]['influence'] 
+                     for edge in panel_influence['edge_list']]
+            for edge, length, scaling in zip(edges, lengths, scalings):
+                edge['length'] = float(length)
+                if scaling != 1:  # exactly 1 when no update was needed
+                    edge['value'] = float(scaling)
+                elif edge['value'] != 1:  # value of earlier evaluation
+                    edge['value'] = 1
 
     def _invert_constraints(self):
         """Restore pattern to the state before constraint was applied"""
-        if 'constraints' not in self.spec:
+        if 'constraints' not in self._spec:
             return 
 
         # follow the process backwards
-        for constraint_n in reversed(self.spec['constraint_order']):  # order preserved as it's a list
-            constraint = self.spec['constraints'][constraint_n]
+        for constraint_n in reversed(self._spec['constraint_order']):  # order preserved as it's a list
+            constraint = self._spec['constraints'][constraint_n]
             constraint_type = constraint['type']
             if constraint_type not in self.constraint_types:
                 raise ValueError("Incorrect constraint type. Alowed are "
@@ -859,33 +1483,14 @@ class ParametrizedPattern(BasicPattern):
         """Returns info for the given edge or meta-edge in inified form"""
 
         panel = self.pattern['panels'][panel_name]
-        edge_ids = edge_influence['id']
-        if isinstance(edge_ids, list):
-            # meta-edge
-            # get all vertices in order
-            verts_ids = [panel['edges'][edge_ids[0]]['endpoints'][0]]  # start
-            for edge_id in edge_ids:
-                verts_ids.append(panel['edges'][edge_id]['endpoints'][1])  # end vertices
-        else:
-            # single edge
-            verts_ids = panel['edges'][edge_ids]['endpoints']
+        verts_ids = _meta_edge_verts_ids(panel['edges'], edge_influence['id'])
 
         verts_coords = []
         for idx in verts_ids:
             verts_coords.append(panel['vertices'][idx])
         verts_coords = np.array(verts_coords)
 
-        # extention line
-        if 'along' in edge_influence:
-            target_line = edge_influence['along']
-        else:
-            target_line = verts_coords[-1] - verts_coords[0] 
-        target_line = np.array(target_line, dtype=float)  # https://stackoverflow.com/questions/50625975/typeerror-ufunc-true-divide-output-typecode-d-could-not-be-coerced-to-pro
-
-        if np.isclose(np.linalg.norm(target_line), 0):
-            raise ZeroDivisionError('target line is zero ' + str(target_line))
-        else:
-            target_line /= np.linalg.norm(target_line)
+        target_line = _extention_line(verts_coords, edge_influence['along'] if 'along' in edge_influence else None)
 
         return verts_ids, verts_coords, target_line, target_line.dot(verts_coords[-1] - verts_coords[0])
 
@@ -899,35 +1504,130 @@ class ParametrizedPattern(BasicPattern):
                 self.parameters[parameter]['value'] = None
                 updated_once = True
         
-        if 'constraints' in self.spec:
-            for constraint in self.spec['constraints']:
-                for edge_collection in self.spec['constraints'][constraint]['influence']:
+        if 'constraints' in self._spec:
+            for constraint in self._spec['constraints']:
+                for edge_collection in self._spec['constraints'][constraint]['influence']:
                     for edge in edge_collection['edge_list']:
                         if edge['value'] is not None: 
                             edge['value'] = None
                             updated_once = True
+        # pattern geometry is not connected to template any more
+        self.template_snapshot = None
+
         if updated_once:
             # only display worning if some new invalidation happened
             print('ParametrizedPattern::Warning::Parameter (& constraints) values are invalidated')
 
+    # -------- Checks ------------
+    def is_self_intersecting(self, panel_names=None):
+        """returns True if any of the pattern panels are self-intersecting
+            * panel_names -- if given, only these panels are checked
+        """
+        if self.panels is None:
+            return super(ParametrizedPattern, self).is_self_intersecting(panel_names)
+        # check the Panel objects directly
+        plan = self._get_param_plan()
+        segments = plan.edge_segments(
+            {name: panel.vertices for name, panel in self.panels.items()}, 
+            {name: panel.curvatures for name, panel in self.panels.items()})
+        if panel_names is not None:
+            segments = segments[[plan.panel_names.index(name) for name in panel_names]]
+        return bool(_segments_intersecting(segments).any())
+
     # ---------- Randomization -------------
     def _randomize_pattern(self):
-        """Robustly randomize current pattern"""
-        # restore template state before making any changes to parameters
-        self._restore_template(params_to_default=False)
-
-        spec_backup = copy.deepcopy(self.spec)
-        self._randomize_parameters()
-        self._update_pattern_by_param_values()
-        for _ in range(100):  # upper bound on trials to avoid infinite loop
-            if not self.is_self_intersecting():
-                break
+        """Robustly randomize current pattern.
+            Returns the number of rejected (self-intersecting) designs"""
+        # template state is needed before making any changes to parameters
+        # NOTE: every parameter evaluation starts from template snapshot, hence no need to backup&restore on re-tries
+        self._get_template_snapshot()
 
-            print('Warning::Randomized pattern is self-intersecting. Re-try..')
-            self._restore(spec_backup)
-            # Try again
+        with metrics.span('pattern.randomize'):
             self._randomize_parameters()
             self._update_pattern_by_param_values()
+            retries = 0
+            for _ in range(100):  # upper bound on trials to avoid infinite loop
+                if not self.is_self_intersecting():
+                    break
+
+                metrics.count('pattern.randomize.retries')
+                retries += 1
+                # Try again
+                self._randomize_parameters()
+                self._update_pattern_by_param_values()
+        return retries
+
+    def sample_batch(self, n, seed=None, chunk_size=4096):
+        """Sample n random designs from current template in one vectorized pass
+            * Parameter values are drawn uniformly from parameter ranges (as in _randomize_parameters())
+            * Designs are evaluated as stacked arrays, without creating pattern objects or 
+                changing the current pattern. chunk_size designs are evaluated at once to bound the memory use
+            * Designs with self-intersecting panels or zero-length edges are not re-sampled but marked as invalid
+
+            Returns dictionary with
+                * 'panels' -- panel names in the order of panel_order()
+                * 'parameters' -- (n, num_values) parameter values in the format of param_values_list()
+                * 'vertices' -- (n, num_panels, max_num_verts, 2) panel vertices padded with zeros
+                * 'curvatures' -- (n, num_panels, max_num_edges, 2) relative curvature coordinates of edges. 
+                    Zeros for straight edges and padding
+                * 'num_vertices', 'num_edges' -- (num_panels, ) number of non-padded vertices & edges of each panel
+                * 'valid' -- (n, ) boolean mask of designs without self-intersecting panels or zero-length edges
+        """
+        if self.template_snapshot is None:
+            self._get_template_snapshot()
+            self._update_pattern_by_param_values()  # back to current parameter values
+        plan = self._get_param_plan()
+
+        # parameter values
+        ranges = []
+        for parameter in self._spec['parameter_order']:
+            param_ranges = self.parameters[parameter]['range']
+            if isinstance(self.parameters[parameter]['value'], list):
+                ranges += param_ranges
+            else:
+                ranges.append(param_ranges)
+        ranges = np.array(ranges, dtype=float).reshape(-1, 2)
+
+        rng = np.random.default_rng(seed)
+        values = rng.uniform(ranges[:, 0], ranges[:, 1], size=(n, len(ranges)))
+        # prevent non-reversible zero values
+        small = np.abs(values) < 1e-2
+        values[small] = np.where(values[small] < 0, -1e-2, 1e-2)
+
+        snapshot = self.template_snapshot
+        panel_names = self.panel_order()
+        num_vertices = np.array([len(snapshot[name].vertices) for name in panel_names])
+        num_edges = np.array([len(snapshot[name].endpoints) for name in panel_names])
+        stacked_verts = np.zeros((n, len(panel_names), max(num_vertices, default=0), 2))
+        stacked_curvatures = np.zeros((n, len(panel_names), max(num_edges, default=0), 2))
+        valid = np.empty(n, dtype=bool)
+
+        # evaluate chunk by chunk
+        for start in range(0, n, chunk_size):
+            chunk = slice(start, min(start + chunk_size, n))
+            size = chunk.stop - chunk.start
+            vertices = {name: np.repeat(panel.vertices[np.newaxis], size, axis=0) for name, panel in snapshot.items()}
+            curvatures = {name: np.repeat(panel.curvatures[np.newaxis], size, axis=0) for name, panel in snapshot.items()}
+            invalid = np.zeros(size, dtype=bool)
+            plan.apply_parameters(plan.values_from_list(values[chunk]), vertices, curvatures, invalid=invalid)
+            plan.apply_constraints(vertices, curvatures=curvatures, invalid=invalid)
+
+            valid[chunk] = ~invalid & ~_segments_intersecting(plan.edge_segments(vertices, curvatures)).any(axis=-1)
+
+            # stack
+            for panel_id, name in enumerate(panel_names):
+                stacked_verts[chunk, panel_id, :num_vertices[panel_id]] = vertices[name]
+                stacked_curvatures[chunk, panel_id, :num_edges[panel_id]] = curvatures[name]
+
+        return {
+            'panels': list(panel_names),
+            'parameters': values,
+            'vertices': stacked_verts,
+            'curvatures': stacked_curvatures,
+            'num_vertices': num_vertices,
+            'num_edges': num_edges,
+            'valid': valid
+        }
 
     def _new_value(self, param_range):
         """Random value within range given as an iteratable"""
@@ -955,6 +1655,636 @@ class ParametrizedPattern(BasicPattern):
                 self.parameters[parameter]['value'] = self._new_value(param_ranges)
 
 
+# ------------ Parameter application --------
+_zero_tol = 1e-8  # equivalent of np.isclose(value, 0) with default tolerances, but without its overhead on scalars
+
+
+def _meta_edge_verts_ids(edges, edge_ids):
+    """List of vertex ids of the given edge or meta-edge (list of edge ids) in traversal order"""
+    if isinstance(edge_ids, list):
+        # meta-edge
+        # get all vertices in order
+        verts_ids = [edges[edge_ids[0]]['endpoints'][0]]  # start
+        for edge_id in edge_ids:
+            verts_ids.append(edges[edge_id]['endpoints'][1])  # end vertices
+    else:
+        # single edge
+        verts_ids = edges[edge_ids]['endpoints']
+    return verts_ids
+
+
+def _extention_line(verts_coords, along=None, invalid=None):
+    """Unit vector of the extention direction of (meta-)edge given by vertex coordinates.
+        Follows edge chord unless 'along' direction is provided
+        * Supports batches of (meta-)edges: verts_coords of shape (..., num_verts, 2)
+        * invalid -- (...) boolean array of the batch. If given, zero-length lines mark their batch elements 
+            as invalid (in-place) & are returned as zero vectors instead of raising ZeroDivisionError
+    """
+    if along is not None:
+        target_line = along
+    else:
+        target_line = verts_coords[..., -1, :] - verts_coords[..., 0, :] 
+    target_line = np.array(target_line, dtype=float)  # https://stackoverflow.com/questions/50625975/typeerror-ufunc-true-divide-output-typecode-d-could-not-be-coerced-to-pro
+
+    norm = np.sqrt((target_line * target_line).sum(axis=-1, keepdims=True))
+    zero = norm <= _zero_tol
+    if zero.any():
+        if invalid is None:
+            raise ZeroDivisionError('target line is zero ' + str(target_line))
+        invalid |= zero[..., 0]
+        norm = np.where(zero, 1, norm)
+    target_line /= norm
+
+    return target_line
+
+
+def _extend_verts(verts_coords, target_line, direction, value, multiplicative=True):
+    """Shrink/elongate (meta-)edge given by its vertices along target_line. Returns new vertex coordinates.
+        'multiplicative' parameter controls the type of extention:
+            * if True, value is treated as a scaling factor of the edge or edge projection -- default
+            * if False, value is added to the edge or edge projection
+        * Supports batches of (meta-)edges: verts_coords of shape (..., num_verts, 2) 
+            with target_line of shape (..., 2) and value of shape (...)
+    """
+    # calc extention pivot
+    if direction == 'end':
+        fixed = verts_coords[..., :1, :]  # start is fixed
+    elif direction == 'start':
+        fixed = verts_coords[..., -1:, :]  # end is fixed
+    elif direction == 'both':
+        fixed = (verts_coords[..., :1, :] + verts_coords[..., -1:, :]) / 2
+    else:
+        raise RuntimeError('Unknown edge extention direction {}'.format(direction))
+
+    # move verts 
+    # * along target line that sits on fixed point (correct sign & distance along the line)
+    target_line = target_line[..., np.newaxis, :]
+    verts_projection = ((verts_coords - fixed) * target_line).sum(axis=-1, keepdims=True) * target_line
+    value = np.asarray(value)[..., np.newaxis, np.newaxis]
+
+    if multiplicative:
+        # * to match the scaled projection (correct point of application -- initial vertex position)
+        return verts_coords - (1 - value) * verts_projection
+
+    # * to match the added projection: 
+    # still need projection to make sure the extention derection is corect relative to fixed point
+    # normalize first
+    norms = np.sqrt((verts_projection * verts_projection).sum(axis=-1, keepdims=True))
+    non_zero = norms > _zero_tol
+    verts_projection = np.where(non_zero, verts_projection / np.where(non_zero, norms, 1), verts_projection)
+
+    # zero projections were not normalized -- they will zero-out the effect
+    return verts_coords + value * verts_projection
+
+
+def _segments_intersecting(segments):
+    """Checks whatever any pair of segments intersect in the points interior to both segments
+        * Same test as BasicPattern._is_segm_intersecting() evaluated for all the pairs at once 
+            by broadcasting segments of shape (..., num_segments, 2, 2) against each other
+        * Returns boolean array of shape (...)
+    """
+    # Follows discussion in  https://math.stackexchange.com/questions/80798/detecting-polygon-self-intersection 
+    num_segments = segments.shape[-3]
+    starts = segments[..., :, 0, :]
+    ends = segments[..., :, 1, :]
+
+    def ccw(start, end, point):
+        """Orientation test of BasicPattern._is_segm_intersecting() for arrays of points"""
+        return ((end[..., 0] - start[..., 0]) * (point[..., 1] - start[..., 1]) 
+                - (point[..., 0] - start[..., 0]) * (end[..., 1] - start[..., 1]))
+
+    # [..., i, j] -- orientation of points of segment j w.r.t. segment i
+    s_i, e_i = starts[..., :, np.newaxis, :], ends[..., :, np.newaxis, :]
+    s_j, e_j = starts[..., np.newaxis, :, :], ends[..., np.newaxis, :, :]
+    # == 0 for edges sharing a vertex
+    straddles = ~(ccw(s_i, e_i, s_j) * ccw(s_i, e_i, e_j) >= 0)
+    intersecting = straddles & np.swapaxes(straddles, -1, -2)
+
+    # Each pair is only checked once
+    pairs = np.triu(np.ones((num_segments, num_segments), dtype=bool), k=1)
+    return (intersecting & pairs).any(axis=(-1, -2))
+
+
+class ParameterPlan(object):
+    """
+        Parameter application compiled from the structure of a parametrized pattern template.
+        Influence lists of parameters & constraints are converted to vertex index arrays once per template, 
+        s.t. the evaluation for new parameter values only runs numpy operations on per-panel vertex arrays 
+        and updates the pattern spec once at the end.
+
+        Plan only depends on the template structure (parameter order, influences & edge ids), 
+        not on the parameter values, so it could be shared by all the patterns created from the same template
+
+        All evaluation routines support batches: per-panel arrays of shape (batch_size, num_verts, 2) 
+        together with parameter values of shape (batch_size, ) (or (batch_size, num_values) for multi-value parameters)
+    """
+    def __init__(self, spec, parameter_types, constraint_types):
+        panels = spec['pattern']['panels']
+
+        # panel edges as straight segments (see edge_segments())
+        self.panel_names = list(panels)
+        self._segment_layout(panels)
+
+        # (parameter name, parameter type, influence operations)
+        self.parameter_steps = []
+        # number of values for each parameter in order
+        self.value_sizes = []
+        for parameter in spec['parameter_order']:
+            param_type = spec['parameters'][parameter]['type']
+            if param_type not in parameter_types:
+                raise ValueError('Incorrect parameter type {} of {}. Alowed are {}'.format(
+                    param_type, parameter, list(parameter_types)))
+            value = spec['parameters'][parameter]['value']
+            self.value_sizes.append(len(value) if isinstance(value, list) else 1)
+
+            operations = []
+            for panel_influence in spec['parameters'][parameter]['influence']:
+                panel_name = panel_influence['panel']
+                for edge in panel_influence['edge_list']:
+                    if param_type == 'curve':
+                        if 'curvature' not in panels[panel_name]['edges'][edge]:
+                            raise ValueError('Applying curvature scaling to non-curvy edge '
+                                             + str(edge) + ' of ' + panel_name)
+                        operations.append((panel_name, edge))
+                    else:
+                        operations.append(self._length_operation(panels[panel_name], panel_name, edge))
+            self.parameter_steps.append((parameter, param_type, operations))
+
+        # (constraint name, operations for all edges of all constraint influences in order)
+        self.constraint_steps = []
+        # panel edge ids of every (meta-)edge of the constraints measured by arc length, None for the other constraints
+        self.constraint_arc_edges = []
+        if 'constraints' in spec:
+            for constraint_n in spec['constraints']:  
+                constraint = spec['constraints'][constraint_n]
+                if constraint['type'] not in constraint_types:
+                    raise ValueError('Incorrect constraint type {} of {}. Alowed are {}'.format(
+                        constraint['type'], constraint_n, constraint_types))
+                measure = constraint['measure'] if 'measure' in constraint else 'chord'
+                if measure not in ['chord', 'arc_length']:
+                    raise ValueError('Unknown length measure {} of {}. Alowed are chord, arc_length'.format(
+                        measure, constraint_n))
+                operations, arc_edges = [], []
+                for panel_influence in constraint['influence']:
+                    for edge in panel_influence['edge_list']:
+                        operations.append(self._length_operation(
+                            panels[panel_influence['panel']], panel_influence['panel'], edge))
+                        arc_edges.append(np.array(edge['id'] if isinstance(edge['id'], list) else [edge['id']], dtype=int))
+                self.constraint_steps.append((constraint_n, operations))
+                self.constraint_arc_edges.append(arc_edges if measure == 'arc_length' else None)
+        self.measures_arcs = any(arc_edges is not None for arc_edges in self.constraint_arc_edges)
+
+        # dependencies: panels influenced by every parameter & constraint
+        self.parameter_panels = {
+            parameter: set(operation[0] for operation in operations) for parameter, _, operations in self.parameter_steps}
+        self.constraint_panels = [set(operation[0] for operation in operations) for _, operations in self.constraint_steps]
+        # constraints evaluation compiled for a particular subset of constraints (see apply_constraints())
+        self.constraint_stages = {}
+
+    def _segment_layout(self, panels):
+        """Ids of edge vertices & segment points for edge_segments() in the stacked arrays of all panels"""
+        edge_starts, edge_ends, panel_segments = [], [], []
+        vert_offset = 0
+        self.panel_vert_counts = {}
+        self.panel_endpoints = {}
+        for name in self.panel_names:
+            panel = panels[name]
+            self.panel_vert_counts[name] = len(panel['vertices'])
+            self.panel_endpoints[name] = np.array([edge['endpoints'] for edge in panel['edges']], dtype=int).reshape(-1, 2)
+            segments = []
+            for edge in panel['edges']:
+                edge_id = len(edge_starts)  # id in the list of all edges
+                edge_starts.append(vert_offset + edge['endpoints'][0])
+                edge_ends.append(vert_offset + edge['endpoints'][1])
+                if 'curvature' in edge:
+                    # view curvy edge as two segments through control point
+                    segments.append(('start', edge_id, 'control', edge_id))
+                    segments.append(('control', edge_id, 'end', edge_id))
+                else:
+                    segments.append(('start', edge_id, 'end', edge_id))
+            panel_segments.append(segments)
+            vert_offset += len(panel['vertices'])
+
+        # points are stacked as [starts, controls, ends, padding zero]
+        num_edges = len(edge_starts)
+        point_offsets = {'start': 0, 'control': num_edges, 'end': 2 * num_edges}
+        pad_id = 3 * num_edges
+        max_segments = max(map(len, panel_segments), default=0)
+        self.segment_points = np.full((len(panel_segments), max_segments, 2), pad_id, dtype=np.int32)
+        for panel_id, segments in enumerate(panel_segments):
+            for segm_id, (first, first_edge, second, second_edge) in enumerate(segments):
+                self.segment_points[panel_id, segm_id] = [
+                    point_offsets[first] + first_edge, point_offsets[second] + second_edge]
+        self.edge_starts = np.array(edge_starts, dtype=np.int32)
+        self.edge_ends = np.array(edge_ends, dtype=np.int32)
+
+    # ----- Dependencies -----
+    def dependent_panels(self, parameters):
+        """Panels that need to be re-evaluated when values of given parameters change: 
+            panels influenced by the parameters and all the panels connected to them through constraints
+            (constraint result depends on all the edges it includes)"""
+        panels = set()
+        for parameter in parameters:
+            panels |= self.parameter_panels[parameter]
+
+        updated = True
+        while updated:
+            updated = False
+            for constraint_panels in self.constraint_panels:
+                if constraint_panels & panels and not constraint_panels <= panels:
+                    panels |= constraint_panels
+                    updated = True
+        return panels
+
+    # ----- Evaluation -----
+    def edge_segments(self, vertices, curvatures):
+        """Edges of all panels as straight segments of shape (..., num_panels, max_num_segments, 2, 2)
+            * Curvy edges are viewed as two segments through Bezier control point (as in BasicPattern._panel_edge_list())
+            * Panels follow the order of the template. Panels with less segments are padded with degenerate zero-length segments
+            * curvatures of straight edges are ignored
+        """
+        verts = np.concatenate([vertices[name] for name in self.panel_names], axis=-2)
+        curvs = np.concatenate([curvatures[name] for name in self.panel_names], axis=-2)
+        starts = verts[..., self.edge_starts, :]
+        ends = verts[..., self.edge_ends, :]
+
+        controls = bezier.control_points(starts, ends, curvs)
+
+        padding = np.zeros(starts.shape[:-2] + (1, 2))
+        points = np.concatenate([starts, controls, ends, padding], axis=-2)
+        return points[..., self.segment_points, :]
+
+    def values_from_list(self, value_list):
+        """Parameter values as dictionary from list of values given in parameter order (as ParametrizedPattern.param_values_list())
+            * Batched value lists of shape (..., num_values) are also supported
+        """
+        values = {}
+        value_count = 0
+        for (parameter, _, _), size in zip(self.parameter_steps, self.value_sizes):
+            if size > 1:
+                values[parameter] = value_list[..., value_count:value_count + size]
+            else:
+                values[parameter] = value_list[..., value_count]
+            value_count += size
+        return values
+
+    def apply_parameters(self, values, vertices, curvatures, panels=None, invalid=None):
+        """Apply parameter values to panel arrays (in-place) following the parameter order
+            * values -- dictionary of parameter values
+            * panels -- if given, only the influence on these panels is evaluated 
+                (vertices & curvatures are only expected to contain these panels)
+            * invalid -- boolean array of the batch shape. If given, designs with zero-length (meta-)edges 
+                are marked in it (in-place) instead of raising ZeroDivisionError
+        """
+        for (parameter, param_type, operations), size in zip(self.parameter_steps, self.value_sizes):
+            if panels is not None:
+                if not self.parameter_panels[parameter] & panels:
+                    continue
+                operations = [operation for operation in operations if operation[0] in panels]
+            value = values[parameter]
+            if param_type == 'curve':
+                value = np.asarray(value, dtype=float)
+                for panel_name, edge in operations:
+                    if size > 1:
+                        curvatures[panel_name][..., edge, :] *= value[..., :2]
+                    else:
+                        curvatures[panel_name][..., edge, 1] *= value
+            else:
+                if size > 1:
+                    raise ValueError("Multiple scaling factors are not supported")
+                for operation in operations:
+                    self._extend(vertices, operation, value, multiplicative=(param_type == 'length'), invalid=invalid)
+
+    def apply_constraints(self, vertices, panels=None, curvatures=None, invalid=None, arc_reference=None):
+        """Change panel arrays (in-place) to adhere to constraints 
+            Returns the list of measured lengths & applied scaling factors as (constraint name, lengths, scalings) 
+            Assumes no zero-length edges exist
+            * panels -- if given, only constraints on these panels are evaluated. 
+                Expects the set closed w.r.t. constraints (see dependent_panels())
+            * curvatures -- panel curvature arrays. Only needed for constraints measured by arc length 
+                ('measure': 'arc_length' in constraint spec). 
+                NOTE the scaling matches arc lengths exactly for single edges, and approximately for meta-edges
+            * invalid -- boolean array of the batch shape. If given, designs with zero-length (meta-)edges 
+                are marked in it (in-place) instead of raising ZeroDivisionError. Geometry of such designs is not meaningful
+            * arc_reference -- Panel objects with earlier geometry of the panels (e.g. before the parameter update). 
+                Arc lengths cached in them (see measure_arc_lengths()) are re-used for the edges that did not change. 
+                Only used for a single design (not batched vertices)
+
+            All the constraints are solved at once on the stacked vertices of constrained panels 
+            with the index arrays compiled in _compile_constraints()
+        """
+        constraint_ids = []
+        for constraint_id, (_, operations) in enumerate(self.constraint_steps):  # order preserved as it's a list
+            if len(operations) == 0:
+                break
+            if panels is None or self.constraint_panels[constraint_id] <= panels:
+                constraint_ids.append(constraint_id)
+        if not constraint_ids:
+            return []
+
+        constraint_ids = tuple(constraint_ids)
+        if constraint_ids not in self.constraint_stages:
+            self.constraint_stages[constraint_ids] = self._compile_constraints(constraint_ids)
+        panel_slices, stages = self.constraint_stages[constraint_ids]
+
+        verts = np.concatenate([vertices[name] for name, _, _ in panel_slices], axis=-2)
+        if any(stage['arc_sums'] is not None for stage in stages):
+            if curvatures is None:
+                raise ValueError('ParameterPlan::Error::Curvatures are needed to measure constraints by arc length')
+            curvs = np.concatenate([curvatures[name] for name, _, _ in panel_slices], axis=-2)
+            if arc_reference is not None and verts.ndim == 2:
+                reference = [arc_reference[name] for name, _, _ in panel_slices]
+                ref_verts = np.concatenate([panel.vertices for panel in reference])
+                ref_curvs = np.concatenate([panel.curvatures for panel in reference])
+                ref_arcs = np.concatenate(measure_arc_lengths(reference))
+            else:
+                reference = None
+        records = []
+        for stage in stages:
+            first = verts[..., stage['first'], :]
+            last = verts[..., stage['last'], :]
+
+            # get all length of the affected (meta) edges
+            # TODO constraints along a custom vector are not well tested
+            lines = self._extention_lines(first, last, stage['along'], stage['has_along'], invalid)
+            lengths = (lines * (last - first)).sum(axis=-1)
+            if stage['arc_sums'] is not None:
+                # sums of arc lengths of panel edges of the (meta-)edges
+                starts = verts[..., stage['arc_starts'], :]
+                ends = verts[..., stage['arc_ends'], :]
+                edge_curvs = curvs[..., stage['arc_curvatures'], :]
+                if reference is not None:  # only measure the edges that changed
+                    arcs = ref_arcs[stage['arc_curvatures']]
+                    changed = ((starts != ref_verts[stage['arc_starts']]).any(axis=-1) 
+                               | (ends != ref_verts[stage['arc_ends']]).any(axis=-1)
+                               | (edge_curvs != ref_curvs[stage['arc_curvatures']]).any(axis=-1))
+                    if changed.any():
+                        arcs[changed] = bezier.arc_lengths(starts[changed], ends[changed], edge_curvs[changed])
+                else:
+                    arcs = bezier.arc_lengths(starts, ends, edge_curvs)
+                lengths = np.where(stage['arc'], np.matmul(arcs, stage['arc_sums']), lengths)
+
+            # target as mean of provided edges of each constraint
+            # & scaling factor for every edge to match it
+            if invalid is not None:
+                zero = np.abs(lengths) <= _zero_tol
+                invalid |= zero.any(axis=-1)
+                lengths = np.where(zero, 1., lengths)
+            scalings = np.empty_like(lengths)
+            for _, edges in stage['constraints']:
+                target_len = lengths[..., edges].sum(axis=-1, keepdims=True) / (edges.stop - edges.start)
+                scalings[..., edges] = target_len / lengths[..., edges]
+            scalings = np.where(np.isclose(scalings, 1), 1., scalings)  # no update needed
+
+            for constraint_n, edges in stage['constraints']:
+                records.append((
+                    constraint_n, 
+                    [lengths[..., edge_id] for edge_id in range(edges.start, edges.stop)], 
+                    [scalings[..., edge_id] for edge_id in range(edges.start, edges.stop)]))
+
+            # update edges. Groups of edges with shared vertices are updated one after another
+            for edge_ids, vert_ids, vert_edges in stage['groups']:
+                if len(stage['groups']) > 1:  # need current positions
+                    first = verts[..., stage['first'][edge_ids], :]
+                    last = verts[..., stage['last'][edge_ids], :]
+                    lines = self._extention_lines(
+                        first, last, stage['along'][edge_ids], stage['has_along'][edge_ids], invalid)
+
+                # see _extend_verts()
+                fixed = np.where(
+                    stage['fixed_start'][edge_ids, np.newaxis], first, 
+                    np.where(stage['fixed_end'][edge_ids, np.newaxis], last, (first + last) / 2))
+                verts_coords = verts[..., vert_ids, :]
+                target_line = lines[..., vert_edges, :]
+                verts_projection = ((verts_coords - fixed[..., vert_edges, :]) * target_line).sum(axis=-1, keepdims=True) * target_line
+                verts[..., vert_ids, :] = verts_coords - (1 - scalings[..., edge_ids][..., vert_edges, np.newaxis]) * verts_projection
+
+        for name, start, end in panel_slices:
+            vertices[name][...] = verts[..., start:end, :]
+        return records
+
+    def _compile_constraints(self, constraint_ids):
+        """Index arrays to solve given constraints (ordered list of ids) on stacked vertices of constrained panels. 
+            Returns 
+                * panel_slices -- (panel name, start, end) of panel vertices in stacked vertex array
+                * evaluation stages: consecutive constraints that have no shared vertices 
+                    could be evaluated together. Otherwise the later constraint would be measured after the update
+                    of the former one
+        """
+        # stacked vertices of all constrained panels
+        names = [name for name in self.panel_names if any(
+            name in self.constraint_panels[constraint_id] for constraint_id in constraint_ids)]
+        offsets, panel_slices, offset = {}, [], 0
+        edge_offsets, edge_offset = {}, 0  # for stacked curvatures
+        for name in names:
+            num_verts = self.panel_vert_counts[name]
+            offsets[name] = offset
+            panel_slices.append((name, offset, offset + num_verts))
+            offset += num_verts
+            edge_offsets[name] = edge_offset
+            edge_offset += len(self.panel_endpoints[name])
+
+        # group constraints into stages
+        stages_constraints, stage_verts = [], set()
+        for constraint_id in constraint_ids:
+            operations = self.constraint_steps[constraint_id][1]
+            constraint_verts = set(
+                offsets[panel_name] + vert_id for panel_name, verts_ids, _, _ in operations for vert_id in verts_ids)
+            if not stages_constraints or constraint_verts & stage_verts:
+                stages_constraints.append([])
+                stage_verts = set()
+            stages_constraints[-1].append(constraint_id)
+            stage_verts |= constraint_verts
+
+        stages = []
+        for stage_constraints in stages_constraints:
+            stage = {'constraints': [], 'first': [], 'last': [], 'along': [], 'has_along': [], 'fixed_start': [], 'fixed_end': [], 
+                     'arc': [], 'arc_starts': [], 'arc_ends': [], 'arc_curvatures': [], 'arc_owners': []}
+            edge_verts = []
+            for constraint_id in stage_constraints:
+                constraint_n, operations = self.constraint_steps[constraint_id]
+                arc_edges = self.constraint_arc_edges[constraint_id]
+                start = len(stage['first'])
+                for op_id, (panel_name, verts_ids, direction, along) in enumerate(operations):
+                    stage['arc'].append(arc_edges is not None)
+                    if arc_edges is not None:
+                        endpoints = self.panel_endpoints[panel_name][arc_edges[op_id]]
+                        stage['arc_starts'] += list(offsets[panel_name] + endpoints[:, 0])
+                        stage['arc_ends'] += list(offsets[panel_name] + endpoints[:, 1])
+                        stage['arc_curvatures'] += list(edge_offsets[panel_name] + arc_edges[op_id])
+                        stage['arc_owners'] += [len(stage['first'])] * len(arc_edges[op_id])
+                    global_ids = offsets[panel_name] + verts_ids
+                    edge_verts.append(global_ids)
+                    stage['first'].append(global_ids[0])
+                    stage['last'].append(global_ids[-1])
+                    stage['has_along'].append(along is not None)
+                    stage['along'].append(along if along is not None else [0., 0.])
+                    stage['fixed_start'].append(direction == 'end')  # start is fixed
+                    stage['fixed_end'].append(direction == 'start')  # end is fixed
+                stage['constraints'].append((constraint_n, slice(start, len(stage['first']))))
+            for key in ['first', 'last', 'arc_starts', 'arc_ends', 'arc_curvatures']:
+                stage[key] = np.array(stage[key], dtype=int)
+            for key in ['has_along', 'fixed_start', 'fixed_end', 'arc']:
+                stage[key] = np.array(stage[key], dtype=bool)
+            stage['along'] = np.array(stage['along'], dtype=float).reshape(-1, 2)
+            # (num arc edges, num constraint edges) matrix to sum arc lengths of edges into (meta-)edge lengths
+            stage['arc_sums'] = None
+            if stage['arc'].any():
+                stage['arc_sums'] = np.zeros((len(stage['arc_owners']), len(stage['first'])))
+                stage['arc_sums'][np.arange(len(stage['arc_owners'])), stage['arc_owners']] = 1
+            del stage['arc_owners']
+
+            # groups of edges without shared vertices that are updated at once
+            groups, group_verts = [], set()
+            for edge_id, verts_ids in enumerate(edge_verts):
+                if not groups or group_verts & set(verts_ids):
+                    groups.append([])
+                    group_verts = set()
+                groups[-1].append(edge_id)
+                group_verts |= set(verts_ids)
+            stage['groups'] = []
+            for group in groups:
+                vert_ids = np.concatenate([edge_verts[edge_id] for edge_id in group])
+                # id of edge within the group for every vertex
+                vert_edges = np.concatenate([np.full(len(edge_verts[edge_id]), idx) for idx, edge_id in enumerate(group)])
+                stage['groups'].append((np.array(group), vert_ids, vert_edges))
+            stages.append(stage)
+
+        return panel_slices, stages
+
+    # ----- Utils -----
+    @staticmethod
+    def _length_operation(panel, panel_name, edge_influence):
+        """Length parameter influence on a (meta-)edge in a form of
+            (panel name, vertex ids, extention direction, fixed extention line or None)"""
+        verts_ids = np.array(_meta_edge_verts_ids(panel['edges'], edge_influence['id']))
+        if edge_influence['direction'] not in ['start', 'end', 'both']:
+            raise RuntimeError('Unknown edge extention direction {}'.format(edge_influence['direction']))
+        along = _extention_line(None, edge_influence['along']) if 'along' in edge_influence else None
+
+        return panel_name, verts_ids, edge_influence['direction'], along
+
+    @staticmethod
+    def _extention_lines(first, last, along, has_along, invalid=None):
+        """Extention lines of multiple (meta-)edges given by their end vertices, see _extention_line()
+            'along' directions are expected to be normalized already"""
+        lines = last - first
+        norm = np.sqrt((lines * lines).sum(axis=-1, keepdims=True))
+        zero = norm[..., ~has_along, 0] <= _zero_tol
+        if zero.any():
+            if invalid is None:
+                raise ZeroDivisionError('target line is zero ' + str(lines))
+            invalid |= zero.any(axis=-1)
+        return np.where(has_along[:, np.newaxis], along, lines / np.where(norm > 0, norm, 1))
+
+    @staticmethod
+    def _extend(vertices, operation, value, multiplicative=True, invalid=None):
+        panel_name, verts_ids, direction, along = operation
+        verts_coords = vertices[panel_name][..., verts_ids, :]
+        target_line = along if along is not None else _extention_line(verts_coords, invalid=invalid)
+
+        vertices[panel_name][..., verts_ids, :] = _extend_verts(
+            verts_coords, target_line, direction, value, multiplicative)
+
+
+# ------------ Datasets as tensors --------
+def dataset_as_tensors(dataset_path, out_file=None):
+    """Convert all pattern specifications of a dataset folder into stacked tensors
+        (as returned by BasicPattern.pattern_as_tensors() with all the options enabled) 
+        padded to the max number of panels, edges & stitches in the dataset, 
+        s.t. the dataset could be loaded at once without parsing JSON files of each datapoint
+
+        * Specifications are searched in both datapoint subfolders & dataset root (see BasicPattern.serialize()), 
+            template specification is skipped
+        * Saves the result as .npz archive to out_file if given
+        Returns dictionary of arrays, with datapoint names in 'names' 
+            and arc lengths of all the edges (num_datapoints, max_panels, max_edges) in 'edge_arc_lengths'
+    """
+    patterns = dataset_patterns(dataset_path)
+
+    # padding sizes
+    max_panels = max([len(pattern.pattern['panels']) for pattern in patterns], default=0)
+    max_edges = max([len(panel['edges']) for pattern in patterns for panel in pattern.pattern['panels'].values()], default=0)
+    max_stitches = max([len(pattern.pattern['stitches']) for pattern in patterns], default=0)
+
+    keys = ['panels', 'num_panels', 'rotations', 'translations', 'stitches', 'num_stitches', 'stitch_tags']
+    tensors = [pattern.pattern_as_tensors(
+        pad_panels_to_len=max_edges, pad_panels_num=max_panels, pad_stitches_num=max_stitches,
+        with_placement=True, with_stitches=True, with_stitch_tags=True) for pattern in patterns]
+    dataset = {key: np.array([pattern_tensors[idx] for pattern_tensors in tensors]) for idx, key in enumerate(keys)}
+    # for dataset statistics
+    # for dataset statistics: cached arc lengths of the panels (see BasicPattern.edge_arc_lengths()), measured at once
+    panels = [pattern._arc_length_panels(pattern.panel_order()) for pattern in patterns]
+    measure_arc_lengths([panel for pattern_panels in panels for panel in pattern_panels])
+    dataset['edge_arc_lengths'] = np.zeros(dataset['panels'].shape[:-1])
+    for pattern_id, pattern_panels in enumerate(panels):
+        for panel_id, panel in enumerate(pattern_panels):
+            dataset['edge_arc_lengths'][pattern_id, panel_id, :len(panel.arc_lengths)] = panel.arc_lengths
+    dataset['names'] = np.array([pattern.name for pattern in patterns])
+
+    if out_file is not None:
+        np.savez(out_file, **dataset)
+    return dataset
+
+
+def dataset_panel_outlines(dataset_path, out_file=None, curve_samples=10):
+    """World-space panel outlines (see BasicPattern.panel_outlines_3D()) of all pattern specifications of a dataset folder
+        s.t. 3D pattern geometry is available to offline tools without Maya
+
+        * Specifications are found as in dataset_as_tensors()
+        * Saves the result as .npz archive to out_file if given
+        Returns dictionary of arrays: 
+            * 'points' -- (total_num_points, 3) outline points of all panels of all datapoints
+            * 'panel_num_points' -- number of points of each panel (panels in panel_order() of each datapoint)
+            * 'panel_names' -- names of the panels
+            * 'num_panels' -- number of panels of each datapoint
+            * 'names' -- datapoint names
+    """
+    patterns = dataset_patterns(dataset_path)
+
+    points, panel_num_points, panel_names = [], [], []
+    for pattern in patterns:
+        panel_order = pattern.panel_order()
+        pattern_points, counts = pattern._outline_points(panel_order, curve_samples)
+        points.append(pattern_points)
+        panel_num_points.append(counts)
+        panel_names += panel_order
+
+    dataset = {
+        'points': np.concatenate(points) if points else np.zeros((0, 3)),
+        'panel_num_points': np.concatenate(panel_num_points) if panel_num_points else np.zeros(0, dtype=int),
+        'panel_names': np.array(panel_names),
+        'num_panels': np.array([len(pattern.pattern['panels']) for pattern in patterns], dtype=int),
+        'names': np.array([pattern.name for pattern in patterns])
+    }
+
+    if out_file is not None:
+        np.savez(out_file, **dataset)
+    return dataset
+
+
+def dataset_spec_files(dataset_path):
+    """Pattern specification files of a dataset folder with names of their samples, 
+        searching in both datapoint subfolders & dataset root (see BasicPattern.serialize()), skipping the template"""
+    dataset_path = Path(dataset_path)
+    spec_files = sorted(dataset_path.glob('*/specification.json')) + sorted(
+        path for path in dataset_path.glob('*_specification.json') 
+        if not path.name.endswith('_template_specification.json'))
+    return [
+        (path, path.parent.name if path.name == 'specification.json' else path.name[:-len('_specification.json')]) 
+        for path in spec_files]
+
+
+def dataset_patterns(dataset_path):
+    """Load all pattern specifications of a dataset folder (see dataset_spec_files())"""
+    patterns = []
+    for path, name in dataset_spec_files(dataset_path):
+        pattern = BasicPattern(str(path))
+        pattern.name = name
+        patterns.append(pattern)
+    return patterns
+
+
 # ---------- test -------------
 if __name__ == "__main__":
     import customconfig
@@ -0,0 +1,105 @@
+"""
+    Direct rasterization of sewing patterns to images with PIL:
+    panels are drawn as filled polygons with curved edges sampled (see pattern.bezier),
+    in the same layout & colors as svg images of VisPattern, but without drawing & parsing svg first.
+    Many patterns could be drawn into a single image atlas (see draw_atlas())
+"""
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# my
+from pattern import bezier
+
+panel_fill = (255, 217, 194)
+panel_outline = (0, 0, 0)
+label_color = (9, 33, 173)
+label_font_size = 25
+
+_fonts = {}
+
+
+def _font(size):
+    """Scalable default font of PIL of the given size (bitmap default font for old PIL versions)"""
+    if size not in _fonts:
+        try:
+            _fonts[size] = ImageFont.load_default(size)
+        except TypeError:  # Pillow < 10.1
+            _fonts[size] = ImageFont.load_default()
+    return _fonts[size]
+
+
+def panel_polygon(panel, vertices, curve_samples=10):
+    """Closed outline of the panel in image coordinates: vertices (in px) of the edge loop
+        with points sampled on curved edges. Returns (N, 2) array"""
+    edges = panel['edges']
+    endpoints = np.array([edge['endpoints'] for edge in edges])
+    # image Y axis looks down => curvature Y is flipped, as in VisPattern._draw_a_panel()
+    curvatures = np.array([edge['curvature'] if 'curvature' in edge else [0, 0] for edge in edges], dtype=float)
+    curvatures[:, 1] *= -1
+
+    curved = np.array(['curvature' in edge for edge in edges])
+    t = np.linspace(0, 1, curve_samples, endpoint=False)
+    points = bezier.curve_points(vertices[endpoints[:, 0]], vertices[endpoints[:, 1]], curvatures, t)  # (edges, samples, 2)
+
+    # straight edges only need the start point
+    points_per_edge = np.where(curved, curve_samples, 1)
+    mask = np.arange(curve_samples)[None, :] < points_per_edge[:, None]
+    return points[mask]
+
+
+def draw_pattern(pattern, antialias=2, curve_samples=10, layout=None):
+    """Image of the VisPattern object (PIL.Image, RGB) in the layout of VisPattern images (see VisPattern._panel_layout())
+        * antialias -- (int) drawing is done with this scale & downsampled to get smooth edges
+        * layout -- precomputed result of pattern._panel_layout()
+    """
+    layout, (width, height) = pattern._panel_layout() if layout is None else layout
+    scale = int(antialias)
+    image = Image.new('RGB', (max(int(np.ceil(width * scale)), 1), max(int(np.ceil(height * scale)), 1)), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+
+    for panel_name, vertices, text_insert in layout:
+        panel = pattern.pattern['panels'][panel_name]
+        polygon = panel_polygon(panel, vertices, curve_samples) * scale
+        draw.polygon([tuple(point) for point in polygon], fill=panel_fill, outline=panel_outline, width=max(1, int(scale)))
+
+        draw.text(tuple(np.asarray(text_insert) * scale), panel_name, fill=label_color,
+                  font=_font(label_font_size * scale), anchor='ls')
+        if pattern.view_ids:
+            for text, insert, color, font_size in pattern._id_labels(panel_name, vertices):
+                draw.text(tuple(insert * scale), text, fill=color, font=_font(font_size * scale), anchor='ls')
+
+    if scale > 1:
+        image = image.reduce(scale)  # box filter -- the fastest way to downsample by integer factor
+    return image
+
+
+def save_png(pattern, png_filename, antialias=2, curve_samples=10):
+    """Save image of the VisPattern to png file"""
+    draw_pattern(pattern, antialias, curve_samples).save(png_filename, format='PNG')
+
+
+def draw_atlas(patterns, columns=8, tile_size=None, antialias=2, curve_samples=10):
+    """Images of many VisPattern objects in a single image atlas: a grid with given number of columns
+        * tile_size -- (width, height) of the grid cells. Images are shrinked to fit into the cells keeping the aspect ratio.
+            By default cells fit the largest image w/o resizing
+        Returns
+            * atlas image (PIL.Image, RGB)
+            * position of each pattern in the atlas: {pattern name: [x, y, width, height]}
+    """
+    images = [draw_pattern(pattern, antialias, curve_samples) for pattern in patterns]
+    if tile_size is None:
+        tile_size = (max([image.width for image in images] + [1]), max([image.height for image in images] + [1]))
+    tile_w, tile_h = tile_size
+
+    columns = max(1, min(columns, len(images)))
+    rows = -(-len(images) // columns)
+    atlas = Image.new('RGB', (columns * tile_w, max(rows, 1) * tile_h), (255, 255, 255))
+    positions = {}
+    for idx, (pattern, image) in enumerate(zip(patterns, images)):
+        if image.width > tile_w or image.height > tile_h:
+            image = image.copy()
+            image.thumbnail((tile_w, tile_h), Image.LANCZOS)
+        x, y = (idx % columns) * tile_w, (idx // columns) * tile_h
+        atlas.paste(image, (x, y))
+        positions[pattern.name] = [x, y, image.width, image.height]
+    return atlas, positions
@@ -1,32 +1,73 @@
 """
     Simple Rotation Conversion routines (Maya-Python2.7-Compatible!!)
     TODO: Can be substituted with scipy rotation transformation routines for Maya2022+
+
+    * euler_xyz_to_R_batch() & R_to_euler_batch() work on arrays of rotations at once
+    * euler_xyz_to_R() & R_to_euler() are single rotation versions
 """
 import numpy as np
-import math as m
 import sys
 
 
 # Thanks to https://www.meccanismocomplesso.org/en/3d-rotations-and-euler-angles-in-python/ for the code
-def _Rx(theta):
-    return np.matrix([
-        [1, 0           , 0           ],
-        [0, m.cos(theta), -m.sin(theta)],
-        [0, m.sin(theta), m.cos(theta)]])
+def _axis_rotations(theta, axis):
+    """Stack of rotation matrices around given axis (0 -- x, 1 -- y, 2 -- z) for the array of angles in radians"""
+    cos, sin = np.cos(theta), np.sin(theta)
+    first, second = [ax for ax in range(3) if ax != axis]
+    if axis == 1:  # keep right-handed order of the rotation plane
+        first, second = second, first
 
+    R = np.zeros(theta.shape + (3, 3))
+    R[..., axis, axis] = 1
+    R[..., first, first] = cos
+    R[..., first, second] = -sin
+    R[..., second, first] = sin
+    R[..., second, second] = cos
+    return R
 
-def _Ry(theta):
-    return np.matrix([
-        [m.cos(theta), 0, m.sin(theta)],
-        [0           , 1, 0           ],
-        [-m.sin(theta), 0, m.cos(theta)]])
 
+def euler_xyz_to_R_batch(eulers):
+    """Convert (N, 3) array of Euler angles to (N, 3, 3) array of Rotation matrices.
+        Expects input in degrees.
+        Only support Maya convension of intrinsic xyz Euler Angles
+    """
+    eulers = np.deg2rad(np.asarray(eulers, dtype=float))
+    return np.matmul(
+        np.matmul(_axis_rotations(eulers[..., 2], 2), _axis_rotations(eulers[..., 1], 1)), 
+        _axis_rotations(eulers[..., 0], 0))
 
-def _Rz(theta):
-    return np.matrix([
-        [m.cos(theta), -m.sin(theta), 0],
-        [m.sin(theta), m.cos(theta) , 0],
-        [0           , 0            , 1]])
+
+def R_to_euler_batch(Rs):
+    """
+        Convert (N, 3, 3) array of Rotation matrices to (N, 3) array of Euler-angles in degrees 
+        (in Maya convension of intrinsic xyz Euler Angles)
+        NOTE: 
+            Routine produces one of the possible Euler angles, corresponding to input rotations (the Euler angles are not uniquely defined)
+    """
+    Rs = np.asarray(Rs, dtype=float)
+    tol = sys.float_info.epsilon * 10
+
+    # gimbal lock
+    degenerate = np.logical_and(np.abs(Rs[..., 0, 0]) < tol, np.abs(Rs[..., 1, 0]) < tol)
+
+    eul1 = np.where(degenerate, 0., np.arctan2(Rs[..., 1, 0], Rs[..., 0, 0]))
+    sp = np.sin(eul1)
+    cp = np.cos(eul1)
+    eul2 = np.where(
+        degenerate, 
+        np.arctan2(-Rs[..., 2, 0], Rs[..., 0, 0]),
+        np.arctan2(-Rs[..., 2, 0], cp * Rs[..., 0, 0] + sp * Rs[..., 1, 0]))
+    eul3 = np.where(
+        degenerate, 
+        np.arctan2(-Rs[..., 1, 2], Rs[..., 1, 1]),
+        np.arctan2(sp * Rs[..., 0, 2] - cp * Rs[..., 1, 2], cp * Rs[..., 1, 1] - sp * Rs[..., 0, 1]))
+
+    return np.rad2deg(np.stack([eul3, eul2, eul1], axis=-1))
+
+
+# memo of the matrices for the rotations seen so far -- templates re-use the same few panel rotations
+_euler_R_cache = {}
+_euler_R_cache_size = 1024
 
 
 def euler_xyz_to_R(euler):
@@ -34,7 +75,12 @@ def euler_xyz_to_R(euler):
         Expects input in degrees.
         Only support Maya convension of intrinsic xyz Euler Angles
     """
-    return _Rz(np.deg2rad(euler[2])) * _Ry(np.deg2rad(euler[1])) * _Rx(np.deg2rad(euler[0]))
+    key = tuple(float(angle) for angle in np.ravel(euler))
+    if key not in _euler_R_cache:
+        if len(_euler_R_cache) >= _euler_R_cache_size:
+            _euler_R_cache.clear()
+        _euler_R_cache[key] = euler_xyz_to_R_batch(np.array(key))
+    return np.matrix(_euler_R_cache[key])  # copy s.t. the cached matrix is safe from in-place updates
 
 
 def R_to_euler(R):
@@ -43,18 +89,4 @@ def R_to_euler(R):
         NOTE: 
             Routine produces one of the possible Euler angles, corresponding to input rotations (the Euler angles are not uniquely defined)
     """
-    tol = sys.float_info.epsilon * 10
-  
-    if abs(R[0, 0]) < tol and abs(R[1, 0]) < tol:
-        eul1 = 0
-        eul2 = m.atan2(-R[2, 0], R[0, 0])
-        eul3 = m.atan2(-R[1, 2], R[1, 1])
-    else:   
-        eul1 = m.atan2(R[1, 0], R[0, 0])
-        sp = m.sin(eul1)
-        cp = m.cos(eul1)
-        eul2 = m.atan2(-R[2, 0], cp * R[0, 0] + sp * R[1, 0])
-        eul3 = m.atan2(sp * R[0, 2] - cp * R[1, 2], cp * R[1, 1] - sp * R[0, 1])
-    
-    return [np.rad2deg(eul3), np.rad2deg(eul2), np.rad2deg(eul1)]
-
+    return list(R_to_euler_batch(np.asarray(R)))
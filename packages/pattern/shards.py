@@ -0,0 +1,173 @@
+"""
+    Sharded container for the files of dataset samples (see BasicPattern.serialize() with shard)
+
+    Files of many samples are stored in a few uncompressed .tar shards instead of a folder per sample,
+    which keeps the number of files of large datasets manageable for the file system, os.walk() scans & transfers.
+    * Files are stored under the same relative paths they would have in the dataset folder,
+        s.t. expanding a shard gives the usual folder layout needed by Maya pipeline (see expand())
+    * Each shard has an index next to it (<shard>.tar.index, JSON) with the position of every file of every sample
+        in the shard, so any file is read with a single seek without scanning the archive
+    * Shards are written to temporary files & moved in place when complete, with index written last
+"""
+import io
+import json
+import os
+from pathlib import Path
+import tarfile
+
+shard_suffix = '.tar'
+index_suffix = '.tar.index'
+
+
+class ShardWriter(object):
+    """Adds files of samples to the shards of the given folder:
+        <prefix>_00000.tar, <prefix>_00001.tar, ... with samples_per_shard samples each
+        * first_shard_id -- number of the first shard, e.g. for writers of different processes filling the same folder
+    """
+    def __init__(self, folder, samples_per_shard=1000, prefix='shard', first_shard_id=0):
+        self.folder = Path(folder)
+        self.samples_per_shard = samples_per_shard
+        self.prefix = prefix
+
+        self.shard_files = []  # finished shards
+        self._shard_id = first_shard_id
+        self._tar = None
+        self._index = {}
+
+    def add(self, sample_name, files):
+        """Add files of a sample given as {relative path: str or bytes content}"""
+        if self._tar is None:
+            self._open_shard()
+        if sample_name in self._index:
+            raise ValueError('{}::Error::Sample {} is already in the shard'.format(self.__class__.__name__, sample_name))
+
+        sample_index = {}
+        for filename, content in files.items():
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            info = tarfile.TarInfo(filename.replace(os.sep, '/'))
+            info.size = len(content)
+            info.mtime = 0  # s.t. shards of the same samples are identical byte-to-byte
+            self._tar.addfile(info, io.BytesIO(content))
+            # file data is padded to full blocks right before the current position
+            sample_index[info.name] = [self._tar.offset - tarfile.BLOCKSIZE * -(-info.size // tarfile.BLOCKSIZE), info.size]
+        self._index[sample_name] = sample_index
+
+        if len(self._index) >= self.samples_per_shard:
+            self._close_shard()
+
+    def close(self):
+        """Finish the last shard"""
+        if self._tar is not None:
+            self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    # ------ Utils -------
+    def _shard_path(self):
+        return self.folder / '{}_{:05d}{}'.format(self.prefix, self._shard_id, shard_suffix)
+
+    def _open_shard(self):
+        self._tmp_path = str(self._shard_path()) + '.tmp'
+        self._tar = tarfile.open(self._tmp_path, 'w', format=tarfile.PAX_FORMAT)
+        self._index = {}
+
+    def _close_shard(self):
+        self._tar.close()
+        shard_path = self._shard_path()
+        os.replace(self._tmp_path, shard_path)
+
+        index_path = str(shard_path)[:-len(shard_suffix)] + index_suffix
+        with open(index_path + '.tmp', 'w') as f_index:
+            json.dump({'shard': shard_path.name, 'samples': self._index}, f_index, separators=(',', ':'))
+        os.replace(index_path + '.tmp', index_path)
+
+        self.shard_files.append(shard_path)
+        self._shard_id += 1
+        self._tar = None
+        self._index = {}
+
+
+class ShardReader(object):
+    """Random access to the files of samples in all the shards of a folder by sample name"""
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.samples = {}  # sample name -> (shard path, {relative path: [offset, size]})
+        for index_path in sorted(self.folder.glob('*' + index_suffix)):
+            with open(index_path, 'r') as f_index:
+                index = json.load(f_index)
+            shard_path = self.folder / index['shard']
+            for sample_name, files in index['samples'].items():
+                self.samples[sample_name] = (shard_path, files)
+        self._handles = {}
+
+    def sample_names(self):
+        return list(self.samples.keys())
+
+    def files(self, sample_name):
+        """Relative paths of all the files of the sample"""
+        return list(self.samples[sample_name][1].keys())
+
+    def read(self, sample_name, filename):
+        """Content of the file of the sample (as bytes).
+            filename is either relative path of the file or its basename"""
+        shard_path, files = self.samples[sample_name]
+        if filename not in files:
+            matching = [path for path in files if path.split('/')[-1] == filename]
+            if not matching:
+                raise KeyError('{}::Error::No file {} in sample {}'.format(self.__class__.__name__, filename, sample_name))
+            filename = matching[0]
+        offset, size = files[filename]
+
+        if shard_path not in self._handles:
+            self._handles[shard_path] = open(shard_path, 'rb')
+        handle = self._handles[shard_path]
+        handle.seek(offset)
+        return handle.read(size)
+
+    def expand(self, out_folder, sample_names=None):
+        """Write files of the given samples (all if None) to the usual folder layout in out_folder"""
+        for sample_name in (self.samples if sample_names is None else sample_names):
+            for filename in self.files(sample_name):
+                path = Path(out_folder) / filename
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, 'wb') as f_out:
+                    f_out.write(self.read(sample_name, filename))
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def expand(shard_file, out_folder):
+    """Extract all files of the shard to out_folder in the usual folder layout of the dataset.
+        Returns list of sample names in the shard"""
+    shard_file = Path(shard_file)
+    index_path = str(shard_file)[:-len(shard_suffix)] + index_suffix
+    with open(index_path, 'r') as f_index:
+        index = json.load(f_index)
+
+    with tarfile.open(shard_file, 'r') as tar:
+        if hasattr(tarfile, 'data_filter'):  # Python 3.8.17+, 3.11.4+
+            tar.extractall(out_folder, filter='data')
+        else:
+            tar.extractall(out_folder)
+    return list(index['samples'].keys())
+
+
+def is_sharded(dataset_path):
+    """Check if dataset folder contains shards"""
+    return any(Path(dataset_path).glob('*' + index_suffix))
@@ -2,18 +2,21 @@
     To be used in Python 3.6+ due to dependencies
 """
 import copy
+import io
+import multiprocessing
 import random
 import string
 import os
+from pathlib import Path
 import numpy as np
 
 import svgwrite
-from svglib import svglib
-from reportlab.graphics import renderPM
 
 # my
 import customconfig
+import metrics
 from pattern import core
+from pattern import raster
 
 
 class VisPattern(core.ParametrizedPattern):
@@ -41,17 +44,14 @@ class VisPattern(core.ParametrizedPattern):
         # and that's why I need a class object fot 
         self.scaling_for_drawing = self._verts_to_px_scaling_factor()
         self.view_ids = view_ids  # whatever to render vertices & endes indices
+        self.save_images = True  # visualization on serialize(). Could be rendered later with render_dataset()
 
-    def serialize(self, path, to_subfolder=True, tag=''):
-
-        log_dir = super().serialize(path, to_subfolder, tag=tag)
-        svg_file = os.path.join(log_dir, (self.name + tag + '_pattern.svg'))
-        png_file = os.path.join(log_dir, (self.name + tag + '_pattern.png'))
-
-        # save visualtisation
-        self._save_as_image(svg_file, png_file)
-
-        return log_dir
+    def _serialized_files(self, spec_filename, tag='', **spec_options):
+        """Specification (see BasicPattern.serialize() for spec_options) & visualization files"""
+        files = super()._serialized_files(spec_filename, tag, **spec_options)
+        if self.save_images:
+            files[self.name + tag + '_pattern.svg'], files[self.name + tag + '_pattern.png'] = self._images()
+        return files
 
     # -------- Drawing ---------
 
@@ -98,19 +98,45 @@ class VisPattern(core.ParametrizedPattern):
         flipped_point[1] *= -1
         return flipped_point
 
-    def _draw_a_panel(self, drawing, panel_name, offset=[0, 0]):
+    def _panel_layout(self):
+        """
+        Placement of panels in pattern images: side by side in panel_order() from left to right
+        Returns 
+            * list of (panel name, vertices in px coordinates, insertion point of panel name label)
+            * image size (width, height)
         """
-        Adds a requested panel to the svg drawing with given offset and scaling
+        if self.scaling_for_drawing is None:  # re-evaluate if not ready
+            self.scaling_for_drawing = self._verts_to_px_scaling_factor()
+
+        base_offset = [60, 60]
+        panel_offset_x = 0
+        heights = [0]  # s.t. it has some value if pattern is empty -- no panels
+        layout = []
+        for panel_name in self.panel_order():
+            if panel_name is None:
+                continue
+            vertices = np.asarray(self.pattern['panels'][panel_name]['vertices'])
+            vertices = self._verts_to_px_coords(vertices)
+            # Shift vertices for visibility
+            vertices = vertices + [panel_offset_x + base_offset[0], base_offset[1]]
+
+            panel_center = np.mean(vertices, axis=0)
+            text_insert = panel_center + np.array([-25, 3])
+            layout.append((panel_name, vertices, text_insert))
+
+            # the lower-right corner for the offset of the next panel
+            panel_offset_x = max(np.max(vertices[:, 0]), text_insert[0] + 10 * len(panel_name))
+            heights.append(np.max(vertices[:, 1]))
+
+        return layout, (panel_offset_x + base_offset[0], max(heights) + base_offset[1])  # using latest offset -- the most right
+
+    def _draw_a_panel(self, drawing, panel_name, vertices, text_insert):
+        """
+        Adds a requested panel to the svg drawing at given vertex positions (see _panel_layout())
         Assumes (!!) 
             that edges are correctly oriented to form a closed loop
-        Returns 
-            the lower-right vertex coordinate for the convenice of future offsetting.
         """
         panel = self.pattern['panels'][panel_name]
-        vertices = np.asarray(panel['vertices'])
-        vertices = self._verts_to_px_coords(vertices)
-        # Shift vertices for visibility
-        vertices = vertices + offset
 
         # draw edges
         start = vertices[panel['edges'][0]['endpoints'][0]]
@@ -131,64 +157,66 @@ class VisPattern(core.ParametrizedPattern):
         drawing.add(path)
 
         # name the panel
-        panel_center = np.mean(vertices, axis=0)
-        text_insert = panel_center + np.array([-25, 3])
         drawing.add(drawing.text(panel_name, insert=text_insert, 
                     fill='rgb(9,33,173)', font_size='25'))
-        text_max_x = text_insert[0] + 10 * len(panel_name)
 
-        panel_center = np.mean(vertices, axis=0)
         if self.view_ids:
-            # name vertices 
-            for idx in range(vertices.shape[0]):
-                shift = vertices[idx] - panel_center
-                # last element moves pivot to digit center
-                shift = 5 * shift / np.linalg.norm(shift) + np.array([-5, 5])
+            for text, insert, color, font_size in self._id_labels(panel_name, vertices):
                 drawing.add(
-                    drawing.text(str(idx), insert=vertices[idx] + shift, 
-                                 fill='rgb(245,96,66)', font_size='25'))
-            # name edges
-            for idx, edge in enumerate(panel['edges']):
-                middle = np.mean(
-                    vertices[[edge['endpoints'][0], edge['endpoints'][1]]], axis=0)
-                shift = middle - panel_center
-                shift = 5 * shift / np.linalg.norm(shift) + np.array([-5, 5])
-                # name
-                drawing.add(
-                    drawing.text(idx, insert=middle + shift, 
-                                 fill='rgb(50,179,101)', font_size='20'))
+                    drawing.text(text, insert=insert, fill='rgb({},{},{})'.format(*color), font_size=str(font_size)))
 
-        return max(np.max(vertices[:, 0]), text_max_x), np.max(vertices[:, 1])
+    def _id_labels(self, panel_name, vertices):
+        """Labels of vertex & edge ids of the panel: list of (text, insertion point, color, font size)"""
+        panel = self.pattern['panels'][panel_name]
+        panel_center = np.mean(vertices, axis=0)
+        labels = []
+        # name vertices 
+        for idx in range(vertices.shape[0]):
+            shift = vertices[idx] - panel_center
+            # last element moves pivot to digit center
+            shift = 5 * shift / np.linalg.norm(shift) + np.array([-5, 5])
+            labels.append((str(idx), vertices[idx] + shift, (245, 96, 66), 25))
+        # name edges
+        for idx, edge in enumerate(panel['edges']):
+            middle = np.mean(
+                vertices[[edge['endpoints'][0], edge['endpoints'][1]]], axis=0)
+            shift = middle - panel_center
+            shift = 5 * shift / np.linalg.norm(shift) + np.array([-5, 5])
+            labels.append((str(idx), middle + shift, (50, 179, 101), 20))
+        return labels
 
     def _save_as_image(self, svg_filename, png_filename):
         """
             Saves current pattern in svg and png format for visualization
         """
-        if self.scaling_for_drawing is None:  # re-evaluate if not ready
-            self.scaling_for_drawing = self._verts_to_px_scaling_factor()
+        svg, png = self._images()
+        with open(svg_filename, 'w', encoding='utf-8') as f_svg:
+            f_svg.write(svg)
+        with open(png_filename, 'wb') as f_png:
+            f_png.write(png)
 
-        dwg = svgwrite.Drawing(svg_filename, profile='full')
-        base_offset = [60, 60]
-        panel_offset_x = 0
-        heights = [0]  # s.t. it has some value if pattern is empty -- no panels
+    def _images(self):
+        """
+            Current pattern visualization as svg (str) and png (bytes) file content
+        """
+        layout, (width, height) = self._panel_layout()
 
-        panel_order = self.panel_order()
-        for panel in panel_order:
-            if panel is not None:
-                panel_offset_x, height = self._draw_a_panel(
-                    dwg, panel,
-                    offset=[panel_offset_x + base_offset[0], base_offset[1]]
-                )
-                heights.append(height)
+        dwg = svgwrite.Drawing(profile='full')
+        for panel_name, vertices, text_insert in layout:
+            self._draw_a_panel(dwg, panel_name, vertices, text_insert)
 
         # final sizing & save
-        dwg['width'] = str(panel_offset_x + base_offset[0]) + 'px'  # using latest offset -- the most right
-        dwg['height'] = str(max(heights) + base_offset[1]) + 'px'
-        dwg.save(pretty=True)
+        dwg['width'] = str(width) + 'px'
+        dwg['height'] = str(height) + 'px'
+        svg = io.StringIO()
+        dwg.write(svg, pretty=True)
+        svg = svg.getvalue()
+
+        # png is drawn directly, without parsing the svg
+        png = io.BytesIO()
+        raster.draw_pattern(self, layout=(layout, (width, height))).save(png, format='PNG')
 
-        # to png
-        svg_pattern = svglib.svg2rlg(svg_filename)
-        renderPM.drawToFile(svg_pattern, png_filename, fmt='PNG')
+        return svg, png.getvalue()
 
 
 class RandomPattern(VisPattern):
@@ -213,15 +241,29 @@ class RandomPattern(VisPattern):
     def __init__(self, template_file):
         """Note that this class requires some input file: 
             there is not point of creating this object with empty pattern"""
-        super().__init__(template_file, view_ids=False)  # don't show ids for datasets
+        # Start from a copy of loaded & normalized template from process-wide cache
+        # instead of re-loading & re-normalizing template file for every new sample
+        self._copy_template(template_cache.get(template_file))
+        self.view_ids = False  # don't show ids for datasets
 
         # update name for a random pattern
         self.name = self.name + '_' + self._id_generator()
 
         # randomization setup
-        self._randomize_pattern()
+        self.rejected_designs = self._randomize_pattern()
 
     # -------- Other Utils ---------
+    def _copy_template(self, template):
+        """Initialize as a copy of given template pattern object
+            * Specification is copied
+            * Objects derived from template structure are shared: 
+                parameter plan & template snapshot (read-only), drawing scale
+        """
+        self.__dict__.update(template.__dict__)
+        self.spec = core.spec_copy(template.spec)
+        self.properties = self.spec['properties']
+        self.parameters = self.spec['parameters']
+
     def _id_generator(self, size=10,
                       chars=string.ascii_uppercase + string.digits):
         """Generated a random string of a given size, see
@@ -230,6 +272,103 @@ class RandomPattern(VisPattern):
         return ''.join(random.choices(chars, k=size))
 
 
+class TemplateCache(object):
+    """
+        Process-wide cache of pattern templates keyed by template file path & modification time. 
+        Keeps loaded & normalized template (VisPattern object in template state) 
+        with compiled parameter plan & template snapshot, 
+        s.t. new RandomPattern objects could start from a copy of it without any file I/O or normalization work
+
+        Cached templates should not be modified: use core.spec_copy() on the spec of the template to get a working copy
+    """
+    def __init__(self):
+        self.templates = {}
+
+    def get(self, template_file):
+        """Template pattern of the given file. Loaded on the first request & when the file is updated"""
+        path = os.path.abspath(template_file)
+        mtime = os.path.getmtime(path)
+        if path not in self.templates or self.templates[path][0] != mtime:
+            self.templates[path] = (mtime, self._load(template_file))
+        return self.templates[path][1]
+
+    def clear(self):
+        self.templates = {}
+
+    def _load(self, template_file):
+        template = VisPattern(template_file, view_ids=False)
+        template._get_template_snapshot()  # template state & compiled parameter plan
+        return template
+
+
+template_cache = TemplateCache()
+
+
+# ------- Rendering of datasets --------
+def render_dataset(dataset_path, sample_names=None, scaling=None, num_workers=None, force=False):
+    """Draw svg & png visualization of patterns of the dataset (e.g. generated without images, see datagenerator.py)
+        in a pool of processes. Images are saved next to the specifications, as by VisPattern.serialize()
+        * sample_names -- names of the samples to draw (all samples if None)
+        * scaling -- pixels per pattern unit. By default, the scaling of the dataset template is used (if any), 
+            s.t. images look the same as the ones drawn at generation time
+        * num_workers -- number of processes (all CPUs if <= 0). Samples are drawn in the current process if None
+        * force -- re-draw all requested samples. 
+            Otherwise samples with images newer than their specification are skipped (NOTE even if scaling was different)
+        Returns numbers of drawn & skipped samples
+    """
+    dataset_path = Path(dataset_path)
+    spec_files = core.dataset_spec_files(dataset_path)
+    if sample_names is not None:
+        sample_names = set(sample_names)
+        spec_files = [(path, name) for path, name in spec_files if name in sample_names]
+
+    if scaling is None:
+        templates = sorted(dataset_path.glob('*_template_specification.json'))
+        if templates:
+            scaling = VisPattern(str(templates[0]), view_ids=False).scaling_for_drawing
+
+    if num_workers is None:
+        return _render_samples((spec_files, scaling, force))
+
+    num_workers = num_workers if num_workers > 0 else os.cpu_count()
+    chunk_size = max(1, len(spec_files) // (num_workers * 8))
+    chunks = [(spec_files[start:start + chunk_size], scaling, force) for start in range(0, len(spec_files), chunk_size)]
+    drawn, skipped = 0, 0
+    with multiprocessing.Pool(num_workers) as pool:
+        for chunk_drawn, chunk_skipped in pool.imap_unordered(_render_samples, chunks):
+            drawn += chunk_drawn
+            skipped += chunk_skipped
+    return drawn, skipped
+
+
+def _render_samples(args):
+    """Draw images for the list of (spec file, sample name). Returns numbers of drawn & skipped samples"""
+    spec_files, scaling, force = args
+    drawn, skipped = 0, 0
+    for spec_file, name in spec_files:
+        svg_file = spec_file.parent / (name + '_pattern.svg')
+        png_file = spec_file.parent / (name + '_pattern.png')
+        if not force and _images_up_to_date(spec_file, [svg_file, png_file]):
+            skipped += 1
+            continue
+
+        with metrics.span('render.sample'):
+            pattern = VisPattern(str(spec_file), view_ids=False)
+            pattern.name = name
+            if scaling is not None:
+                pattern.scaling_for_drawing = scaling
+            pattern._save_as_image(svg_file, png_file)
+        drawn += 1
+    return drawn, skipped
+
+
+def _images_up_to_date(spec_file, image_files):
+    """Check if all images exist & are newer than the specification (incl. vertices sidecar)"""
+    sources = [spec_file, spec_file.parent / (spec_file.stem + '_vertices.npy')]
+    source_time = max(path.stat().st_mtime for path in sources if path.exists())
+    return all(path.exists() and path.stat().st_mtime >= source_time for path in image_files)
+
+
 if __name__ == "__main__":
     from datetime import datetime
     import time
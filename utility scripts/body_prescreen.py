@@ -0,0 +1,57 @@
+"""
+    Check initial 3D placement of the panels of all patterns in a dataset against the body mesh without Maya 
+    (see pattern.body.BodyScreen) and list the samples with panels placed through the body -- 
+    these are likely to fail simulation with intersections with the body.
+
+    Dataset is expected to be in datasets_path of system.json, body is taken from bodies_path 
+
+    With --templates, checks all the pattern templates in the given folder at their default parameters instead 
+    & exits with non-zero code if any of them fails -- templates are expected to pass the check 
+    for the screening of their samples to be meaningful
+"""
+
+import argparse
+from pathlib import Path
+import sys
+
+# My
+import customconfig
+from pattern.core import dataset_patterns, ParametrizedPattern
+from pattern.body import BodyScreen
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', '-d', help='name of dataset folder', type=str)
+    parser.add_argument('--templates', '-t', help='folder with pattern templates to check instead of a dataset', type=str)
+    parser.add_argument('--body', '-b', help='name of body .obj file', type=str, default='f_smpl_template.obj')
+    parser.add_argument('--min_depth', help='depth (cm) of the panel parts inside the body to count', type=float, default=2.)
+    parser.add_argument('--min_area', help='fraction of panel area deeper than min_depth to report the panel', 
+                        type=float, default=0.3)
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    system_props = customconfig.Properties('./system.json')
+
+    body_screen = BodyScreen(Path(system_props['bodies_path']) / args.body, min_depth=args.min_depth, min_area=args.min_area)
+    if args.templates:
+        patterns = [ParametrizedPattern(template_file) for template_file in sorted(Path(args.templates).glob('**/*.json'))]
+    else:
+        patterns = dataset_patterns(Path(system_props['datasets_path']) / args.data)
+
+    fails = []
+    for pattern in patterns:
+        penetrating = body_screen.penetrating_panels(pattern)
+        if penetrating:
+            print('{}: {}'.format(pattern.name, penetrating))
+            fails.append(pattern.name)
+
+    print('{} out of {} {} have panels placed through the body'.format(
+        len(fails), len(patterns), 'templates' if args.templates else 'samples'))
+    if args.templates and fails:
+        sys.exit(1)
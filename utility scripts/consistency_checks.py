@@ -0,0 +1,316 @@
+"""
+    Consistency checks of the fast paths of pattern evaluation against the reference (full) evaluation
+    on all pattern templates. Run after changes to pattern.core & friends.
+
+    * update_parameter -- random single-parameter edits with ParametrizedPattern.update_parameter()
+        give the same pattern as full re-evaluation of the same parameter values (apply_param_list())
+    * arc_lengths -- with constraints measured by arc length, random single-parameter edits give the same pattern 
+        as evaluation without cached arc lengths, and cached edge arc lengths (BasicPattern.edge_arc_lengths()) 
+        match the freshly measured ones
+    * sample_batch -- designs of ParametrizedPattern.sample_batch() (evaluated in a few chunks) match 
+        the patterns evaluated one by one from the same parameter values, incl. validity
+    * tensors -- random designs survive the round trip through BasicPattern.pattern_as_tensors() 
+        & pattern_from_tensors() (padded, with placement & stitches): same tensors & same 3D panel outlines
+    * shards -- sharded datasets generated with 1 & 2 workers are the same byte-to-byte
+    * resume -- dataset generation interrupted midway (samples missing from the manifest are removed 
+        & the last manifest line is cut) & resumed is the same as uninterrupted one, incl. generation stats. 
+        Resuming after the run was killed before the final stats were logged only completes the stats. 
+        Metrics of the runs are summed
+
+    Reports mismatches & exits with non-zero code if any check failed.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+from pathlib import Path
+import random
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+# My
+from customconfig import Properties
+from pattern import bezier
+from pattern.core import BasicPattern, ParametrizedPattern, Panel
+sys.path.insert(0, str(Path(__file__).parent.parent / 'data_generation'))
+import datagenerator
+
+
+def load_template(template_file):
+    """Template as ParametrizedPattern with loading warnings silenced"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ParametrizedPattern(template_file)
+
+
+def generate_dataset(template_file, path, name, num_samples, **gen_config):
+    """Generate small dataset from the template. Returns the path to the dataset folder"""
+    props = Properties()
+    props.set_basic(templates=Path(template_file).name, name=name, size=num_samples, to_subfolders=True)
+    props.set_section_config('generator', **gen_config)
+    with contextlib.redirect_stdout(io.StringIO()):
+        datagenerator.generate(path, Path(template_file).parent, props)
+    return Path(path) / props['data_folder']
+
+
+def dataset_files(dataset_path):
+    """Content of all files of the dataset, except the ones that depend on the run (properties with stats, manifest)"""
+    skip = ['dataset_properties.json', datagenerator.GenerationManifest.filename]
+    return {
+        file.relative_to(dataset_path).as_posix(): file.read_bytes() 
+        for file in sorted(Path(dataset_path).glob('**/*')) if file.is_file() and file.name not in skip}
+
+
+def same_spec(pattern, other):
+    """Check if specifications of the patterns are the same"""
+    return json.dumps(pattern.spec, sort_keys=True) == json.dumps(other.spec, sort_keys=True)
+
+
+def check_update_parameter(template_file, num_samples):
+    """Random walk of single-parameter edits vs full re-evaluation of the same parameter values"""
+    fails = []
+    pattern = load_template(template_file)
+    reference = load_template(template_file)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pattern._randomize_pattern()
+    for _ in range(num_samples):
+        parameter = random_update(pattern)
+
+        reference.apply_param_list(pattern.param_values_list())
+        if not same_spec(pattern, reference):
+            fails.append('pattern differs from full re-evaluation after update of {}'.format(parameter))
+            break
+        if pattern.is_self_intersecting() != reference.is_self_intersecting():
+            fails.append('self-intersection differs from full re-evaluation after update of {}'.format(parameter))
+            break
+    return fails
+
+
+def random_update(pattern):
+    """Update random parameter of the pattern to a random value. Returns the name of the parameter"""
+    parameter = random.choice(pattern.spec['parameter_order'])
+    value = pattern.parameters[parameter]['value']
+    if isinstance(value, list):
+        value_idx = random.randrange(len(value))
+        new_value = pattern._new_value(pattern.parameters[parameter]['range'][value_idx])
+    else:
+        value_idx = None
+        new_value = pattern._new_value(pattern.parameters[parameter]['range'])
+    pattern.update_parameter(parameter, new_value, value_idx)
+    return parameter
+
+
+def check_arc_lengths(template_file, num_samples):
+    """Cached arc lengths after single-parameter edits vs fresh measurements"""
+    fails = []
+    pattern = load_template(template_file)
+    if 'constraints' not in pattern.spec or not pattern.spec['constraints']:
+        return fails
+    for constraint in pattern.spec['constraints'].values():
+        constraint['measure'] = 'arc_length'
+    pattern.param_plan = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        pattern._randomize_pattern()
+
+    for step in range(num_samples):
+        parameter = random_update(pattern)
+
+        # evaluation from the template without cached lengths
+        plan = pattern._get_param_plan()
+        panels = {name: panel.copy() for name, panel in pattern.template_snapshot.items()}
+        vertices = {name: panel.vertices for name, panel in panels.items()}
+        curvatures = {name: panel.curvatures for name, panel in panels.items()}
+        plan.apply_parameters(
+            {param: pattern.parameters[param]['value'] for param in pattern.parameters}, vertices, curvatures)
+        plan.apply_constraints(vertices, curvatures=curvatures)
+        if any([not np.allclose(panel.vertices, Panel.from_spec(pattern.pattern['panels'][name]).vertices, atol=1e-9)
+                for name, panel in panels.items()]):
+            fails.append('pattern differs from evaluation without cached arc lengths after update of {}'.format(parameter))
+            break
+
+        if step % 2:  # lengths measured in the Panel objects of the pattern are kept when the spec is updated
+            pattern.edge_arc_lengths()
+            pattern.spec
+        cached = pattern.edge_arc_lengths()
+        for name, panel in pattern.pattern['panels'].items():
+            panel = Panel.from_spec(panel)
+            fresh = bezier.arc_lengths(
+                panel.vertices[panel.endpoints[:, 0]], panel.vertices[panel.endpoints[:, 1]], panel.curvatures)
+            if not np.allclose(cached[name], fresh, atol=1e-9):
+                fails.append('cached arc lengths of {} differ from fresh ones after update of {}'.format(name, parameter))
+        if fails:
+            break
+    return fails
+
+
+def check_sample_batch(template_file, num_samples):
+    """Batched sampling vs evaluation of each design of the batch"""
+    fails = []
+    pattern = load_template(template_file)
+    batch = pattern.sample_batch(num_samples, seed=random.randrange(2**32), chunk_size=max(1, num_samples // 3))
+    for idx in range(num_samples):
+        pattern.apply_param_list(list(batch['parameters'][idx]))
+        for panel_id, panel_name in enumerate(batch['panels']):
+            panel = pattern.pattern['panels'][panel_name]
+            vertices = np.array(panel['vertices'])
+            curvatures = np.array([edge['curvature'] if 'curvature' in edge else [0, 0] for edge in panel['edges']])
+            if (not np.allclose(vertices, batch['vertices'][idx, panel_id, :len(vertices)], atol=1e-9)
+                    or not np.allclose(curvatures, batch['curvatures'][idx, panel_id, :len(curvatures)], atol=1e-9)):
+                fails.append('design {} panel {} differs from evaluation of its parameters'.format(idx, panel_name))
+        if batch['valid'][idx] == pattern.is_self_intersecting():
+            fails.append('validity of design {} differs from self-intersection check of its evaluation'.format(idx))
+    return fails
+
+
+def check_tensors(template_file, num_samples):
+    """Round trip of random designs through the tensor representation"""
+    fails = []
+    pattern = load_template(template_file)
+    for idx in range(num_samples):
+        with contextlib.redirect_stdout(io.StringIO()):
+            pattern._randomize_pattern()
+        padding = {'pad_panels_to_len': 20, 'pad_panels_num': len(pattern.pattern['panels']) + 2, 
+                   'pad_stitches_num': len(pattern.pattern['stitches']) + 5}
+        tensors = pattern.pattern_as_tensors(**padding, with_placement=True, with_stitches=True)
+        edges, _, rotations, translations, stitches, _ = tensors
+
+        restored = BasicPattern()
+        restored.pattern_from_tensors(edges, rotations, translations, stitches, padded=True)
+        restored_tensors = restored.pattern_as_tensors(**padding, with_placement=True, with_stitches=True)
+        if any([not np.allclose(tensor, restored_tensor, atol=1e-9) 
+                for tensor, restored_tensor in zip(tensors, restored_tensors)]):
+            fails.append('tensors of design {} change after the round trip'.format(idx))
+            continue
+        outlines = pattern.panel_outlines_3D()
+        restored_outlines = restored.panel_outlines_3D()
+        if any([not np.allclose(outline, restored_outline, atol=1e-6) 
+                for outline, restored_outline in zip(outlines.values(), restored_outlines.values())]):
+            fails.append('3D panel outlines of design {} change after the round trip'.format(idx))
+    return fails
+
+
+def check_shards(template_file, num_samples):
+    """Sharded datasets generated with different number of workers"""
+    seed = random.randrange(2**32)
+    tmp_path = tempfile.mkdtemp()
+    try:
+        datasets = [
+            dataset_files(generate_dataset(
+                template_file, tmp_path, 'workers_' + str(num_workers), num_samples, 
+                random_seed=seed, num_workers=num_workers, shard_size=max(1, num_samples // 3)))
+            for num_workers in [1, 2]]
+    finally:
+        shutil.rmtree(tmp_path)
+
+    if datasets[0].keys() != datasets[1].keys():
+        return ['files of sharded datasets differ with 1 & 2 workers']
+    return ['{} differs with 1 & 2 workers'.format(file) for file in datasets[0] if datasets[0][file] != datasets[1][file]]
+
+
+def interrupt(dataset_path, num_completed):
+    """Make the dataset look like its generation was killed after num_completed samples"""
+    manifest_path = Path(dataset_path) / datagenerator.GenerationManifest.filename
+    lines = manifest_path.read_text().splitlines()
+    removed = [json.loads(line)['sample'] for line in lines[num_completed:]]
+    for sample in removed:
+        shutil.rmtree(Path(dataset_path) / sample)
+    # killed while logging the next sample
+    manifest_path.write_text(''.join([line + '\n' for line in lines[:num_completed]]) + lines[-1][:10])
+
+
+def check_resume(template_file, num_samples):
+    """Interrupted & resumed generation vs uninterrupted one"""
+    seed = random.randrange(2**32)
+    tmp_path = tempfile.mkdtemp()
+    try:
+        full_path = generate_dataset(
+            template_file, tmp_path, 'full', num_samples, random_seed=seed, num_workers=2, metrics=True)
+        resumed_path = generate_dataset(
+            template_file, tmp_path, 'resumed', num_samples, random_seed=seed, num_workers=2, metrics=True)
+        interrupt(resumed_path, num_samples // 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            resumed_props = datagenerator.resume(resumed_path, Path(template_file).parent)
+        full_files, resumed_files = dataset_files(full_path), dataset_files(resumed_path)
+        full_stats = Properties(full_path / 'dataset_properties.json')['generator']['stats']
+
+        # killed after the last sample, before the final stats
+        unfinished_props = Properties(resumed_path / 'dataset_properties.json')
+        unfinished_stats = unfinished_props['generator']['stats']
+        for key in list(unfinished_stats):
+            if key not in ['runs', 'metrics']:  # logged with the progress of the run
+                del unfinished_stats[key]
+        unfinished_props.serialize(resumed_path / 'dataset_properties.json')
+        with contextlib.redirect_stdout(io.StringIO()):
+            finalized_props = datagenerator.resume(resumed_path, Path(template_file).parent)
+        finalized_files = dataset_files(resumed_path)
+    finally:
+        shutil.rmtree(tmp_path)
+
+    fails = []
+    if full_files.keys() != resumed_files.keys():
+        fails.append('files of resumed dataset differ from uninterrupted one')
+    else:
+        fails += ['{} of resumed dataset differs from uninterrupted one'.format(file) 
+                  for file in full_files if full_files[file] != resumed_files[file]]
+    if resumed_props['generator']['stats']['rejected_designs'] != full_stats['rejected_designs']:
+        fails.append('rejected designs of resumed dataset differ from uninterrupted one')
+    if finalized_files != resumed_files:
+        fails.append('resuming of completed dataset changes its files')
+    finalized_stats = finalized_props['generator']['stats']
+    if ('rejected_designs' not in finalized_stats or finalized_stats['rejected_designs'] != full_stats['rejected_designs']
+            or finalized_stats['runs'] != resumed_props['generator']['stats']['runs']):
+        fails.append('stats of completed dataset are not finalized on resume')
+    # samples of the interrupted run are generated again
+    num_runs_samples = num_samples + num_samples - num_samples // 2
+    if resumed_props['generator']['stats']['metrics']['timers']['generator.sample']['count'] != num_runs_samples:
+        fails.append('metrics of resumed dataset are not summed over the runs')
+    if finalized_stats['metrics'] != resumed_props['generator']['stats']['metrics']:
+        fails.append('metrics of completed dataset change on resume')
+    return fails
+
+
+checks = {
+    'update_parameter': check_update_parameter,
+    'arc_lengths': check_arc_lengths,
+    'sample_batch': check_sample_batch,
+    'tensors': check_tensors,
+    'shards': check_shards,
+    'resume': check_resume,
+}
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--templates', '-t', help='folder with pattern templates', type=str,
+                        default=str(Path(__file__).parent.parent / 'data_generation' / 'Patterns'))
+    parser.add_argument('--checks', '-c', help='checks to run (all by default)', nargs='+', choices=list(checks.keys()),
+                        default=list(checks.keys()))
+    parser.add_argument('--samples', '-s', help='number of random designs (or edits) per template', type=int, default=20)
+    parser.add_argument('--seed', help='random seed', type=int, default=0)
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    templates_path = Path(args.templates)
+
+    num_fails = 0
+    for check in args.checks:
+        for template_file in sorted(templates_path.glob('**/*.json')):
+            random.seed(args.seed)
+            name = template_file.relative_to(templates_path).with_suffix('').as_posix()
+            fails = checks[check](template_file, args.samples)
+            for fail in fails:
+                print('{}::{}: {}'.format(check, name, fail))
+            num_fails += len(fails)
+        print('{} done'.format(check))
+
+    print('{} fails'.format(num_fails))
+    if num_fails:
+        sys.exit(1)
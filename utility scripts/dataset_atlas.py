@@ -0,0 +1,59 @@
+"""
+    Draw sewing patterns of a dataset (or its first samples) into a single image atlas 
+    (see pattern.raster.draw_atlas()) for a quick visual review of the data.
+    Saves the atlas .png & .json with the position of each sample in the atlas to the dataset folder
+
+    Dataset is expected to be in datasets_path of system.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+from pathlib import Path
+
+# My
+import customconfig
+from pattern import core, raster
+from pattern.wrappers import VisPattern
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', '-d', help='name of dataset folder', type=str)
+    parser.add_argument('--output', '-o', help='name of the output .png file in the dataset folder', 
+                        type=str, default='atlas.png')
+    parser.add_argument('--samples', '-s', help='max number of samples to draw (all if not given)', type=int)
+    parser.add_argument('--columns', '-c', help='number of columns in the atlas', type=int, default=8)
+    parser.add_argument('--tile', '-t', help='width & height of the atlas cells in px', type=int, nargs=2)
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    system_props = customconfig.Properties('./system.json')
+
+    dataset_path = Path(system_props['datasets_path']) / args.data
+    spec_files = core.dataset_spec_files(dataset_path)[:args.samples]
+
+    # same scaling for all samples, as in the images drawn at generation time
+    templates = sorted(dataset_path.glob('*_template_specification.json'))
+    patterns = []
+    with contextlib.redirect_stdout(io.StringIO()):  # silence loading warnings
+        scaling = VisPattern(str(templates[0]), view_ids=False).scaling_for_drawing if templates else None
+        for path, name in spec_files:
+            pattern = VisPattern(str(path), view_ids=False)
+            pattern.name = name
+            if scaling is not None:
+                pattern.scaling_for_drawing = scaling
+            patterns.append(pattern)
+
+    atlas, positions = raster.draw_atlas(patterns, args.columns, args.tile)
+    atlas.save(dataset_path / args.output)
+    with open((dataset_path / args.output).with_suffix('.json'), 'w') as f_json:
+        json.dump(positions, f_json, indent=2)
+
+    print('Saved atlas of {} patterns to {}'.format(len(patterns), dataset_path / args.output))
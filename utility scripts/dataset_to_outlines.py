@@ -0,0 +1,37 @@
+"""
+    Export world-space outlines of all panels of a generated dataset into one .npz file 
+    (see pattern.core.dataset_panel_outlines()), s.t. panels placed in 3D are available 
+    to offline tools without running Maya.
+
+    Dataset is expected to be in datasets_path of system.json
+"""
+
+import argparse
+from pathlib import Path
+
+# My
+import customconfig
+from pattern.core import dataset_panel_outlines
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', '-d', help='name of dataset folder', type=str)
+    parser.add_argument('--output', '-o', help='name of the output file in the dataset folder', 
+                        type=str, default='panel_outlines.npz')
+    parser.add_argument('--samples', '-s', help='number of segments to sample each curved edge with', type=int, default=10)
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    system_props = customconfig.Properties('./system.json')
+
+    dataset_path = Path(system_props['datasets_path']) / args.data
+    dataset = dataset_panel_outlines(dataset_path, dataset_path / args.output, args.samples)
+
+    print('Saved outlines of {} panels of {} patterns to {}'.format(
+        len(dataset['panel_names']), len(dataset['names']), dataset_path / args.output))
@@ -0,0 +1,37 @@
+"""
+    Convert sewing patterns of a generated dataset into one .npz file of stacked padded tensors 
+    (see pattern.core.dataset_as_tensors()), s.t. training jobs could load the whole dataset at once
+    instead of parsing JSON specification of every datapoint.
+
+    Dataset is expected to be in datasets_path of system.json
+"""
+
+import argparse
+from pathlib import Path
+
+# My
+import customconfig
+from pattern.core import dataset_as_tensors
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', '-d', help='name of dataset folder', type=str)
+    parser.add_argument('--output', '-o', help='name of the output file in the dataset folder', 
+                        type=str, default='pattern_tensors.npz')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    system_props = customconfig.Properties('./system.json')
+
+    dataset_path = Path(system_props['datasets_path']) / args.data
+    dataset = dataset_as_tensors(dataset_path, dataset_path / args.output)
+
+    print('Saved {} patterns to {}. Tensor shapes:'.format(len(dataset['names']), dataset_path / args.output))
+    for key, array in dataset.items():
+        print('\t{}: {}'.format(key, array.shape))
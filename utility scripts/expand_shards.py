@@ -0,0 +1,47 @@
+"""
+    Expand sharded dataset (see pattern.shards & 'shard_size' option of data_generation/datagenerator.py)
+    into the usual folder layout with files of each sample, as expected by simulation & other tools.
+
+    Dataset is expected to be in datasets_path of system.json
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+# My
+import customconfig
+from pattern import shards
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', '-d', help='name of dataset folder', type=str)
+    parser.add_argument('--shard', help='name of a single shard to expand (all shards of the dataset if not given)', type=str)
+    parser.add_argument('--samples', '-s', help='names of the samples to expand (all if not given)', type=str, nargs='+')
+    parser.add_argument('--remove', '-r', help='remove shards after expanding. Ignored if samples are given', action='store_true')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    system_props = customconfig.Properties('./system.json')
+
+    dataset_path = Path(system_props['datasets_path']) / args.data
+
+    if args.samples:
+        with shards.ShardReader(dataset_path) as reader:
+            reader.expand(dataset_path, args.samples)
+        print('Expanded {} samples to {}'.format(len(args.samples), dataset_path))
+    else:
+        shard_files = [dataset_path / args.shard] if args.shard else sorted(dataset_path.glob('*' + shards.shard_suffix))
+        num_samples = 0
+        for shard_file in shard_files:
+            num_samples += len(shards.expand(shard_file, dataset_path))
+            if args.remove:
+                os.remove(str(shard_file)[:-len(shards.shard_suffix)] + shards.index_suffix)
+                os.remove(shard_file)
+        print('Expanded {} samples from {} shards to {}'.format(num_samples, len(shard_files), dataset_path))
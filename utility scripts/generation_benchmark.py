@@ -0,0 +1,201 @@
+"""
+    Throughput benchmark of pattern generation on all pattern templates.
+
+    Runs random samples of each template through the stages of dataset generation (see data_generation/datagenerator.py):
+    copy (of the cached template), randomize (incl. re-tries of self-intersecting designs), serialize & render (svg & png).
+    Reports samples/sec, p50 & p95 latency of each stage, time of the first template load, rate of rejected designs 
+    & peak memory. Each template is run in a fresh process, s.t. the load is cold & the peak memory is its own.
+
+    Results are saved to JSON. Given a baseline (JSON of an earlier run),
+    reports the changes against it & exits with non-zero code if any template got slower than the tolerance allows.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# My
+from pattern.wrappers import RandomPattern, VisPattern, template_cache
+
+stages = ['copy', 'randomize', 'serialize', 'render']
+
+
+class TimedRandomPattern(RandomPattern):
+    """Random pattern that records the time of its randomization"""
+    def _randomize_pattern(self):
+        start = time.perf_counter()
+        rejected = super()._randomize_pattern()
+        self.randomize_time = time.perf_counter() - start
+        return rejected
+
+
+def peak_rss_mb():
+    """Peak resident memory of the process (MB). None if not available on the platform"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10  # bytes on macOS, KB on Linux
+
+
+def stage_stats(times):
+    """Latency percentiles of the stage (ms)"""
+    times = np.array(times) * 1000
+    return {'p50': float(np.percentile(times, 50)), 'p95': float(np.percentile(times, 95)), 'mean': float(times.mean())}
+
+
+def benchmark_template(template_file, num_samples, out_folder, seed):
+    """Generate samples of the template stage by stage. Expected to run in a fresh process"""
+    random.seed(seed)
+    times = {stage: [] for stage in stages}
+    rejected = 0
+
+    with contextlib.redirect_stdout(io.StringIO()):  # silence loading warnings
+        start = time.perf_counter()
+        VisPattern(template_file, view_ids=False)
+        template_load = time.perf_counter() - start
+        template_cache.clear()
+        template_cache.get(template_file)
+
+        total_start = time.perf_counter()
+        for _ in range(num_samples):
+            start = time.perf_counter()
+            pattern = TimedRandomPattern(template_file)
+            times['copy'].append(time.perf_counter() - start - pattern.randomize_time)
+            times['randomize'].append(pattern.randomize_time)
+            rejected += pattern.rejected_designs
+
+            pattern.save_images = False  # timed separately
+            start = time.perf_counter()
+            log_dir = pattern.serialize(out_folder, to_subfolder=True)
+            times['serialize'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            pattern._save_as_image(
+                os.path.join(log_dir, pattern.name + '_pattern.svg'), os.path.join(log_dir, pattern.name + '_pattern.png'))
+            times['render'].append(time.perf_counter() - start)
+        total_time = time.perf_counter() - total_start
+
+    return {
+        'samples': num_samples,
+        'samples_per_sec': num_samples / total_time,
+        'template_load_ms': template_load * 1000,
+        'rejected_designs': rejected,
+        'retry_rate': rejected / (rejected + num_samples),
+        'stages': {stage: stage_stats(stage_times) for stage, stage_times in times.items()},
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print changes of the results against the baseline. Returns the list of regressions"""
+    regressions = []
+    for name, result in results['templates'].items():
+        if name not in baseline['templates']:
+            print('{:<45} not in baseline'.format(name))
+            continue
+        base = baseline['templates'][name]
+        changes = {'samples/sec': result['samples_per_sec'] / base['samples_per_sec']}
+        for stage in stages:
+            if stage not in base['stages']:  # baselines before the stage was introduced
+                continue
+            # latency & memory ratios are inverted, s.t. < 1 is always worse
+            changes[stage + ' p50'] = base['stages'][stage]['p50'] / max(result['stages'][stage]['p50'], 1e-9)
+        if result['peak_rss_mb'] is not None and base['peak_rss_mb'] is not None:
+            changes['peak RSS'] = base['peak_rss_mb'] / result['peak_rss_mb']
+        slower = [key for key, ratio in changes.items() if ratio < 1 - tolerance]
+        regressions += [name + ': ' + key for key in slower]
+        print('{:<45} {}{}'.format(
+            name, ', '.join(['{} x{:.2f}'.format(key, ratio) for key, ratio in changes.items()]),
+            ' <- SLOWER' if slower else ''))
+    return regressions
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--templates', '-t', help='folder with pattern templates', type=str,
+                        default=str(Path(__file__).parent.parent / 'data_generation' / 'Patterns'))
+    parser.add_argument('--samples', '-s', help='number of random samples per template', type=int, default=50)
+    parser.add_argument('--seed', help='random seed of each template', type=int, default=0)
+    parser.add_argument('--output', '-o', help='JSON file to save the results to', type=str, default='generation_benchmark.json')
+    parser.add_argument('--baseline', '-b', help='JSON results of earlier run to compare with', type=str)
+    parser.add_argument('--tolerance', 
+                        help='relative slow down (of samples/sec or p50 of any stage) or memory increase reported as regression',
+                        type=float, default=0.1)
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+
+    results = {
+        'config': {'samples': args.samples, 'seed': args.seed},
+        'system': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'templates': {}
+    }
+    templates_path = Path(args.templates)
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        for template_file in sorted(templates_path.glob('**/*.json')):
+            name = template_file.relative_to(templates_path).with_suffix('').as_posix()
+            out_folder = os.path.join(tmp_folder, template_file.stem)
+            # fresh process for every template
+            with multiprocessing.get_context('spawn').Pool(1) as pool:
+                result = pool.apply(benchmark_template, (template_file, args.samples, out_folder, args.seed))
+            shutil.rmtree(out_folder)
+            results['templates'][name] = result
+            print('{:<45} {:7.1f} samples/sec, retries {:5.1%}, load {:.1f} ms, '.format(
+                      name, result['samples_per_sec'], result['retry_rate'], result['template_load_ms'])
+                  + ', '.join(['{} {:.2f}/{:.2f} ms'.format(stage, result['stages'][stage]['p50'], result['stages'][stage]['p95'])
+                               for stage in stages]))
+    finally:
+        shutil.rmtree(tmp_folder)
+
+    total_samples = sum([result['samples'] for result in results['templates'].values()])
+    total_rejected = sum([result['rejected_designs'] for result in results['templates'].values()])
+    peaks = [result['peak_rss_mb'] for result in results['templates'].values() if result['peak_rss_mb'] is not None]
+    results['total'] = {
+        'samples': total_samples,
+        'samples_per_sec': total_samples / sum(
+            [result['samples'] / result['samples_per_sec'] for result in results['templates'].values()]),
+        'retry_rate': total_rejected / (total_rejected + total_samples),
+        'peak_rss_mb': max(peaks) if peaks else None  # of the largest template
+    }
+    print('Total: {:.1f} samples/sec, retries {:.1%}, peak RSS {} MB'.format(
+        results['total']['samples_per_sec'], results['total']['retry_rate'], 
+        None if results['total']['peak_rss_mb'] is None else round(results['total']['peak_rss_mb'])))
+    print('(stage latencies are p50/p95)')
+
+    with open(args.output, 'w') as f_out:
+        json.dump(results, f_out, indent=2)
+    print('Results saved to {}'.format(args.output))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f_base:
+            baseline = json.load(f_base)
+        print('Compared to {} (x < 1 is slower):'.format(args.baseline))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('{} regressions over {:.0%} tolerance'.format(len(regressions), args.tolerance))
+            sys.exit(1)
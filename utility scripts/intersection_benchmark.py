@@ -0,0 +1,103 @@
+"""
+    Benchmark of panel self-intersection checks on all pattern templates.
+
+    Compares vectorized ParametrizedPattern.is_self_intersecting() on the evaluated Panel objects 
+    (as used in generation, see ParametrizedPattern._randomize_pattern()) with the reference pairwise loop over
+    BasicPattern._is_segm_intersecting() on the copy of the sample spec for random samples of each template,
+    reports timings & number of samples where the two checks disagree (expected to be zero).
+"""
+
+import argparse
+import contextlib
+import io
+import random
+from pathlib import Path
+import time
+
+import numpy as np
+
+# My
+from pattern.core import ParametrizedPattern, spec_copy
+
+
+def reference_is_self_intersecting(pattern, spec):
+    """Per-pair check of all the edges of each panel of the pattern spec in python loop"""
+    for panel in spec['pattern']['panels'].values():
+        vertices = np.array(panel['vertices'])
+
+        # construct edge list in coordinates
+        edge_list = []
+        for edge in panel['edges']:
+            edge_coords = vertices[edge['endpoints']]
+            if 'curvature' in edge:
+                curv_abs = pattern._control_to_abs_coord(edge_coords[0], edge_coords[1], edge['curvature'])
+                edge_list.append([edge_coords[0], curv_abs])
+                edge_list.append([curv_abs, edge_coords[1]])
+            else:
+                edge_list.append(edge_coords.tolist())
+
+        for i1 in range(0, len(edge_list)):
+            for i2 in range(i1 + 1, len(edge_list)):
+                if pattern._is_segm_intersecting(edge_list[i1], edge_list[i2]):
+                    return True
+    return False
+
+
+def benchmark_template(template_file, num_samples, repeats):
+    """Time both checks on random samples of the template"""
+    with contextlib.redirect_stdout(io.StringIO()):  # silence loading warnings
+        pattern = ParametrizedPattern(template_file)
+
+    time_reference, time_vectorized, mismatches, num_intersecting = 0., 0., 0, 0
+    for _ in range(num_samples):
+        pattern._randomize_parameters()
+        pattern._update_pattern_by_param_values()
+        if pattern.panels is None:
+            raise RuntimeError('Evaluated geometry is expected in Panel objects')
+
+        # before the spec is requested: spec update moves the geometry from Panel objects to the spec
+        start = time.perf_counter()
+        for _ in range(repeats):
+            vectorized = pattern.is_self_intersecting()
+        time_vectorized += time.perf_counter() - start
+
+        spec = spec_copy(pattern.spec)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            reference = reference_is_self_intersecting(pattern, spec)
+        time_reference += time.perf_counter() - start
+
+        mismatches += reference != vectorized
+        num_intersecting += reference
+
+    num_runs = num_samples * repeats
+    return time_reference / num_runs, time_vectorized / num_runs, mismatches, num_intersecting
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--templates', '-t', help='folder with pattern templates', type=str,
+                        default=str(Path(__file__).parent.parent / 'data_generation' / 'Patterns'))
+    parser.add_argument('--samples', '-s', help='number of random samples per template', type=int, default=50)
+    parser.add_argument('--repeats', '-r', help='number of timed runs per sample', type=int, default=5)
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    random.seed(0)  # for parameter sampling
+
+    total_reference, total_vectorized, total_mismatches = 0., 0., 0
+    for template_file in sorted(Path(args.templates).glob('**/*.json')):
+        t_ref, t_vec, mismatches, intersecting = benchmark_template(template_file, args.samples, args.repeats)
+        total_reference += t_ref
+        total_vectorized += t_vec
+        total_mismatches += mismatches
+        print('{:<45} reference {:7.3f} ms, vectorized {:7.3f} ms, x{:5.1f}; intersecting {}/{}, mismatches {}'.format(
+            template_file.stem, t_ref * 1000, t_vec * 1000, t_ref / t_vec, intersecting, args.samples, mismatches))
+
+    print('Total: reference {:.3f} ms, vectorized {:.3f} ms, x{:.1f}; mismatches {}'.format(
+        total_reference * 1000, total_vectorized * 1000, total_reference / total_vectorized, total_mismatches))
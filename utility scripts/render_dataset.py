@@ -0,0 +1,39 @@
+"""
+    Draw svg & png visualizations of sewing patterns of a dataset in a pool of processes 
+    (see pattern.wrappers.render_dataset()), e.g. for datasets generated with 'deferred_rendering' option.
+    Samples with up-to-date images are skipped.
+
+    Dataset is expected to be in datasets_path of system.json
+"""
+
+import argparse
+from pathlib import Path
+import time
+
+# My
+import customconfig
+from pattern.wrappers import render_dataset
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', '-d', help='name of dataset folder', type=str)
+    parser.add_argument('--samples', '-s', help='names of the samples to draw (all if not given)', type=str, nargs='+')
+    parser.add_argument('--scaling', help='pixels per pattern unit (cm). Scaling of the dataset template by default', type=float)
+    parser.add_argument('--workers', '-w', help='number of processes (all CPUs by default)', type=int, default=0)
+    parser.add_argument('--force', '-f', help='re-draw up-to-date images (e.g. to change the scaling)', action='store_true')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    system_props = customconfig.Properties('./system.json')
+
+    start_time = time.time()
+    drawn, skipped = render_dataset(
+        Path(system_props['datasets_path']) / args.data, args.samples, args.scaling, args.workers, args.force)
+
+    print('Drawn {} patterns, skipped {} up-to-date ones in {:.1f} s'.format(drawn, skipped, time.time() - start_time))
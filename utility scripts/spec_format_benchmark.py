@@ -0,0 +1,94 @@
+"""
+    Benchmark of pattern specification file formats (see pattern.core.BasicPattern.serialize()).
+
+    Saves random samples of a template in each format,
+    reports bytes per sample, write & load time per sample, and max deviation of loaded vertices from the original.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+# My
+from pattern.core import BasicPattern, ParametrizedPattern
+
+formats = {
+    'default': {},
+    'compact': {'compact': True},
+    'compact, precision 4': {'compact': True, 'precision': 4},
+    'compact, vertices sidecar': {'compact': True, 'vertices_sidecar': True},
+    'compact, precision 4, vertices sidecar': {'compact': True, 'precision': 4, 'vertices_sidecar': True},
+}
+
+
+def random_samples(template_file, num_samples):
+    """Random designs from the template"""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):  # silence loading warnings
+        for idx in range(num_samples):
+            pattern = ParametrizedPattern(template_file)
+            pattern._randomize_pattern()
+            pattern.name = pattern.name + '_' + str(idx)
+            samples.append(pattern)
+    return samples
+
+
+def folder_size(path):
+    return sum(file.stat().st_size for file in Path(path).glob('**/*') if file.is_file())
+
+
+def benchmark_format(samples, out_folder, spec_options):
+    """Save & load all samples in the given format"""
+    start = time.perf_counter()
+    for pattern in samples:
+        pattern.serialize(out_folder, to_subfolder=True, **spec_options)
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded = [BasicPattern(os.path.join(out_folder, pattern.name, 'specification.json')) for pattern in samples]
+    load_time = time.perf_counter() - start
+
+    # precision check
+    max_error = 0
+    for pattern, loaded_pattern in zip(samples, loaded):
+        for name, panel in pattern.pattern['panels'].items():
+            error = np.abs(np.array(panel['vertices']) - np.array(loaded_pattern.pattern['panels'][name]['vertices']))
+            max_error = max(max_error, error.max())
+
+    num_samples = len(samples)
+    return folder_size(out_folder) / num_samples, write_time / num_samples, load_time / num_samples, max_error
+
+
+def get_command_args():
+    """command line arguments to control the run"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--template', '-t', help='pattern template file', type=str,
+                        default=str(Path(__file__).parent.parent / 'data_generation' / 'Patterns' / 'combos' / 'jumpsuit.json'))
+    parser.add_argument('--samples', '-s', help='number of random samples to save', type=int, default=200)
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_command_args()
+    random.seed(0)
+
+    samples = random_samples(args.template, args.samples)
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        for format_name, spec_options in formats.items():
+            out_folder = os.path.join(tmp_folder, format_name.replace(', ', '_').replace(' ', '_'))
+            bytes_per_sample, write_time, load_time, max_error = benchmark_format(samples, out_folder, spec_options)
+            print('{:<40} {:8.0f} bytes/sample, write {:6.3f} ms/sample, load {:6.3f} ms/sample, max vertex error {:.1e}'.format(
+                format_name, bytes_per_sample, write_time * 1000, load_time * 1000, max_error))
+    finally:
+        shutil.rmtree(tmp_folder)